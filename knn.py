@@ -0,0 +1,332 @@
+import os
+import collections
+import numpy as np
+import pandas as pd
+import pipeline
+import plan
+import spatial
+
+WEIGHTS = ['uniform', 'distance']
+
+class KDTree(object):
+    '''
+    Description:
+    A k-d tree stored in flat arrays: the points are permuted so that every node holds the
+    contiguous range index[start:end], and every node keeps the bounding box of its points.
+    A node is split at the median of its widest dimension until it holds at most leaf_size
+    points.
+
+    Parameters:
+    points:    np.ndarray - (n, d) coordinates, without missing values
+    leaf_size: int        - maximum number of points of a leaf
+    '''
+    def __init__(self, points, leaf_size=40):
+        self.points = np.ascontiguousarray(points, dtype=np.float64)
+        self.leaf_size = max(1, leaf_size)
+        self.index = np.arange(self.points.shape[0])
+        start, end, left, right, dim, split = [0], [self.points.shape[0]], [-1], [-1], [0], [0.0]
+        # node -> (lowest, highest) coordinates of its points
+        boxes = {}
+        stack = [0]
+        while len(stack) > 0:
+            node = stack.pop()
+            s, e = start[node], end[node]
+            rows = self.index[s:e]
+            values = self.points[rows]
+            if e == s:
+                # Only the root of an empty tree
+                boxes[node] = (np.full(self.points.shape[1], np.inf), np.full(self.points.shape[1], -np.inf))
+                continue
+            boxes[node] = (values.min(axis=0), values.max(axis=0))
+            if e - s <= self.leaf_size:
+                continue
+            d = int(np.argmax(boxes[node][1] - boxes[node][0]))
+            m = (e - s) // 2
+            part = np.argpartition(values[:,d], m)
+            self.index[s:e] = rows[part]
+            dim[node] = d
+            split[node] = values[part[m], d]
+            for child_start, child_end in [(s, s + m), (s + m, e)]:
+                start.append(child_start)
+                end.append(child_end)
+                left.append(-1)
+                right.append(-1)
+                dim.append(0)
+                split.append(0.0)
+                stack.append(len(start) - 1)
+            left[node], right[node] = len(start) - 2, len(start) - 1
+        self.start = np.array(start, dtype=np.int64)
+        self.end = np.array(end, dtype=np.int64)
+        self.left = np.array(left, dtype=np.int64)
+        self.right = np.array(right, dtype=np.int64)
+        self.dim = np.array(dim, dtype=np.int64)
+        self.split = np.array(split, dtype=np.float64)
+        self.lo = np.array([boxes[node][0] for node in range(len(start))]).reshape(len(start), self.points.shape[1])
+        self.hi = np.array([boxes[node][1] for node in range(len(start))]).reshape(len(start), self.points.shape[1])
+
+    def __len__(self):
+        return self.points.shape[0]
+
+    def node_of(self, queries, size, k):
+        # The node of at most size points each query falls in, all the queries descending the
+        # tree level by level; a node whose children hold fewer than k points is not descended,
+        # so that the k-th nearest point of the node always bounds the search
+        nodes = np.zeros(len(queries), dtype=np.int64)
+        descend = lambda nodes: ((self.left[nodes] >= 0) & (self.end[nodes] - self.start[nodes] > size)
+                                 & (np.minimum(self.end[self.left[nodes]] - self.start[self.left[nodes]],
+                                               self.end[self.right[nodes]] - self.start[self.right[nodes]]) >= k))
+        active = np.flatnonzero(descend(nodes))
+        while len(active) > 0:
+            current = nodes[active]
+            go_left = queries[active, self.dim[current]] < self.split[current]
+            nodes[active] = np.where(go_left, self.left[current], self.right[current])
+            active = active[descend(nodes[active])]
+        return nodes
+
+    def candidates(self, lo, hi, radius2):
+        # Points of the leaves whose box lies within sqrt(radius2) of the box [lo, hi]
+        nodes = np.zeros(1, dtype=np.int64)
+        leaves = []
+        while len(nodes) > 0:
+            gap = np.maximum(0, np.maximum(self.lo[nodes] - hi, lo - self.hi[nodes]))
+            nodes = nodes[(gap ** 2).sum(axis=1) <= radius2]
+            is_leaf = self.left[nodes] < 0
+            leaves.append(nodes[is_leaf])
+            nodes = np.concatenate([self.left[nodes[~is_leaf]], self.right[nodes[~is_leaf]]])
+        leaves = np.concatenate(leaves)
+        starts = self.start[leaves]
+        lengths = self.end[leaves] - starts
+        # Gather all the ranges at once (see search.ColumnIndex.rows)
+        shifts = starts - np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        return self.index[np.arange(lengths.sum()) + np.repeat(shifts, lengths)]
+
+    def query(self, queries, k=1, group_size=256, batch_size=1024):
+        '''
+        Description:
+        The k nearest points of every query (Euclidean distance), nearest first. The queries
+        are grouped by the node of at most group_size (and at least k) points they fall in; a
+        group is searched at once, in the leaves lying within the distance of the k-th nearest
+        point of its node.
+
+        Parameters:
+        queries:    np.ndarray - (m, d) coordinates
+        k:          int        - number of neighbours (at most the number of points)
+        group_size: int        - number of points of the nodes the queries are grouped by
+        batch_size: int        - maximum number of queries searched at once
+
+        Output:
+        distances:  np.ndarray - (m, k)
+        indices:    np.ndarray - (m, k) positions in points
+        '''
+        queries = np.ascontiguousarray(queries, dtype=np.float64).reshape(-1, self.points.shape[1])
+        k = min(k, len(self))
+        distances = np.zeros((len(queries), k))
+        indices = np.zeros((len(queries), k), dtype=np.int64)
+        if len(queries) == 0 or k == 0:
+            return distances, indices
+        nodes = self.node_of(queries, group_size, k)
+        order = np.argsort(nodes, kind='stable')
+        bounds = np.flatnonzero(np.diff(nodes[order])) + 1
+        for group in np.split(order, bounds):
+            node = nodes[group[0]]
+            own = self.index[self.start[node]:self.end[node]]
+            for batch in range(0, len(group), batch_size):
+                rows = group[batch:batch+batch_size]
+                points = queries[rows]
+                radius2 = np.inf
+                if len(own) >= k:
+                    radius2 = np.partition(self.distances2(points, own), k - 1, axis=1)[:,k-1].max()
+                found = self.candidates(points.min(axis=0), points.max(axis=0), radius2)
+                d2 = self.distances2(points, found)
+                nearest = np.argpartition(d2, k - 1, axis=1)[:,:k] if k < len(found) else np.tile(np.arange(len(found)), (len(rows), 1))
+                nearest_d2 = np.take_along_axis(d2, nearest, axis=1)
+                ranks = np.argsort(nearest_d2, axis=1, kind='stable')
+                distances[rows] = np.sqrt(np.take_along_axis(nearest_d2, ranks, axis=1))
+                indices[rows] = found[np.take_along_axis(nearest, ranks, axis=1)]
+        return distances, indices
+
+    def distances2(self, queries, rows):
+        # Squared distances between the queries and the given points, as a (queries, rows) matrix
+        points = self.points[rows]
+        d2 = (queries ** 2).sum(axis=1)[:,None] + (points ** 2).sum(axis=1)[None,:] - 2 * queries @ points.T
+        return np.maximum(d2, 0)
+
+def default_features(df, categorical=()):
+    '''
+    Description:
+    The columns the distance between rows is taken on: the latitude/longitude columns when
+    there are some, all the complete numerical columns otherwise
+    '''
+    def numerical(j):
+        dtype = df.dtypes.iloc[j]
+        return pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype) and not j in categorical
+    lat_idx, lon_idx = spatial.find_coordinate_columns(df.columns)
+    if lat_idx != None and lon_idx != None and numerical(lat_idx) and numerical(lon_idx):
+        return [lat_idx, lon_idx]
+    complete = ~df.isnull().any().to_numpy()
+    return [j for j in range(df.shape[1]) if numerical(j) and complete[j]]
+
+def feature_matrix(df, features):
+    '''
+    Description:
+    The coordinates of the rows for the distance: latitude/longitude are projected to
+    kilometres (equirectangular, accurate at the scale of a city), the other features are
+    standardized so that no column dominates the distance
+
+    Output:
+    points: np.ndarray - (rows, features), NaN where a feature is missing
+    '''
+    try:
+        points = df.iloc[:, features].to_numpy(dtype=np.float64, na_value=np.nan)
+    except (TypeError, ValueError):
+        raise ValueError("The columns the neighbours are found with should be numerical!")
+    if len(features) == 2 and spatial.find_coordinate_columns([df.columns[j] for j in features]) == (0, 1):
+        lat = np.radians(points[:,0])
+        lon = np.radians(points[:,1])
+        coslat = np.cos(np.nanmean(lat)) if np.isfinite(lat).any() else 1.0
+        return spatial.EARTH_RADIUS_KM * np.stack([lat, lon * coslat], axis=1)
+    with np.errstate(invalid='ignore'):
+        scale = np.nanstd(points, axis=0)
+        scale[~(scale > 0)] = 1.0
+        return (points - np.nanmean(points, axis=0)) / scale
+
+def neighbour_weights(distances, weights):
+    # Uniform, or inversely proportional to the distance; a neighbour at distance 0 takes it all
+    if weights == 'uniform':
+        return np.ones_like(distances)
+    exact = distances == 0
+    with np.errstate(divide='ignore'):
+        inverse = 1 / distances
+    return np.where(exact.any(axis=1)[:,None], exact.astype(np.float64), inverse)
+
+# The tree of a worker process: sent once to every worker, not with every chunk
+worker_tree = None
+
+def init_worker(tree):
+    global worker_tree
+    worker_tree = tree
+
+def query_worker(queries, k):
+    return worker_tree.query(queries, k)
+
+def query_chunks(tree, points, k, chunk_size, workers):
+    '''
+    Description:
+    Generator of the neighbours of the points, chunk by chunk in order. With several chunks
+    and workers, the chunks are queried in worker processes, at most two per worker in
+    flight, so that only a bounded number of chunks of neighbours is ever held.
+
+    Output:
+    (start, distances, indices) of every chunk
+    '''
+    starts = range(0, len(points), chunk_size)
+    workers = os.cpu_count() if workers == None else workers
+    if len(starts) <= 1 or workers <= 1:
+        for start in starts:
+            yield (start,) + tree.query(points[start:start+chunk_size], k)
+        return
+    # 'spawn' does not fork the threads of the interface (see plugin.run_plugin)
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=min(workers, len(starts)), mp_context=context, initializer=init_worker, initargs=(tree,)) as executor:
+        pending = collections.deque()
+        for start in starts:
+            pending.append((start, executor.submit(query_worker, points[start:start+chunk_size], k)))
+            if len(pending) >= 2 * workers:
+                start, future = pending.popleft()
+                yield (start,) + future.result()
+        while len(pending) > 0:
+            start, future = pending.popleft()
+            yield (start,) + future.result()
+
+def knn_impute(df, k=5, weights='uniform', features=None, categorical=(), chunk_size=65536, workers=None, progress=None):
+    '''
+    Description:
+    Nearest-neighbour imputation: the missing values of a column are taken from the k nearest
+    rows having a value for it, the distance being computed on the feature columns (see
+    default_features). A numerical column gets the (weighted) mean of the neighbours, a
+    categorical or text column their (weighted) vote. The columns missing in the same rows are
+    imputed together: a k-d tree is built once over the rows where they are all present, then
+    the rows where they are missing are queried chunk by chunk (see query_chunks). The values
+    still missing, in the feature columns or in rows with missing features, get the built-in
+    'mean' imputation.
+
+    Parameters:
+    df:          pd.DataFrame - the preprocessed data, never modified
+    k:           int          - number of neighbours
+    weights:     str          - one of WEIGHTS
+    features:    list of int  - positions of the feature columns, None for default_features
+    categorical: list of int  - positions of the columns holding class codes
+    chunk_size:  int          - number of rows queried at a time
+    workers:     int          - number of worker processes, None for one per CPU
+    progress:    callable     - progress(done, total), called after every chunk
+
+    Output:
+    df:          pd.DataFrame - the imputed data
+    '''
+    if not weights in WEIGHTS:
+        raise ValueError("Unknown weights '%s'!" % weights)
+    if k < 1:
+        raise ValueError("The number of neighbours should be at least 1!")
+    features = default_features(df, categorical) if features == None else list(features)
+    if len(features) == 0:
+        raise ValueError("There are no complete numerical columns to find the neighbours with!")
+    points = feature_matrix(df, features)
+    isnull = df.isnull()
+    missing = isnull.any().to_numpy() & ~isnull.all().to_numpy()
+    targets = [j for j in np.flatnonzero(missing).tolist() if not j in features]
+    located = ~np.isnan(points).any(axis=1)
+    # Group the target columns missing in the same located rows: one tree per group
+    groups = {}
+    for j in targets:
+        null = isnull.iloc[:, j].to_numpy() & located
+        if null.any():
+            groups.setdefault(np.packbits(null).tobytes(), (null, []))[1].append(j)
+    groups = list(groups.values())
+    total = sum([int(null.sum()) for null, _ in groups])
+    done = 0
+    replaced = {}
+    for null, columns in groups:
+        donors = np.flatnonzero(located & ~null)
+        queries = np.flatnonzero(null)
+        if len(donors) == 0:
+            raise ValueError("The column '%s' has no values in the rows with features to take the neighbours from!" % str(df.columns[columns[0]]))
+        tree = KDTree(points[donors], leaf_size=max(40, 2 * k))
+        # Values of the donors: numbers for the mean, codes for the vote
+        numerical = []
+        donor_values = []
+        for j in columns:
+            dtype = df.dtypes.iloc[j]
+            numerical.append(pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype) and not j in categorical)
+            if numerical[-1]:
+                donor_values.append(df.iloc[donors, j].to_numpy(dtype=np.float64, na_value=np.nan))
+            else:
+                donor_values.append(pd.factorize(df.iloc[donors, j]))
+            if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+                replaced[j] = df.iloc[:, j].to_numpy(dtype=np.float64, na_value=np.nan, copy=True)
+            else:
+                replaced[j] = df.iloc[:, j].to_numpy(dtype=object, copy=True)
+        for start, distances, indices in query_chunks(tree, points[queries], k, chunk_size, workers):
+            rows = queries[start:start+len(indices)]
+            w = neighbour_weights(distances, weights)
+            for t in range(len(columns)):
+                if numerical[t]:
+                    values = donor_values[t][indices]
+                    replaced[columns[t]][rows] = (w * values).sum(axis=1) / w.sum(axis=1)
+                else:
+                    codes, uniques = donor_values[t]
+                    codes = codes[indices]
+                    # Total weight of the neighbours voting as each neighbour; ties go to the nearest
+                    votes = np.einsum('ql,qlj->qj', w, codes[:,:,None] == codes[:,None,:])
+                    best = np.take_along_axis(codes, votes.argmax(axis=1)[:,None], axis=1)[:,0]
+                    replaced[columns[t]][rows] = np.asarray(uniques, dtype=object)[best]
+            if progress != None:
+                progress(done + start + len(indices), total)
+        done += len(queries)
+    for j in replaced:
+        replaced[j] = pd.Series(replaced[j], index=df.index)
+        if replaced[j].dtype == object:
+            replaced[j] = replaced[j].infer_objects()
+    imputed = plan.replace_columns(df, replaced) if len(replaced) > 0 else df
+    return pipeline.impute(imputed, 'mean', 0, categorical)
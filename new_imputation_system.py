@@ -1,152 +1,19 @@
 import sys
 from PySide2.QtWidgets import *
 from PySide2.QtGui import QBrush, QColor, QIcon, QFont, QImage, QPalette, QPixmap, QIntValidator, QDoubleValidator
-from PySide2.QtCore import QThread, Qt, QSize, Signal
+from PySide2.QtCore import QThread, QTimer, Qt, QSize, Signal, QAbstractTableModel, QModelIndex
 import pandas as pd
 import numpy as np
+import knn
 import merge
-
-def merge_two_file(file1, file2, how):
-    '''
-    Description:
-    Merging two files according to the user-specified methods
-    
-    Parameters:
-    file1: str - name of the first file
-    file2: str - name of the second file
-    how:   str - user-specified merge method 
-        *Note*: all files should have their first columns as 'index/id'
-
-        Explanations for different choices of 'how':
-        (1) 'intersection':
-            When merging files, for overlapping features, we only choose the intersected samples
-        (2) 'union': (default)
-            When merging files, we create new samples for those do not overlap with each other
-        (3) 'first'
-            All other files align to the first file, i.e., all samples in the merged file is all  
-            tge samples in the first file. This is commonly used if the first file contains most
-            of the data and following files are used to provide some samll amount of additional info.
-
-    Output:
-    df:    pd.DataFrame - the merged DataFrame for given two files
-    '''
-    if type(file1) == str:
-        # check the file-type first
-        if file1[len(file1) - 4:] == '.csv':
-            df1 = pd.read_csv(file1)
-        elif file1[len(file1) - 5:] == '.xlsx':
-            df1 = pd.read_excel(file1)
-        else:
-            print(file1[len(file1) - 5:])
-            raise ValueError("Invalid input file type!!")
-
-        # Pre-process the DataFrame
-        # (1) Drop the completely empty columns        
-        empty_col1 = np.sum(df1.isnull(), axis=0) == df1.shape[0]
-        empty_col_idx1 = df1.columns[np.array(range(df1.shape[1]))[empty_col1]]
-        df1.drop(empty_col_idx1, axis=1, inplace=True)
-        # (2) Drop the completely empty rows
-        empty_row1 = np.sum(df1.isnull(), axis=1) == df1.shape[1]
-        empty_row_idx1 = df1.index[np.array(range(df1.shape[0]))[empty_row1]]
-        df1.drop(empty_row_idx1, axis=0, inplace=True)
-        # (3) Change the name of the first column
-        first_col_name1 = df1.columns[0]
-        df1.rename(columns={first_col_name1: '__id__'}, inplace=True)
-    elif type(file1) == pd.core.frame.DataFrame:
-        df1 = file1
-    else:
-        raise ValueError("Invalid input file type!!")
-
-    if type(file2) == str:
-        if file2[len(file2) - 4:] == '.csv':
-            df2 = pd.read_csv(file2)
-        elif file2[len(file2) - 5:] == '.xlsx':
-            df2 = pd.read_excel(file2)
-        else:
-            raise ValueError("Invalid input file type")
-
-        empty_col2 = np.sum(df2.isnull(), axis=0) == df2.shape[0]
-        empty_col_idx2 = df2.columns[np.array(range(df2.shape[1]))[empty_col2]]
-        df2.drop(empty_col_idx2, axis=1, inplace=True)
-
-        empty_row2 = np.sum(df2.isnull(), axis=1) == df2.shape[1]
-        empty_row_idx2 = df2.index[np.array(range(df2.shape[0]))[empty_row2]]
-        df2.drop(empty_row_idx2, axis=0, inplace=True)
-        first_col_name2 = df2.columns[0]
-        df2.rename(columns={first_col_name2: '__id__'}, inplace=True)
-    elif type(file2) == pd.core.frame.DataFrame:
-        df2 = file2
-    else:
-        raise ValueError("Invalid input file type!!")
-
-    # Start the merging
-    # Case3: (N1, d1) and (N2, d2) - differnt samples & different features - 'intersection'
-    if how == 'Intersection':
-        df = pd.merge(df1, df2, how='inner')
-    # Case4: (N1, d1) and (N2, d2) - differnt samples & different features - 'union'
-    elif how == 'Union':
-        df = pd.merge(df1, df2, how='outer')
-    # Case5: (N1, d1) and (N2, d2) - differnt samples & different features - 'first'
-    elif how == 'First':
-        df = pd.merge(df1, df2, 'left')
-    else:
-        raise ValueError("The parameter how is invalid")
-    return df
-
-def merge_files(files, how='union'):
-    '''
-    Description:
-    Merging a list of input files according to the user-specified methods
-    
-    Parameters:
-    files: list of str - list of all input strings to be merged
-    how:   str         - user-specified merge method 
-        
-    Output:
-    df:    pd.DataFrame - the merged DataFrame for all given files
-    '''
-    if len(files) == 0:
-        return 0
-    if len(files) == 1:
-        return merge_two_file(files[0], files[0], how=how)
-    df = merge_two_file(files[0], files[1], how)
-    for i in range(2, len(files)):
-        df = merge_two_file(df, files[i], how)
-    return df
-
-def is_text(item):
-    try:
-        float(item)
-        return False
-    except:
-        return True
-
-def error_detection(df):
-    '''
-    Description:
-    Given a panda dataframe, detect all possible errors according to *datatype* in each column
-    
-    Parameter:
-    df:         pd.DataFrame - Input dataframe to be detected
-
-    Output:
-    col_idx:    list of column indices, which contain errors
-    row_idx:    list of list of row indices
-    '''
-    col_idx = []
-    row_idx = []
-    num_sample, num_feature = df.shape
-    for j in range(num_feature):
-        feature_istext = np.array(df.iloc[:,j].map(lambda x : is_text(x)))
-        num_text = np.sum(feature_istext)
-        if num_sample == 0:
-            break
-        if num_text/num_sample >= 0.05:
-            continue
-        else:
-            col_idx.append(j)
-            row_idx.append(np.argwhere(feature_istext))
-    return col_idx, row_idx
+import plan
+import pipeline
+import plugin
+import selection
+import search
+import spatial
+import stats
+import timeindex
 
 class TitleWidget(QWidget):
     def __init__(self):
@@ -403,35 +270,7 @@ class DataPreviewWidget(QWidget):
         # Load the file into DataFrame first
         df = merge.FilePreprocess(filename)
         # ============================DATA PREVIEW TABLE===========================
-        self.datapreview_table = QTableWidget()
-        num_row, num_col = df.shape
-        num_row = min(100, num_row)
-        all_num_row = max(num_row, 30)
-        all_num_col = max(num_col, 15)
-        self.datapreview_table.setColumnCount(all_num_col)
-        self.datapreview_table.setRowCount(all_num_row)
-        self.datapreview_table.setHorizontalHeaderLabels(list(df.columns))
-        self.datapreview_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
-        for i in range(num_row):
-            for j in range(num_col):
-                cur_item = str(df.iat[i,j])
-                if cur_item == 'nan':
-                    empty_item = QTableWidgetItem()
-                    empty_item.setBackground(QBrush(QColor(201,252,255)))
-                    self.datapreview_table.setItem(i, j, empty_item)
-                    continue
-                self.datapreview_table.setItem(i, j, QTableWidgetItem(cur_item))    
-        tablefont = QFont()
-        tablefont.setPointSize(11)
-        self.datapreview_table.setFont(tablefont)
-        self.datapreview_table.horizontalHeader().setFont(tablefont)
-        self.datapreview_table.resizeColumnsToContents() 
-        self.datapreview_table.setAlternatingRowColors(True)
-        self.datapreview_table.setStyleSheet('''
-            QTableWidget{
-                alternate-background-color:#f9f9f9;
-            }
-        ''')
+        self.datapreview_table = DataFrameView(DataFrameModel(df.iloc[:100]))
         # =============================DELETE BUTTON===============================
         self.filedelete_button = FileDeleteButton(idx)
         note = QLabel("Note: Preview mode only displays the first 100 lines for large files.")
@@ -604,17 +443,8 @@ class MergeFileThread(QThread):
         for i in range(len(self.filenames)):
             if self.file_validflag[i]:
                 valid_files.append(self.filenames[i])
-        if len(valid_files) == 1:
-            self.df = merge.FilePreprocess(valid_files[0])
-            self.TwoFileMerge.emit(1,1)
-        else:
-            self.TwoFileMerge.emit(0, len(valid_files))
-            self.df, RealCol = merge.MergeTwoFile(valid_files[0], valid_files[1], None)
-            self.TwoFileMerge.emit(2, len(valid_files))
-            for i in range(2, len(valid_files)):
-                self.df, RealCol = merge.MergeTwoFile(self.df, valid_files[i], RealCol)
-                self.TwoFileMerge.emit(i+1, len(valid_files))
-        ErrorColIdx, ErrorRowIdx = error_detection(self.df)
+        self.df = pipeline.merge_smart(valid_files, self.TwoFileMerge.emit)
+        ErrorColIdx, ErrorRowIdx = pipeline.error_detection(self.df)
         self.TwoFileMerge.emit(len(valid_files)+1, len(valid_files))
         self.MergeFileFinish.emit(self.df, self.previous_pagenum, ErrorColIdx, ErrorRowIdx)
 
@@ -626,25 +456,15 @@ class TransformThread(QThread):
         self.features = features
         self.col_idx = col_idx
     def run(self):
-        TotalLength = len(self.features)
-        TenPercentCounter = 1
-        TransformDict = {}
-        ClassType = 0
-        for i in range(TotalLength):
-            if str(self.features[i]) == 'nan':
-                pass
-            elif not self.features[i] in TransformDict:
-                TransformDict[self.features[i]] = ClassType
-                ClassType += 1
-            if (i+5) == int(TotalLength * TenPercentCounter / 10): ##############PROBLEM HERE###############
-                self.TenPercent.emit(TenPercentCounter)
-                TenPercentCounter += 1
+        self.TenPercent.emit(1)
+        TransformDict = pipeline.build_transform_dict(self.features)
+        self.TenPercent.emit(10)
         self.TransformFinish.emit(TransformDict, self.col_idx)
 
 class SelectionThread(QThread):
     TenPercent = Signal(int)
-    SelectionFinish = Signal(np.ndarray, np.ndarray, int)
-    def __init__(self, features, SelectionMethod, SelectionRangeDown, SelectionRangeUp, SelectionCondition, SelectionValue, SelectionIndex, col_idx):
+    SelectionFinish = Signal(np.ndarray, int)
+    def __init__(self, features, SelectionMethod, SelectionRangeDown, SelectionRangeUp, SelectionCondition, SelectionValue, col_idx):
         super(SelectionThread, self).__init__()
         self.features = features
         self.SelectionMethod = SelectionMethod
@@ -652,266 +472,670 @@ class SelectionThread(QThread):
         self.SelectionRangeUp = SelectionRangeUp
         self.SelectionCondition = SelectionCondition
         self.SelectionValue = SelectionValue
-        self.SelectionIndex = SelectionIndex
         self.col_idx = col_idx
     def run(self):
-        TotalLength = len(self.features)
-        TenPercentCounter = 1
-        SelectedIndicator = np.array([False]*TotalLength)
-        if self.SelectionMethod == 'Range':
-            if self.SelectionRangeDown == None:
-                self.SelectionRangeDown = -float('inf')
-            if self.SelectionRangeUp == None:
-                self.SelectionRangeUp = float('inf')
-            for i in range(TotalLength):
-                try:
-                    if str(self.features[i]) == 'nan':
-                        SelectedIndicator[i] = True
-                    else:
-                        if float(self.features[i]) >= self.SelectionRangeDown and float(self.features[i]) <= self.SelectionRangeUp:
-                            SelectedIndicator[i] = True
-                        else:
-                            SelectedIndicator[i] = False
-                except:
-                    SelectedIndicator[i] = False
-                if (i+5) == int(TotalLength*TenPercentCounter/9):
-                    self.TenPercent.emit(TenPercentCounter)
-                    TenPercentCounter += 1
-        elif self.SelectionMethod == 'Condition':
-            if self.SelectionCondition == 0: # Equal
-                for i in range(TotalLength):
-                    try:
-                        if float(self.features[i]) == float(self.SelectionValue) or str(self.features[i]) == 'nan':
-                            SelectedIndicator[i] = True
-                        else:
-                            SelectedIndicator[i] = False
-                    except:
-                        SelectedIndicator[i] = (str(self.SelectionValue) == str(self.features[i]) or str(self.features[i]) == 'nan')
-                    if (i+5) == int(TotalLength*TenPercentCounter/9):
-                        self.TenPercent.emit(TenPercentCounter)
-                        TenPercentCounter += 1
-            elif self.SelectionCondition == 1: # Not Equal
-                for i in range(TotalLength):
-                    try:
-                        if float(self.features[i]) != float(self.SelectionValue) or str(self.features[i]) == 'nan':
-                            SelectedIndicator[i] = True
-                        else:
-                            SelectedIndicator[i] = False
-                    except:
-                        SelectedIndicator[i] = (str(self.SelectionValue) != str(self.features[i]) or str(self.features[i]) == 'nan')
-                    if (i+5) == int(TotalLength*TenPercentCounter/9):
-                        self.TenPercent.emit(TenPercentCounter)
-                        TenPercentCounter += 1
-            elif self.SelectionCondition == 2: # Greater Than
-                for i in range(TotalLength):
-                    try:
-                        if str(self.features[i]) == 'nan':
-                            SelectedIndicator[i] = True
-                        else:
-                            if float(self.features[i]) > self.SelectionValue:
-                                SelectedIndicator[i] = True
-                            else:
-                                SelectedIndicator[i] = False
-                    except:
-                        SelectedIndicator[i] = False
-                    if (i+5) == int(TotalLength*TenPercentCounter/9):
-                        self.TenPercent.emit(TenPercentCounter)
-                        TenPercentCounter += 1
-            elif self.SelectionCondition == 3: # Greater/Equal
-                for i in range(TotalLength):
-                    try:
-                        if str(self.features[i]) == 'nan':
-                            SelectedIndicator[i] = True
-                        else:
-                            if float(self.features[i]) >= self.SelectionValue:
-                                SelectedIndicator[i] = True
-                            else:
-                                SelectedIndicator[i] = False
-                    except:
-                        SelectedIndicator[i] = False
-                    if (i+5) == int(TotalLength*TenPercentCounter/9):
-                        self.TenPercent.emit(TenPercentCounter)
-                        TenPercentCounter += 1
-            elif self.SelectionCondition == 4: # Smaller Than
-                for i in range(TotalLength):
-                    try:
-                        if str(self.features[i]) == 'nan':
-                            SelectedIndicator[i] = True
-                        else:
-                            if float(self.features[i]) < self.SelectionValue:
-                                SelectedIndicator[i] = True
-                            else:
-                                SelectedIndicator[i] = False
-                    except:
-                        SelectedIndicator[i] = False
-                    if (i+5) == int(TotalLength*TenPercentCounter/9):
-                        self.TenPercent.emit(TenPercentCounter)
-                        TenPercentCounter += 1
-            elif self.SelectionCondition == 5: # Smaller/Equal
-                for i in range(TotalLength):
-                    try:
-                        if str(self.features[i]) == 'nan':
-                            SelectedIndicator[i] = True
-                        else:
-                            if float(self.features[i]) <= self.SelectionValue:
-                                SelectedIndicator[i] = True
-                            else:
-                                SelectedIndicator[i] = False
-                    except:
-                        SelectedIndicator[i] = False
-                    if (i+5) == int(TotalLength*TenPercentCounter/9):
-                        self.TenPercent.emit(TenPercentCounter)
-                        TenPercentCounter += 1
-            elif self.SelectionCondition == 6: # Start with
-                for i in range(TotalLength):
-                    if str(self.features[i]) == 'nan':
-                        SelectedIndicator[i] = True
-                    else: 
-                        if len(str(self.SelectionValue)) > len(str(self.features[i])):
-                            SelectedIndicator[i] = False
-                        else:
-                            SelectedIndicator[i] = str(self.features[i])[:len(str(self.SelectionValue))] == str(self.SelectionValue)
-                    if (i+5) == int(TotalLength*TenPercentCounter/9):
-                        self.TenPercent.emit(TenPercentCounter)
-                        TenPercentCounter += 1
-            elif self.SelectionCondition == 7: # Not Start with
-                for i in range(TotalLength):
-                    if str(self.features[i]) == 'nan':
-                        SelectedIndicator[i] = True
-                    else: 
-                        if len(str(self.SelectionValue)) > len(str(self.features[i])):
-                            SelectedIndicator[i] = True
-                        else:
-                            SelectedIndicator[i] = str(self.features[i])[:len(str(self.SelectionValue))] != str(self.SelectionValue)
-                    if (i+5) == int(TotalLength*TenPercentCounter/9):
-                        self.TenPercent.emit(TenPercentCounter)
-                        TenPercentCounter += 1
-            elif self.SelectionCondition == 8: # End with
-                for i in range(TotalLength):
-                    if str(self.features[i]) == 'nan':
-                        SelectedIndicator[i] = True
-                    else:
-                        if len(str(self.SelectionValue)) > len(str(self.features[i])):
-                            SelectedIndicator[i] = False
-                        else:
-                            SelectedIndicator[i] = str(self.features[i])[len(str(self.features[i]))-len(str(self.SelectionValue)):] == str(self.SelectionValue)
-                    if (i+5) == int(TotalLength*TenPercentCounter/9):
-                        self.TenPercent.emit(TenPercentCounter)
-                        TenPercentCounter += 1
-            elif self.SelectionCondition == 9: # Not End with
-                for i in range(TotalLength):
-                    if str(self.features[i]) == 'nan':
-                        SelectedIndicator[i] = True
-                    else:
-                        if len(str(self.SelectionValue)) > len(str(self.features[i])):
-                            SelectedIndicator[i] = True
-                        else:
-                            SelectedIndicator[i] = str(self.features[i])[len(str(self.features[i]))-len(str(self.SelectionValue)):] != str(self.SelectionValue)
-                    if (i+5) == int(TotalLength*TenPercentCounter/9):
-                        self.TenPercent.emit(TenPercentCounter)
-                        TenPercentCounter += 1
-            elif self.SelectionCondition == 10: # Contain
-                for i in range(TotalLength):
-                    SelectedIndicator[i] = (str(self.SelectionValue) in str(self.features[i]) or str(self.features[i]) == 'nan')
-                    if (i+5) == int(TotalLength*TenPercentCounter/9):
-                        self.TenPercent.emit(TenPercentCounter)
-                        TenPercentCounter += 1
-            elif self.SelectionCondition == 11: # Not contain
-                for i in range(TotalLength):
-                    SelectedIndicator[i] = (not (str(self.SelectionValue) in str(self.features[i]))) or str(self.features[i]) == 'nan'
-                    if (i+5) == int(TotalLength*TenPercentCounter/9):
-                        self.TenPercent.emit(TenPercentCounter)
-                        TenPercentCounter += 1
-        NewSelectionIndex = np.argwhere(SelectedIndicator)
-        NewSelectionIndex = np.intersect1d(NewSelectionIndex, self.SelectionIndex, assume_unique=True)
+        self.TenPercent.emit(1)
+        SelectedIndicator = pipeline.select_rows(self.features, self.SelectionMethod, self.SelectionRangeDown, self.SelectionRangeUp, self.SelectionCondition, self.SelectionValue)
+        # Only the rejected rows are handed back, the SelectionState keeps the rest
+        RejectedRows = np.flatnonzero(~SelectedIndicator)
+        self.TenPercent.emit(10)
+        self.SelectionFinish.emit(RejectedRows, self.col_idx)
+
+class QueryThread(QThread):
+    TenPercent = Signal(int)
+    QueryFinish = Signal(np.ndarray, str)
+    def __init__(self, df, query, QueryText, FeatureDeleteFlag, CategoricalFlag, CategoricalTransformDict, SelectionIndex):
+        super(QueryThread, self).__init__()
+        self.df = df
+        self.query = query
+        self.QueryText = QueryText
+        self.CategoricalFlag = CategoricalFlag[:]
+        self.CategoricalTransformDict = CategoricalTransformDict[:]
+        self.SelectionIndex = SelectionIndex
+        # Names of the remaining columns only (compile_query rejects the ambiguous ones)
+        self.ColumnIndex = dict([(str(df.columns[i]), i) for i in range(len(FeatureDeleteFlag)) if FeatureDeleteFlag[i] == False])
+    def run(self):
+        self.TenPercent.emit(1)
+        # Only the currently selected rows are candidates, so only those can be rejected
+        mask = selection.evaluate_query(self.query, self.GetColumn, self.SelectionIndex)
+        RejectedRows = np.asarray(self.SelectionIndex).reshape(-1,)[~mask]
         self.TenPercent.emit(10)
-        self.SelectionFinish.emit(SelectedIndicator, NewSelectionIndex, self.col_idx)
+        self.QueryFinish.emit(RejectedRows, self.QueryText)
+
+    def GetColumn(self, name, rows):
+        i = self.ColumnIndex[name]
+        feature = self.df.iloc[rows, i]
+        if self.CategoricalFlag[i]:
+            feature = pd.Series(plan.transform_to_categorical(feature, self.CategoricalTransformDict[i]), index=feature.index)
+        return feature
+
+class SpatialSelectionThread(QThread):
+    TenPercent = Signal(int)
+    SpatialFinish = Signal(np.ndarray, tuple)
+    def __init__(self, SpatialIndex, latitude, longitude, SpatialMethod, SpatialArgs, SelectionIndex):
+        super(SpatialSelectionThread, self).__init__()
+        self.SpatialIndex = SpatialIndex
+        self.latitude = latitude
+        self.longitude = longitude
+        self.SpatialMethod = SpatialMethod
+        self.SpatialArgs = SpatialArgs
+        self.SelectionIndex = SelectionIndex
+    def run(self):
+        self.TenPercent.emit(1)
+        # The grid index is built lazily, on the first spatial selection
+        if self.SpatialIndex == None:
+            lat = pd.to_numeric(self.latitude, errors='coerce')
+            lon = pd.to_numeric(self.longitude, errors='coerce')
+            self.SpatialIndex = spatial.GridIndex(lat, lon)
+        self.TenPercent.emit(5)
+        if self.SpatialMethod == 'Box':
+            InsideRows = self.SpatialIndex.query_box(*self.SpatialArgs)
+        else:
+            InsideRows = self.SpatialIndex.query_radius(*self.SpatialArgs)
+        # Rows with missing coordinates are kept, as in the other selections
+        Inside = ~self.SpatialIndex.valid
+        Inside[InsideRows] = True
+        RejectedRows = self.SelectionIndex[~Inside[self.SelectionIndex]]
+        self.TenPercent.emit(10)
+        self.SpatialFinish.emit(RejectedRows, (self.SpatialMethod, tuple(self.SpatialArgs)))
+
+class TimeSelectionThread(QThread):
+    TenPercent = Signal(int)
+    TimeFinish = Signal(np.ndarray, tuple)
+    def __init__(self, DatetimeColumn, feature, TimeFormat, TimeArgs, SelectionIndex):
+        super(TimeSelectionThread, self).__init__()
+        self.DatetimeColumn = DatetimeColumn
+        self.feature = feature
+        self.TimeFormat = TimeFormat
+        self.TimeArgs = TimeArgs
+        self.SelectionIndex = SelectionIndex
+    def run(self):
+        self.TenPercent.emit(1)
+        # The column is parsed only once, on its first time selection
+        if self.DatetimeColumn == None:
+            self.DatetimeColumn = timeindex.DatetimeColumn(self.feature, self.TimeFormat)
+        self.TenPercent.emit(5)
+        InsideRows = self.DatetimeColumn.query(*self.TimeArgs)
+        # Missing values are kept, as in the other selections
+        Inside = self.DatetimeColumn.missing.copy()
+        Inside[InsideRows] = True
+        RejectedRows = self.SelectionIndex[~Inside[self.SelectionIndex]]
+        self.TenPercent.emit(10)
+        self.TimeFinish.emit(RejectedRows, tuple(self.TimeArgs))
+
+class SelectionPreviewThread(QThread):
+    PreviewFinish = Signal(int, int, int)
+    def __init__(self, generation, df, query, ColumnViewCache, DatetimeColumns, FeatureDeleteFlag, CategoricalFlag, CategoricalTransformDict, SelectionIndex):
+        super(SelectionPreviewThread, self).__init__()
+        self.generation = generation
+        self.df = df
+        self.query = query
+        self.ColumnViewCache = ColumnViewCache
+        self.DatetimeColumns = DatetimeColumns
+        # Copies: the GUI thread changes the flags while a preview may still be running
+        self.CategoricalFlag = CategoricalFlag[:]
+        self.CategoricalTransformDict = CategoricalTransformDict[:]
+        self.SelectionIndex = SelectionIndex
+        # Names of the remaining columns only (compile_query rejects the ambiguous ones)
+        self.ColumnIndex = dict([(str(df.columns[i]), i) for i in range(len(FeatureDeleteFlag)) if FeatureDeleteFlag[i] == False])
+        self.cancelled = False
+    def run(self):
+        NumKept = selection.count_query(self.query, self.GetColumn, self.SelectionIndex, cancelled=lambda: self.cancelled, get_datetime=self.GetDatetime)
+        if NumKept == None:
+            return
+        self.PreviewFinish.emit(self.generation, NumKept, len(self.SelectionIndex) - NumKept)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def GetColumn(self, name, rows):
+        # The (transformed) columns are cached across previews, each with the TransformDict it
+        # was built with: a view built by a preview started before a transform/undo/redo is
+        # never used with the new transform
+        i = self.ColumnIndex[name]
+        TransformDict = self.CategoricalTransformDict[i] if self.CategoricalFlag[i] else None
+        entry = self.ColumnViewCache.get(i)
+        if entry == None or entry[0] is not TransformDict:
+            feature = self.df.iloc[:,i]
+            if TransformDict != None:
+                feature = pd.Series(plan.transform_to_categorical(feature, TransformDict), index=feature.index)
+            # A single assignment of the whole entry, so concurrent previews never see half of one
+            entry = (TransformDict, feature)
+            self.ColumnViewCache[i] = entry
+        return entry[1].iloc[rows]
+
+    def GetDatetime(self, name, fmt):
+        # Shared with the time selections: a column is parsed once, not on every preview/chunk
+        i = self.ColumnIndex[name]
+        DatetimeColumn = self.DatetimeColumns.get(i)
+        if DatetimeColumn == None or DatetimeColumn.format != fmt:
+            DatetimeColumn = timeindex.DatetimeColumn(self.df.iloc[:,i], fmt)
+            self.DatetimeColumns[i] = DatetimeColumn
+        return DatetimeColumn
+
+class ProfileThread(QThread):
+    ProfileFinish = Signal(int, object)
+    def __init__(self, ColumnProfiler, col_idx, SelectionIndex):
+        super(ProfileThread, self).__init__()
+        self.ColumnProfiler = ColumnProfiler
+        self.col_idx = col_idx
+        self.SelectionIndex = SelectionIndex
+    def run(self):
+        # Only the blocks cut by the selection are profiled again, the others are merged
+        profile = self.ColumnProfiler.profile(self.SelectionIndex)
+        self.ProfileFinish.emit(self.col_idx, profile.summary())
+
+class AnalysisThread(QThread):
+    ThirdProgress = Signal(int)
+    AnalysisFinish = Signal(int, object, object, object)
+    def __init__(self, df, FeatureDeleteFlag, CategoricalFlag, CategoricalTransformDict, SelectionIndex, version, preprocessed=None):
+        super(AnalysisThread, self).__init__()
+        self.df = df
+        self.plan = plan.build_plan(FeatureDeleteFlag, CategoricalFlag, CategoricalTransformDict, SelectionIndex)
+        self.version = version
+        self.preprocessed = preprocessed
+    def run(self):
+        self.ThirdProgress.emit(1)
+        if self.preprocessed is None:
+            self.preprocessed = plan.execute_plan(self.df, plan.optimize_plan(self.plan, self.df.shape[1]))
+        self.ThirdProgress.emit(2)
+        correlation, comissing = stats.pairwise_statistics(self.preprocessed)
+        self.ThirdProgress.emit(3)
+        self.AnalysisFinish.emit(self.version, self.preprocessed, correlation, comissing)
+
+class SearchThread(QThread):
+    SearchFinish = Signal(object, object)
+    def __init__(self, SearchIndex, text, columns, transforms, rows, key):
+        super(SearchThread, self).__init__()
+        self.SearchIndex = SearchIndex
+        self.text = text
+        self.columns = columns[:]
+        self.transforms = dict(transforms)
+        self.rows = rows
+        self.key = key
+    def run(self):
+        # The inverted indexes of the columns are built on their first search, and kept
+        if self.text == None:
+            self.SearchIndex.build(self.columns)
+            return
+        cells = self.SearchIndex.search(self.text, self.columns, self.transforms, self.rows)
+        self.SearchFinish.emit(self.key, cells)
+
+class SortThread(QThread):
+    def __init__(self, SortIndex, col_idx, descending, TransformDict):
+        super(SortThread, self).__init__()
+        self.SortIndex = SortIndex
+        self.col_idx = col_idx
+        self.descending = descending
+        self.TransformDict = TransformDict
+    def run(self):
+        # The permutation is cached in SortIndex, the view then reads the selection off it
+        self.SortIndex.order(self.col_idx, self.descending, self.TransformDict)
 
 class DownloadThread(QThread):
     ThirdProgress = Signal(int)
-    DownloadFinish = Signal(pd.DataFrame, str)
+    # Frames are passed as plain Python objects, i.e. by reference
+    PreprocessFinish = Signal(object)
+    DownloadFinish = Signal(object, str)
     def __init__(self, df, FeatureDeleteFlag, CategoricalFlag, CategoricalTransformDict, SelectionIndex, savefile):
         super(DownloadThread, self).__init__()    
-        self.df = df.copy()
-        self.FeatureDeleteFlag = FeatureDeleteFlag
-        self.CategoricalFlag = CategoricalFlag
-        self.CategoricalTransformDict = CategoricalTransformDict
-        self.SelectionIndex = SelectionIndex
+        self.df = df
+        self.plan = plan.build_plan(FeatureDeleteFlag, CategoricalFlag, CategoricalTransformDict, SelectionIndex)
         self.savefile = savefile
     def run(self):
-        # First: Transform
-        for i in range(len(self.FeatureDeleteFlag)):
-            if self.CategoricalFlag[i]:
-                self.df.iloc[:,i] = self.df.iloc[:,i].map(lambda x:self.TransformToCategorical(x, i))
+        # Deleted columns are pruned and the selected rows pushed down before transforming
+        scan = plan.optimize_plan(self.plan, self.df.shape[1])
         self.ThirdProgress.emit(1)
-        # Second: Delete Columns/Features
-        DeleteCols = np.argwhere(np.array(self.FeatureDeleteFlag)).reshape(-1,)
-        self.df = self.df.drop(columns=self.df.columns[DeleteCols], axis=1)
-        self.ThirdProgress.emit(2)
-        # Third: Delete Rows/Samples
-        self.df = self.df.loc[self.SelectionIndex,:]
+        self.df = plan.execute_plan(self.df, scan)
+        self.PreprocessFinish.emit(self.df)
         self.ThirdProgress.emit(3)
         self.DownloadFinish.emit(self.df, self.savefile)
-        
-    def TransformToCategorical(self, x, i):
-        if str(x) == 'nan':
-            return np.nan
-        else:
-            return self.CategoricalTransformDict[i][x]
 
 class ImputationThread(QThread):
     Progress = Signal(int, int)
-    ImputationFinish = Signal(pd.DataFrame, pd.DataFrame)
-    def __init__(self, df, FeatureDeleteFlag, CategoricalFlag, CategoricalTransformDict, SelectionIndex):
+    PreprocessFinish = Signal(object)
+    ImputationFinish = Signal(object, object)
+    def __init__(self, ImputationCache, FeatureDeleteFlag, CategoricalFlag, CategoricalTransformDict, SelectionIndex, SelectionKey, imputer='mean', fill_value=0):
         super(ImputationThread, self).__init__()    
-        self.df = df.copy()
-        self.FeatureDeleteFlag = FeatureDeleteFlag
-        self.CategoricalFlag = CategoricalFlag
-        self.CategoricalTransformDict = CategoricalTransformDict
+        self.ImputationCache = ImputationCache
+        self.imputer = imputer
+        self.fill_value = fill_value
+        self.FeatureDeleteFlag = FeatureDeleteFlag[:]
+        self.CategoricalFlag = CategoricalFlag[:]
+        self.CategoricalTransformDict = CategoricalTransformDict[:]
         self.SelectionIndex = SelectionIndex
+        self.SelectionKey = SelectionKey
     
     def run(self):
-        # ====================OBTAIN THE PREPROCESSED DATA=====================
-        # First: Transform
-        for i in range(len(self.FeatureDeleteFlag)):
-            if self.CategoricalFlag[i]:
-                self.df.iloc[:,i] = self.df.iloc[:,i].map(lambda x:self.TransformToCategorical(x, i))
         self.Progress.emit(1, 4)
-        # Second: Delete Columns/Features
-        DeleteCols = np.argwhere(np.array(self.FeatureDeleteFlag)).reshape(-1,)
-        self.df = self.df.drop(columns=self.df.columns[DeleteCols], axis=1)
-        self.Progress.emit(2, 4)
-        # Third: Delete Rows/Samples
-        self.df = self.df.loc[self.SelectionIndex,:]
-        self.dfisnull = self.df.isnull()
-        self.Progress.emit(3, 4)
-        # ======================START THE IMPUTATION===========================
-        for column in list(self.df.columns[self.df.isnull().sum() > 0]):
-            try:
-                mean_val = self.df[column].mean()
-                self.df[column].fillna(mean_val, inplace=True)
-            except:
-                self.df[column].fillna(method='pad', axis=0, inplace=True)
+        # Only the columns/rows affected by the Page 3 changes since the last imputation are
+        # recomputed, the other imputed columns are reused from the cache
+        self.Preprocessed, self.df, self.dfisnull, _ = self.ImputationCache.impute(self.FeatureDeleteFlag, self.CategoricalFlag,
+                                                                                 self.CategoricalTransformDict, self.SelectionIndex, self.SelectionKey,
+                                                                                 self.imputer, self.fill_value)
+        self.PreprocessFinish.emit(self.Preprocessed)
         self.Progress.emit(4, 4)
         self.ImputationFinish.emit(self.df, self.dfisnull)
-    
-    def TransformToCategorical(self, x, i):
-        if str(x) == 'nan':
-            return np.nan
+
+class PluginImputationThread(QThread):
+    Progress = Signal(int, int)
+    PreprocessFinish = Signal(object)
+    ImputationFinish = Signal(object, object)
+    ImputationFailed = Signal(str)
+    ImputationCancelled = Signal()
+    def __init__(self, df, FeatureDeleteFlag, CategoricalFlag, CategoricalTransformDict, SelectionIndex, AlgorithmFile, ParameterFile, preprocessed=None):
+        super(PluginImputationThread, self).__init__()
+        self.cancelled = False
+        self.df = df
+        self.plan = plan.build_plan(FeatureDeleteFlag, CategoricalFlag, CategoricalTransformDict, SelectionIndex)
+        self.AlgorithmFile = AlgorithmFile
+        self.ParameterFile = ParameterFile
+        self.preprocessed = preprocessed
+
+    def run(self):
+        self.Progress.emit(1, 100)
+        if self.preprocessed is None:
+            self.preprocessed = plan.execute_plan(self.df, plan.optimize_plan(self.plan, self.df.shape[1]))
+        self.PreprocessFinish.emit(self.preprocessed)
+        self.Progress.emit(2, 100)
+        # The uploaded algorithm runs in a worker process, with a timeout and a memory limit
+        try:
+            imputed = plugin.run_plugin(self.preprocessed, self.AlgorithmFile, self.ParameterFile, plugin.DEFAULT_TIMEOUT,
+                                        plugin.default_memory_limit(), self.PluginProgress, lambda: self.cancelled)
+        except ValueError as e:
+            self.ImputationFailed.emit(str(e))
+            return
+        if imputed is None:
+            self.ImputationCancelled.emit()
+            return
+        self.Progress.emit(100, 100)
+        self.ImputationFinish.emit(imputed, self.preprocessed.isnull())
+
+    def PluginProgress(self, done, total):
+        if total > 0:
+            self.Progress.emit(min(99, 2 + int(97 * done / total)), 100)
+
+    def cancel(self):
+        # The worker process is killed by run_plugin at its next check
+        self.cancelled = True
+
+class KNNImputationThread(QThread):
+    Progress = Signal(int, int)
+    PreprocessFinish = Signal(object)
+    ImputationFinish = Signal(object, object)
+    ImputationFailed = Signal(str)
+    def __init__(self, df, FeatureDeleteFlag, CategoricalFlag, CategoricalTransformDict, SelectionIndex, k, weights, preprocessed=None):
+        super(KNNImputationThread, self).__init__()
+        self.df = df
+        self.plan = plan.build_plan(FeatureDeleteFlag, CategoricalFlag, CategoricalTransformDict, SelectionIndex)
+        # Positions of the transformed columns in the preprocessed frame: their codes are voted
+        kept = [i for i in range(len(FeatureDeleteFlag)) if FeatureDeleteFlag[i] == False]
+        self.categorical = [j for j in range(len(kept)) if CategoricalFlag[kept[j]]]
+        self.k = k
+        self.weights = weights
+        self.preprocessed = preprocessed
+
+    def run(self):
+        self.Progress.emit(1, 100)
+        if self.preprocessed is None:
+            self.preprocessed = plan.execute_plan(self.df, plan.optimize_plan(self.plan, self.df.shape[1]))
+        self.PreprocessFinish.emit(self.preprocessed)
+        self.Progress.emit(2, 100)
+        # The incomplete rows are queried chunk by chunk in worker processes, see knn.knn_impute
+        try:
+            imputed = knn.knn_impute(self.preprocessed, self.k, self.weights, None, self.categorical, progress=self.KNNProgress)
+        except ValueError as e:
+            self.ImputationFailed.emit(str(e))
+            return
+        self.Progress.emit(100, 100)
+        self.ImputationFinish.emit(imputed, self.preprocessed.isnull())
+
+    def KNNProgress(self, done, total):
+        if total > 0:
+            self.Progress.emit(min(99, 2 + int(97 * done / total)), 100)
+
+def SearchBox(widget):
+    '''
+    Description:
+    Add the full-table search box of Page 3/Page 5 to widget: SearchLE holds the text to find
+    (Enter jumps to the next match) and SearchResultLE the position of the current match
+    '''
+    widget.SearchLE = QLineEdit()
+    widget.SearchLE.setPlaceholderText("Search")
+    widget.SearchLE.setStyleSheet('''
+            *{
+                font: 28px "Microsoft YaHei UI";
+                margin: 10px;
+                border: 2px solid #A0A0A0;
+                border-radius: 8px;
+                width: 220px;
+            }
+        ''')
+    widget.SearchResultLE = QLabel("")
+    widget.SearchResultLE.setStyleSheet('''
+            *{
+                font: 28px "Microsoft YaHei UI";
+                margin-right: 30px;
+            }
+        ''')
+    # The matches of the last search, valid while the text and the displayed table are unchanged
+    widget.SearchKey = None
+    widget.SearchCells = None
+    widget.SearchPosition = -1
+    widget.SearchThread = None
+    widget.PendingSearch = None
+    # The column the table is sorted by (clicking a header sorts by it, again reverses it)
+    widget.SortColumn = None
+    widget.SortDescending = False
+    widget.SortThread = None
+
+def RedoButtonStyle(color):
+    return '''
+            QPushButton{
+                font: 28px "Microsoft YaHei UI";
+                border: none;
+                background-color: none;
+                color: %s;
+                qproperty-icon:url(fig/redo.png);
+                qproperty-iconSize:29px 29px;
+                margin-left: 20px;
+                width: 120px;
+            }
+            QPushButton:hover{
+                font: bold 28px "Microsoft YaHei UI";
+                border: none;
+                background-color: none;
+                color: %s;
+                qproperty-icon:url(fig/redo.png);
+                qproperty-iconSize:29px 29px;
+                margin-left: 20px;
+            }
+        ''' % (color, color)
+
+def RenderBlock(df, isnull, rows, columns, transforms, ErrorRows):
+    '''
+    Description:
+    Format a block of rows of the displayed table, one column at a time
+
+    Parameters:
+    df:         pd.DataFrame - the data
+    isnull:     pd.DataFrame - cells highlighted as missing, None for the missing values of df
+    rows:       np.ndarray   - positions of the rows of the block in df
+    columns:    list of int  - positions of the columns to render
+    transforms: dict         - col_idx -> TransformDict applied on display
+    ErrorRows:  dict         - col_idx -> positions of the erroneous rows
+
+    Output:
+    block:      dict         - col_idx -> (texts, missing flags, error flags) of the block rows
+    '''
+    block = {}
+    for j in columns:
+        values = df.iloc[rows, j]
+        missing = np.asarray(values.isnull() if isnull is None else isnull.iloc[rows, j], dtype=bool)
+        # Each distinct value is transformed and formatted once; missing values (code -1) show empty
+        codes, uniques = pd.factorize(values)
+        if j in transforms:
+            uniques = [transforms[j][value] for value in uniques]
+        texts = [str(value) for value in uniques]
+        texts = np.array(['' if text == 'nan' else text for text in texts] + [''], dtype=object)[codes]
+        errors = np.isin(rows, ErrorRows[j]) if j in ErrorRows else np.zeros(len(rows), dtype=bool)
+        block[j] = (texts, missing, errors)
+    return block
+
+class BlockPrefetchThread(QThread):
+    BlockFinish = Signal(int, int, object)
+    def __init__(self, df, isnull, tasks, columns, transforms, ErrorRows, generation):
+        super(BlockPrefetchThread, self).__init__()
+        self.df = df
+        self.isnull = isnull
+        self.tasks = tasks
+        self.columns = columns[:]
+        self.transforms = dict(transforms)
+        self.ErrorRows = ErrorRows
+        self.generation = generation
+    def run(self):
+        # The frames are never modified in place (see DataFrameModel.setValue), reading them
+        # here while the view paints is safe
+        for b, rows in self.tasks:
+            self.BlockFinish.emit(self.generation, b, RenderBlock(self.df, self.isnull, rows, self.columns, self.transforms, self.ErrorRows))
+
+class DataFrameModel(QAbstractTableModel):
+    '''
+    Description:
+    Virtualized table model over a DataFrame: the view only asks for the cells it paints, which
+    are formatted by blocks of rows kept in an LRU cache. The blocks around the visible rows are
+    rendered ahead in a background thread, so that scrolling and jumping back and forth are instant.
+
+    Parameters:
+    df:         pd.DataFrame - the data, displayed through the row/column view set by setView
+    isnull:     pd.DataFrame - cells highlighted as missing, None to highlight the missing values of df
+    ErrorRows:  dict         - col_idx -> positions of the rows highlighted as errors
+    MaxBlocks:  int          - number of cached blocks
+    '''
+    BlockSize = 100
+    def __init__(self, df, isnull=None, ErrorRows=None, MaxBlocks=50):
+        super(DataFrameModel, self).__init__()
+        self.df = df
+        self.isnull = isnull
+        self.ErrorRows = ErrorRows if ErrorRows != None else {}
+        self.rows = None
+        self.columns = list(range(df.shape[1]))
+        self.transforms = {}
+        self.MaxBlocks = MaxBlocks
+        # block number -> {col_idx: rendered column}, least recently used first
+        self.BlockCache = {}
+        # Bumped whenever cached blocks are dropped, so that stale prefetches are discarded
+        self.generation = 0
+        self.PrefetchThread = None
+        self.PendingPrefetch = None
+        # col_idx -> (TransformDict, width), see ResizeColumns
+        self.ColumnWidths = {}
+        self.MissingBrush = QBrush(QColor(201,252,255))
+        self.ErrorBrush = QBrush(QColor(255, 79, 66, 150))
+
+    def setView(self, rows=None, columns=None, transforms=None):
+        '''
+        rows: positions of the displayed rows (None for all), columns: positions of the displayed
+        columns (None for all), transforms: col_idx -> TransformDict applied on display.
+        Only the cached columns a change affects are dropped: a new row selection drops all the
+        blocks, a new transform drops its column and deleting columns drops nothing.
+        '''
+        transforms = {} if transforms == None else transforms
+        if rows is not self.rows:
+            self.BlockCache = {}
+            self.generation += 1
         else:
-            return self.CategoricalTransformDict[i][x]
+            changed = [j for j in set(self.transforms) | set(transforms) if self.transforms.get(j) is not transforms.get(j)]
+            if len(changed) > 0:
+                for block in self.BlockCache.values():
+                    for j in changed:
+                        block.pop(j, None)
+                self.generation += 1
+        self.beginResetModel()
+        self.rows = rows
+        self.columns = list(range(self.df.shape[1])) if columns is None else list(columns)
+        self.transforms = transforms
+        self.endResetModel()
+        self.prefetch(0)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.df.shape[0] if self.rows is None else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.columns)
+
+    def position(self, row, col):
+        return (row if self.rows is None else self.rows[row]), self.columns[col]
+
+    def value(self, i, j):
+        value = self.df.iat[i, j]
+        if j in self.transforms and str(value) != 'nan':
+            value = self.transforms[j][value]
+        return value
+
+    def BlockRows(self, b):
+        rows = np.arange(b * self.BlockSize, min((b+1) * self.BlockSize, self.rowCount()))
+        return rows if self.rows is None else np.asarray(self.rows)[rows]
+
+    def block(self, b):
+        block = self.BlockCache.pop(b, None)
+        if block is None:
+            block = {}
+        self.BlockCache[b] = block
+        while len(self.BlockCache) > self.MaxBlocks:
+            self.BlockCache.pop(next(iter(self.BlockCache)))
+        return block
+
+    def cell(self, row, col):
+        b, r = divmod(row, self.BlockSize)
+        j = self.columns[col]
+        block = self.block(b)
+        if j not in block:
+            # Not prefetched yet: render this column of the block right away
+            block.update(RenderBlock(self.df, self.isnull, self.BlockRows(b), [j], self.transforms, self.ErrorRows))
+        texts, missing, errors = block[j]
+        return texts[r], missing[r], errors[r]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return self.cell(index.row(), index.column())[0]
+        elif role == Qt.BackgroundRole:
+            _, missing, error = self.cell(index.row(), index.column())
+            if missing:
+                return self.MissingBrush
+            if error:
+                return self.ErrorBrush
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return str(self.df.columns[self.columns[section]])
+        return str(section+1)
+
+    def prefetch(self, row, ahead=2):
+        '''
+        Render in the background the block of row, the previous one and the ahead next ones,
+        for those not fully cached yet
+        '''
+        if self.PrefetchThread != None and self.PrefetchThread.isRunning():
+            self.PendingPrefetch = row
+            return
+        self.PendingPrefetch = None
+        b = row // self.BlockSize
+        num_block = (self.rowCount() + self.BlockSize - 1) // self.BlockSize
+        tasks = []
+        for nb in range(max(0, b-1), min(num_block, b+ahead+1)):
+            block = self.BlockCache.get(nb, {})
+            if any([j not in block for j in self.columns]):
+                tasks.append((nb, self.BlockRows(nb)))
+        if len(tasks) == 0:
+            return
+        self.PrefetchThread = BlockPrefetchThread(self.df, self.isnull, tasks, self.columns, self.transforms, self.ErrorRows, self.generation)
+        self.PrefetchThread.BlockFinish.connect(self.StoreBlock)
+        self.PrefetchThread.finished.connect(self.PrefetchFinish)
+        self.PrefetchThread.start()
+
+    def StoreBlock(self, generation, b, rendered):
+        if generation == self.generation:
+            self.block(b).update(rendered)
+
+    def PrefetchFinish(self):
+        if self.PendingPrefetch != None:
+            self.prefetch(self.PendingPrefetch)
+
+    def setValue(self, row, col, value, missing):
+        # Copy-on-write: impute_df and dfisnull share their buffers with the imputation cache
+        i, j = self.position(row, col)
+        self.df = plan.set_value(self.df, i, j, value)
+        if self.isnull is not None:
+            self.isnull = plan.set_value(self.isnull, i, j, missing)
+        self.BlockCache.get(row // self.BlockSize, {}).pop(j, None)
+        self.generation += 1
+        index = self.index(row, col)
+        self.dataChanged.emit(index, index)
+
+def DataFrameView(model):
+    '''
+    Description:
+    The table of Page 3/Page 5: a QTableView over a DataFrameModel, with fixed row heights so
+    that the view never measures the rows it does not paint
+    '''
+    view = QTableView()
+    view.setModel(model)
+    view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+    view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+    view.verticalHeader().setDefaultSectionSize(30)
+    tablefont = QFont()
+    tablefont.setPointSize(11)
+    view.setFont(tablefont)
+    view.horizontalHeader().setFont(tablefont)
+    ResizeColumns(view)
+    # Keep the blocks around the visible rows rendered ahead
+    view.verticalScrollBar().valueChanged.connect(lambda value: model.prefetch(max(0, view.rowAt(0))))
+    model.prefetch(0)
+    view.setContextMenuPolicy(Qt.CustomContextMenu)
+    view.setAlternatingRowColors(True)
+    view.setStyleSheet('''
+        QTableView{
+            alternate-background-color:#f9f9f9;
+        }
+    ''')
+    return view
+
+def SampleTextLength(values, TransformDict=None, num_sample=200, max_length=60):
+    '''
+    Description:
+    Estimate the displayed text length of a column from an evenly spread sample of its values
+
+    Output:
+    length: int - number of characters, at most max_length
+    '''
+    if len(values) == 0:
+        return 0
+    sample = values.iloc[np.linspace(0, len(values) - 1, min(num_sample, len(values))).astype(int)]
+    codes, uniques = pd.factorize(sample)
+    if TransformDict != None:
+        uniques = [TransformDict[value] for value in uniques]
+    if len(uniques) == 0:
+        return 0
+    return min(max_length, max([len(str(value)) for value in uniques]))
+
+def ResizeColumns(view):
+    '''
+    Description:
+    Set the column widths of a DataFrameModel view from the estimated text lengths, instead of
+    measuring every cell as resizeColumnsToContents does. The estimate of a column is cached in
+    the model until the column is displayed differently (transformed).
+    '''
+    model = view.model()
+    char_width = view.fontMetrics().averageCharWidth()
+    header_metrics = view.horizontalHeader().fontMetrics()
+    for k, j in enumerate(model.columns):
+        TransformDict = model.transforms.get(j)
+        cached = model.ColumnWidths.get(j)
+        if cached == None or cached[0] is not TransformDict:
+            length = SampleTextLength(model.df.iloc[:,j], TransformDict)
+            width = max(header_metrics.horizontalAdvance(model.headerData(k, Qt.Horizontal)), length * char_width)
+            cached = (TransformDict, width + 20)
+            model.ColumnWidths[j] = cached
+        view.setColumnWidth(k, cached[1])
 
 class Page3_Widget(QWidget):
-    def __init__(self, df, ErrorColIdx, ErrorRowIdx):
+    def __init__(self, df, ErrorColIdx, ErrorRowIdx, MissingStats):
         super(Page3_Widget, self).__init__()
-        self.initUI(df, ErrorColIdx, ErrorRowIdx)
-    def initUI(self, df, ErrorColIdx, ErrorRowIdx):
+        self.initUI(df, ErrorColIdx, ErrorRowIdx, MissingStats)
+    def initUI(self, df, ErrorColIdx, ErrorRowIdx, MissingStats):
         num_row, num_col = df.shape
         self.num_col = num_col
-        if num_row == 0:
-            self.MissingRate = 0
-        else:
-            self.MissingRate = 100 * df.isnull().sum().sum() / (num_row * num_col)
+        self.MissingRate, _, _ = MissingStats.summary([False] * num_col)
         # ==================================TOOL MENU===============================
         self.MissingRateLE = QLabel("Missing Rate: %f%%" %self.MissingRate)
         self.MissingRateLE.setStyleSheet('''
@@ -934,7 +1158,7 @@ class Page3_Widget(QWidget):
             }
         ''')  
 
-        GoToLineLE = QLabel("Go To Page")
+        GoToLineLE = QLabel("Go To Row")
         GoToLineLE.setStyleSheet('''
             *{
                 font: 28px "Microsoft YaHei UI";
@@ -952,12 +1176,13 @@ class Page3_Widget(QWidget):
                 width: 80px;
             }
         ''')
-        self.TotalNumLine = QLabel("/%i" %(int(num_row/100)+1))
+        self.TotalNumLine = QLabel("/%i" %num_row)
         self.TotalNumLine.setStyleSheet('''
             *{
                 font: 28px "Microsoft YaHei UI";
             }
         ''')
+        SearchBox(self)
         self.UndoButton = QPushButton(" Undo")
         self.UndoButton.setStyleSheet('''
             QPushButton{
@@ -981,6 +1206,9 @@ class Page3_Widget(QWidget):
             }
         ''')
         self.UndoButton.setEnabled(False)
+        self.RedoButton = QPushButton(" Redo")
+        self.RedoButton.setStyleSheet(RedoButtonStyle('#bfbfbf'))
+        self.RedoButton.setEnabled(False)
         self.DownloadButton = QPushButton(" Download")
         self.DownloadButton.setStyleSheet('''
             QPushButton{
@@ -1003,53 +1231,72 @@ class Page3_Widget(QWidget):
         ''')
         # self.DownloadButton.setMaximumWidth(130)
         # self.DownloadButton.setMinimumWidth(130)        
+        self.AnalysisButton = QPushButton(" Analysis")
+        self.AnalysisButton.setToolTip("Correlations and co-missingness of the preprocessed columns")
+        self.AnalysisButton.setStyleSheet('''
+            QPushButton{
+                font: 28px "Microsoft YaHei UI";
+                border: none;
+                background-color: none;
+                color: #3B8BB9;
+                qproperty-icon:url(fig/analysis.png);
+                qproperty-iconSize:29px 29px;
+                width: 180px;
+            }
+            QPushButton:hover{
+                font: bold 28px "Microsoft YaHei UI";
+                border: none;
+                background-color: none;
+                color: #3B8BB9;
+                qproperty-icon:url(fig/analysis.png);
+                qproperty-iconSize:29px 29px;
+            }
+        ''')
+        self.RecipeButton = QPushButton(" Recipe")
+        self.RecipeButton.setToolTip("Export the preprocessing steps as a recipe file")
+        self.RecipeButton.setStyleSheet('''
+            QPushButton{
+                font: 28px "Microsoft YaHei UI";
+                border: none;
+                background-color: none;
+                color: #3B8BB9;
+                qproperty-icon:url(fig/folder.png);
+                qproperty-iconSize:29px 29px;
+                width: 180px;
+            }
+            QPushButton:hover{
+                font: bold 28px "Microsoft YaHei UI";
+                border: none;
+                background-color: none;
+                color: #3B8BB9;
+                qproperty-icon:url(fig/folder.png);
+                qproperty-iconSize:29px 29px;
+            }
+        ''')
 
         layout = QHBoxLayout()
         layout.addWidget(self.MissingRateLE, 0)
         layout.addWidget(self.SampleNumLE, 0)
         layout.addWidget(self.FeatureNumLE, 0)
         layout.addWidget(QLabel(), 1)
+        layout.addWidget(self.SearchLE, 0)
+        layout.addWidget(self.SearchResultLE, 0)
         layout.addWidget(GoToLineLE, 0)
         layout.addWidget(self.InputLineNumber, 0)
         layout.addWidget(self.TotalNumLine, 0)
         layout.addWidget(self.UndoButton, 0)
+        layout.addWidget(self.RedoButton, 0)
+        layout.addWidget(self.AnalysisButton,0)
+        layout.addWidget(self.RecipeButton,0)
         layout.addWidget(self.DownloadButton,0)
         layout.setSpacing(0)
 
         # ===============================MAIN WINDOW================================
-        self.MainWindow = QTableWidget()
-        display_num_row = min(100, num_row)
-        self.MainWindow.setRowCount(max(30, display_num_row))
-        self.MainWindow.setColumnCount(max(15, num_col))
-        self.MainWindow.setEditTriggers(QAbstractItemView.NoEditTriggers)
-        self.MainWindow.setHorizontalHeaderLabels(list(df.columns))
-        for i in range(display_num_row):
-            for j in range(num_col):
-                CurItem = str(df.iat[i, j])
-                if CurItem == 'nan':
-                    EmptyTableItem = QTableWidgetItem()
-                    EmptyTableItem.setBackground(QBrush(QColor(201,252,255)))
-                    self.MainWindow.setItem(i, j, EmptyTableItem)
-                    continue
-                elif j in ErrorColIdx:
-                    if [i] in ErrorRowIdx[ErrorColIdx.index(j)]:
-                        ErrorTableItem = QTableWidgetItem(CurItem)
-                        ErrorTableItem.setBackground(QBrush(QColor(255, 79, 66, 150)))
-                        self.MainWindow.setItem(i, j, ErrorTableItem)
-                        continue
-                self.MainWindow.setItem(i, j, QTableWidgetItem(CurItem))
-        tablefont = QFont()
-        tablefont.setPointSize(11)
-        self.MainWindow.setFont(tablefont)
-        self.MainWindow.horizontalHeader().setFont(tablefont)
-        self.MainWindow.resizeColumnsToContents()
-        self.MainWindow.setContextMenuPolicy(Qt.CustomContextMenu)
-        self.MainWindow.setAlternatingRowColors(True)
-        self.MainWindow.setStyleSheet('''
-            QTableWidget{
-                alternate-background-color:#f9f9f9;
-            }
-        ''')
+        ErrorRows = {}
+        for j, rows in zip(ErrorColIdx, ErrorRowIdx):
+            ErrorRows[j] = np.asarray(rows).reshape(-1,)
+        self.model = DataFrameModel(df, ErrorRows=ErrorRows)
+        self.MainWindow = DataFrameView(self.model)
         # =============================BACK-NEXT BUTTON===============================
         nextbutton_layout = QHBoxLayout()
         self.PreprocessProgressLE = QLabel("Preprocess: ")
@@ -1181,7 +1428,7 @@ class SelectionDialog(QDialog):
         # ===============LAYOUT 5===================
         layout5 = QHBoxLayout()
         self.SelectionMethodComboBox = QComboBox()
-        self.SelectionMethodComboBox.addItems(['Equal', 'Not Equal', 'Greater than', 'Greater/Equal', 'Smaller than', 'Smaller/Equal', 'Start with', 'Not Start With', 'End with', 'Not End with', 'Contain', 'Not Contain'])
+        self.SelectionMethodComboBox.addItems(selection.CONDITIONS)
         self.ValueLE = QLineEdit()
         self.SelectionMethodComboBox.setEnabled(False)
         self.ValueLE.setEnabled(False)
@@ -1191,6 +1438,73 @@ class SelectionDialog(QDialog):
         layout5.addWidget(self.ValueLE)
         layout5.addWidget(placeholder, 1)
 
+        # ===============LAYOUT 7===================
+        layout7 = QHBoxLayout()
+        self.SelectButton3 = QRadioButton("Query Selection")
+        self.SelectButton3.setProperty('name','in')
+        layout7.addWidget(self.SelectButton3, 0)
+        layout7.addWidget(placeholder, 1)
+
+        # ===============LAYOUT 8===================
+        layout8 = QHBoxLayout()
+        self.QueryLE = QLineEdit()
+        self.QueryLE.setPlaceholderText('e.g. district == 3 and grid between 1000 and 1200 and crimedescr contains "BURGLARY"')
+        self.QueryLE.setEnabled(False)
+        self.QueryLE.setProperty('name','in')
+        self.QueryLE.setMinimumWidth(900)
+        layout8.addWidget(self.QueryLE)
+
+        # ===============LAYOUT 10==================
+        layout10 = QHBoxLayout()
+        self.SelectButton4 = QRadioButton("Spatial Selection")
+        self.SelectButton4.setProperty('name','in')
+        layout10.addWidget(self.SelectButton4, 0)
+        layout10.addWidget(placeholder, 1)
+
+        # ===============LAYOUT 11==================
+        layout11 = QHBoxLayout()
+        self.SpatialMethodComboBox = QComboBox()
+        self.SpatialMethodComboBox.addItems(['Bounding box', 'Radius around point'])
+        self.SpatialMethodComboBox.setEnabled(False)
+        self.SpatialMethodComboBox.setProperty('name','in')
+        layout11.addWidget(self.SpatialMethodComboBox)
+        self.SpatialLEs = []
+        for text in ["Min latitude", "Max latitude", "Min longitude", "Max longitude"]:
+            SpatialLE = QLineEdit()
+            SpatialLE.setPlaceholderText(text)
+            SpatialLE.setValidator(doubleval)
+            SpatialLE.setEnabled(False)
+            SpatialLE.setProperty('name','in')
+            self.SpatialLEs.append(SpatialLE)
+            layout11.addWidget(SpatialLE)
+        layout11.addWidget(placeholder, 1)
+
+        # ===============LAYOUT 12==================
+        layout12 = QHBoxLayout()
+        self.SelectButton5 = QRadioButton("Time Selection")
+        self.SelectButton5.setProperty('name','in')
+        layout12.addWidget(self.SelectButton5, 0)
+        layout12.addWidget(placeholder, 1)
+
+        # ===============LAYOUT 13==================
+        layout13 = QHBoxLayout()
+        self.TimeLEs = []
+        for text in ["From, e.g. 1/1/2006", "To, e.g. 1/31/2006 18:00", "Hours, e.g. 8-17", "Days, e.g. Mon-Fri"]:
+            TimeLE = QLineEdit()
+            TimeLE.setPlaceholderText(text)
+            TimeLE.setEnabled(False)
+            TimeLE.setProperty('name','in')
+            self.TimeLEs.append(TimeLE)
+            layout13.addWidget(TimeLE)
+        layout13.addWidget(placeholder, 1)
+
+        # ===============LAYOUT 9===================
+        layout9 = QHBoxLayout()
+        self.PreviewLE = QLabel()
+        self.PreviewLE.setProperty('name','in')
+        layout9.addWidget(self.PreviewLE, 0)
+        layout9.addWidget(QLabel(), 1)
+
         # ===============LAYOUT 6===================
         layout6 = QHBoxLayout()
         self.OKButton = QPushButton("OK")
@@ -1208,6 +1522,13 @@ class SelectionDialog(QDialog):
         layout.addLayout(layout3)
         layout.addLayout(layout4)
         layout.addLayout(layout5)
+        layout.addLayout(layout7)
+        layout.addLayout(layout8)
+        layout.addLayout(layout10)
+        layout.addLayout(layout11)
+        layout.addLayout(layout12)
+        layout.addLayout(layout13)
+        layout.addLayout(layout9)
         layout.addLayout(layout6)
         self.setStyleSheet('''
             *[name='in']{
@@ -1313,11 +1634,131 @@ class RewriteDialog(QDialog):
         OverallLayout.addLayout(hlayout3)
         self.setLayout(OverallLayout)
         
+class ProfileDialog(QDialog):
+    def __init__(self, name, summary):
+        super(ProfileDialog, self).__init__()
+        self.initUI(name, summary)
+
+    def initUI(self, name, summary):
+        self.setWindowTitle("Column Profile: " + name)
+        self.setWindowFlags(Qt.WindowCloseButtonHint)
+        lines = ["Rows: %i" %summary['rows'],
+                 "Missing Share: %f%%" %summary['missing'],
+                 "Distinct Values (approx.): %i" %summary['distinct'],
+                 "",
+                 "Top Values (counts are lower bounds):"]
+        for value, count in summary['top']:
+            lines.append("    %s: %i" %(str(value), count))
+        if 'quantiles' in summary:
+            lines.append("")
+            lines.append("Quantiles (approx.):")
+            for q, value in summary['quantiles'].items():
+                lines.append("    %3i%%: %g" %(int(100*q), value))
+            counts, edges = summary['histogram']
+            if len(counts) > 0:
+                lines.append("")
+                lines.append("Histogram (approx.):")
+                for i in range(len(counts)):
+                    bar = '#' * int(round(40 * counts[i] / max(1, counts.max())))
+                    lines.append("    [%10.4g, %10.4g]  %-40s %i" %(edges[i], edges[i+1], bar, counts[i]))
+        ProfileLE = QLabel("\n".join(lines))
+        ProfileLE.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        ProfileLE.setStyleSheet('font: 18px "Consolas";')
+        self.OKButton = QPushButton("OK")
+        self.OKButton.setProperty('name', 'profile_confirm')
+        self.OKButton.clicked.connect(self.close)
+        self.setStyleSheet('''
+            QPushButton[name='profile_confirm']{
+                background-color: #326aa9;
+                font: 25px "Microsoft YaHei UI";
+                color: white;
+                border: none;
+                border-radius: 10px;
+                height: 50px;
+                width: 125px;
+                margin: 15px;
+            }
+            QPushButton:hover[name='profile_confirm']{
+                background-color: #457fbf;
+                font: bold 25px "Microsoft YaHei UI";
+                color: white;
+                border: white;
+                border-radius: 10px;
+                height: 50px;
+                width: 125px;
+            }
+        ''')
+        hlayout = QHBoxLayout()
+        hlayout.addWidget(QLabel(), 1)
+        hlayout.addWidget(self.OKButton, 0)
+        hlayout.addWidget(QLabel(), 1)
+        OverallLayout = QVBoxLayout()
+        OverallLayout.addWidget(ProfileLE)
+        OverallLayout.addLayout(hlayout)
+        self.setLayout(OverallLayout)
+
+class AnalysisDialog(QDialog):
+    def __init__(self, correlation, comissing):
+        super(AnalysisDialog, self).__init__()
+        self.initUI(correlation, comissing)
+
+    def initUI(self, correlation, comissing):
+        self.setWindowTitle("Feature Analysis")
+        self.setWindowFlags(Qt.WindowCloseButtonHint | Qt.WindowMaximizeButtonHint)
+        self.resize(1200, 800)
+        tabs = QTabWidget()
+        tabs.setStyleSheet('font: 20px "Microsoft YaHei UI";')
+        # Both matrices are displayed by the same virtualized model as the data, the first
+        # column holding the row names
+        self.CorrelationView = DataFrameView(DataFrameModel(self.MatrixFrame(correlation.round(3))))
+        self.ComissingView = DataFrameView(DataFrameModel(self.MatrixFrame(comissing)))
+        tabs.addTab(self.CorrelationView, "Correlation (numerical columns)")
+        tabs.addTab(self.ComissingView, "Co-missingness (rows missing in both)")
+        OverallLayout = QVBoxLayout()
+        OverallLayout.addWidget(tabs)
+        self.setLayout(OverallLayout)
+
+    def MatrixFrame(self, matrix):
+        frame = matrix.copy()
+        frame.insert(0, ' ', [str(name) for name in matrix.index])
+        return frame
+
 class Page4_Widget(QWidget):
     def __init__(self):
         super(Page4_Widget, self).__init__()
         self.initUI()
     def initUI(self): 
+        # ===========================IMPUTER SELECT============================
+        # The uploaded algorithm (None), one of the built-in imputers of pipeline.IMPUTERS, or
+        # the nearest-neighbour imputer with its number of neighbours and weights
+        self.Imputers = [None] + [name for name in pipeline.IMPUTERS if name != 'none'] + ['knn']
+        ImputerLayout = QHBoxLayout()
+        ImputerLabel = QLabel("Imputer: ")
+        ImputerLabel.setStyleSheet('''
+            *{
+                font: 37px "Microsoft YaHei UI";
+                color: #666666;
+            }
+        ''')
+        self.ImputerComboBox = QComboBox()
+        self.ImputerComboBox.addItems(["Uploaded Algorithm"] + ["KNN" if name == 'knn' else name.replace('_', ' ').title() for name in self.Imputers[1:]])
+        self.FillValueLE = QLineEdit("0")
+        self.FillValueLE.setPlaceholderText("Constant")
+        self.FillValueLE.setEnabled(False)
+        self.NeighborsLE = QLineEdit("5")
+        self.NeighborsLE.setPlaceholderText("Neighbours")
+        self.NeighborsLE.setValidator(QIntValidator(1, 1000))
+        self.NeighborsLE.setEnabled(False)
+        self.WeightsComboBox = QComboBox()
+        self.WeightsComboBox.addItems([name.title() for name in knn.WEIGHTS])
+        self.WeightsComboBox.setEnabled(False)
+        ImputerLayout.addWidget(QLabel(), 1)
+        ImputerLayout.addWidget(ImputerLabel, 0)
+        ImputerLayout.addWidget(self.ImputerComboBox, 0)
+        ImputerLayout.addWidget(self.FillValueLE, 0)
+        ImputerLayout.addWidget(self.NeighborsLE, 0)
+        ImputerLayout.addWidget(self.WeightsComboBox, 0)
+        ImputerLayout.addWidget(QLabel(), 1)
         # ==========================ALGORITHM UPLOAD===========================
         # (1) Row1: Title
         AlgLabelLayout = QHBoxLayout()
@@ -1476,15 +1917,34 @@ class Page4_Widget(QWidget):
         self.back_button.setProperty('name','next_back_button')       
         self.next_button = QPushButton("Next")
         self.next_button.setProperty('name','next_back_button')
+        # Stops a running imputation algorithm (shown while it runs)
+        self.StopButton = QPushButton("Stop")
+        self.StopButton.setProperty('name','next_back_button')
         nextbutton_layout.addWidget(self.ImputeProgressLE, 0)
         nextbutton_layout.addWidget(self.progressbar, 0)
+        nextbutton_layout.addWidget(self.StopButton, 0)
         nextbutton_layout.addWidget(QLabel(), 1)
         nextbutton_layout.addWidget(self.back_button, 0)
         nextbutton_layout.addWidget(self.next_button, 0)  
         self.ImputeProgressLE.hide()
         self.progressbar.hide()  
+        self.StopButton.hide()
         # ============================OVERALL LAYOUT============================
         self.setStyleSheet('''
+            QComboBox{
+                font: 30px "Microsoft YaHei UI";
+                border: 2px solid #A0A0A0;
+                border-radius: 8px;
+                height: 50px;
+                width: 300px;
+            }
+            QLineEdit{
+                font: 30px "Microsoft YaHei UI";
+                border: 2px solid #A0A0A0;
+                border-radius: 8px;
+                height: 50px;
+                width: 200px;
+            }
             QPushButton[name='upload_button']{
                 background-color: #326AA9;
                 font: 37px "Microsoft YaHei UI";
@@ -1531,6 +1991,7 @@ class Page4_Widget(QWidget):
         placeholder = QLabel()
         placeholder.setMaximumHeight(30)
         placeholder.setMinimumHeight(30)
+        OverallLayout.addLayout(ImputerLayout)
         OverallLayout.addLayout(AlgLayout)
         OverallLayout.addLayout(ParLayout)
         OverallLayout.addWidget(placeholder)
@@ -1544,7 +2005,7 @@ class Page5_Widget(QWidget):
     def initUI(self, impute_df, dfisnull):
         num_row, num_col = impute_df.shape
         # ==============================TOOL MENU============================
-        GoToLineLE= QLabel("Go To Page")
+        GoToLineLE= QLabel("Go To Row")
         GoToLineLE.setStyleSheet('''
             *{
                 font: 28px "Microsoft YaHei UI";
@@ -1562,12 +2023,13 @@ class Page5_Widget(QWidget):
                 width: 80px;
             }
         ''')
-        self.TotalNumLine = QLabel("/%i" %(int(num_row/100)+1))
+        self.TotalNumLine = QLabel("/%i" %num_row)
         self.TotalNumLine.setStyleSheet('''
             *{
                 font: 28px "Microsoft YaHei UI";
             }
         ''')
+        SearchBox(self)
         self.RedoButton = QPushButton(" Re-impute")
         self.RedoButton.setStyleSheet('''
             QPushButton{
@@ -1614,36 +2076,16 @@ class Page5_Widget(QWidget):
         ''')
         ToolMenuLayout = QHBoxLayout()
         ToolMenuLayout.addWidget(QLabel(), 1)
+        ToolMenuLayout.addWidget(self.SearchLE, 0)
+        ToolMenuLayout.addWidget(self.SearchResultLE, 0)
         ToolMenuLayout.addWidget(GoToLineLE, 0)
         ToolMenuLayout.addWidget(self.InputLineNumber, 0)
         ToolMenuLayout.addWidget(self.TotalNumLine, 0)
         # ToolMenuLayout.addWidget(self.RedoButton, 0)
         ToolMenuLayout.addWidget(self.DownloadButton, 0)
         # =============================MAIN WINDOW=============================
-        self.MainWindow = QTableWidget()
-        display_num_row = min(100, num_row)
-        self.MainWindow.setRowCount(max(30, display_num_row))
-        self.MainWindow.setColumnCount(max(15, num_col))
-        self.MainWindow.setEditTriggers(QAbstractItemView.NoEditTriggers)
-        self.MainWindow.setHorizontalHeaderLabels(list(impute_df.columns))
-        for i in range(display_num_row):
-            for j in range(num_col):
-                CurItem = QTableWidgetItem(str(impute_df.iat[i, j]))
-                if dfisnull.iat[i, j]:
-                    CurItem.setBackground(QBrush(QColor(201,252,255)))
-                self.MainWindow.setItem(i, j, CurItem)
-        tablefont = QFont()
-        tablefont.setPointSize(11)
-        self.MainWindow.setFont(tablefont)
-        self.MainWindow.horizontalHeader().setFont(tablefont)
-        self.MainWindow.resizeColumnsToContents()
-        self.MainWindow.setContextMenuPolicy(Qt.CustomContextMenu)
-        self.MainWindow.setAlternatingRowColors(True)
-        self.MainWindow.setStyleSheet('''
-            QTableWidget{
-                alternate-background-color:#f9f9f9;
-            }
-        ''')
+        self.model = DataFrameModel(impute_df, isnull=dfisnull)
+        self.MainWindow = DataFrameView(self.model)
         # ===============================BACK BUTTON============================
         backbutton_layout = QHBoxLayout()
         ImputationProcessLE = QLabel("Imputation Process: ")
@@ -2085,6 +2527,11 @@ class Imputation_System(QWidget):
             self.Overall_Layout.addWidget(self.Page4_Widget)
             self.Page4_Widget.AlgUploadButton.clicked.connect(self.Page4UploadAlg)
             self.Page4_Widget.ParUploadButton.clicked.connect(self.Page4UploadPar)
+            self.Page4_Widget.StopButton.clicked.connect(self.Page4StopImputation)
+            self.Page4_Widget.ImputerComboBox.currentIndexChanged.connect(self.Page4ChangeImputer)
+            self.Page4_Widget.FillValueLE.textEdited.connect(self.Page4ChangeImputer)
+            self.Page4_Widget.NeighborsLE.textEdited.connect(self.Page4ChangeImputer)
+            self.Page4_Widget.WeightsComboBox.currentIndexChanged.connect(self.Page4ChangeImputer)
             self.Page4_Widget.back_button.clicked.connect(self.GOTO_Page3)
             self.Page4_Widget.next_button.clicked.connect(self.GOTO_Page5)
             
@@ -2108,12 +2555,17 @@ class Imputation_System(QWidget):
 
     def GOTO_Page5(self):
         # This part only applies when jumping from page4: when no algorithm/parameter file are uploaded
-        if self.AlgorithmFile == None:
+        # (only needed without a built-in imputer)
+        imputer = self.Page4Imputer()
+        if imputer == None and self.AlgorithmFile == None:
             QMessageBox.information(self, "No File Uploaded", "There are no algorithm file uploaded. Please upload one.", QMessageBox.Yes, QMessageBox.Yes)
             return 
-        if self.ParameterFile == None:
+        if imputer == None and self.ParameterFile == None:
             QMessageBox.information(self, "No File Uploaded", "There are no parameter file uploaded. Please upload one.", QMessageBox.Yes, QMessageBox.Yes)
             return 
+        if imputer == 'knn' and not self.Page4_Widget.NeighborsLE.hasAcceptableInput():
+            QMessageBox.critical(self, "Input Error", "Please input the number of neighbours!", QMessageBox.Yes, QMessageBox.Yes)
+            return
         
         # Check whether jump from elsewhere
         if self.pagenum == 5:
@@ -2125,7 +2577,24 @@ class Imputation_System(QWidget):
         # Check whether page5 has already been initialized
         if self.page5_init == False:
             self.page5_init = True
-            self.page5_ImputationThread = ImputationThread(self.df, self.FeatureDeleteFlag, self.CategoricalFlag, self.CategoricalTransformDict, self.SelectionIndex)
+            if imputer == 'knn':
+                self.page5_ImputationThread = KNNImputationThread(self.df, self.FeatureDeleteFlag, self.CategoricalFlag, self.CategoricalTransformDict, self.SelectionIndex,
+                                                                  int(self.Page4_Widget.NeighborsLE.text()), knn.WEIGHTS[self.Page4_Widget.WeightsComboBox.currentIndex()],
+                                                                  self.CachedPreprocessedFrame())
+                self.page5_ImputationThread.ImputationFailed.connect(self.Page5ImputationFailed)
+            elif imputer != None:
+                # The built-in imputers reuse the columns imputed by the previous runs, see ImputationCache
+                self.page5_ImputationThread = ImputationThread(self.ImputationCache, self.FeatureDeleteFlag, self.CategoricalFlag, self.CategoricalTransformDict,
+                                                               self.SelectionIndex, self.SelectionState.key, imputer,
+                                                               pipeline.parse_fill_value(self.Page4_Widget.FillValueLE.text()))
+            else:
+                self.page5_ImputationThread = PluginImputationThread(self.df, self.FeatureDeleteFlag, self.CategoricalFlag, self.CategoricalTransformDict, self.SelectionIndex,
+                                                                     self.AlgorithmFile, self.ParameterFile, self.CachedPreprocessedFrame())
+                self.page5_ImputationThread.ImputationFailed.connect(self.Page5ImputationFailed)
+                self.page5_ImputationThread.ImputationCancelled.connect(self.Page5ImputationCancelled)
+                self.Page4_Widget.StopButton.show()
+            version = self.Page3Version
+            self.page5_ImputationThread.PreprocessFinish.connect(lambda df: self.StorePreprocessedFrame(df, version))
             self.page5_ImputationThread.ImputationFinish.connect(self.Page5_DisplayTable)
             self.page5_ImputationThread.Progress.connect(self.DisplayPage4ProgressBar)
             self.DisablePage4Buttons()
@@ -2151,29 +2620,62 @@ class Imputation_System(QWidget):
     def Page3_DisplayTable(self, df, previous_pagenum, ErrorColIdx, ErrorRowIdx):
         self.EnablePage2Buttons()
         self.df = df
-        self.MissingNum = self.df.isnull().sum().sum()
+        # Null counts per column and per block of rows, updated incrementally by the Page 3 actions
+        self.MissingStats = stats.MissingStats(self.df)
         self.ErrorColIdx = ErrorColIdx
         self.ErrorRowIdx = ErrorRowIdx
         num_sample, num_feature = df.shape
         self.FeatureDeleteFlag = [False] * num_feature
         self.CategoricalFlag = [False] * num_feature
         self.CategoricalTransformDict = [None] * num_feature
-        self.SelectionFlag = [False] * num_feature
         self.SelectionMethod = None
         self.SelectionRangeUp = None
         self.SelectionRangeDown = None
         self.SelectionCondition = 0
         self.SelectionValue = None
-        self.SelectionIndicator = [None] * num_feature
-        self.SelectionIndex = np.array([i for i in range(num_sample)])
+        self.SelectionQuery = None
+        self.SelectionState = selection.SelectionState(num_sample)
+        self.SelectionIndex = self.SelectionState.index
+        # col_idx -> (TransformDict, column as displayed), see SelectionPreviewThread.GetColumn
+        self.ColumnViewCache = {}
+        # col_idx -> (TransformDict, stats.ColumnProfiler of the displayed column)
+        self.ColumnProfilers = {}
+        self.ProfileThreads = []
+        # The preprocessed frame is shared by Download and Imputation; Page3Version is bumped
+        # on every Page 3 change, so a cached frame of an older version is never reused
+        self.Page3Version = 0
+        self.PreprocessedFrame = None
+        # (Page3Version, correlation, co-missingness) of the last feature analysis
+        self.AnalysisCache = None
+        self.ImputationCache = pipeline.ImputationCache(self.df)
+        self.SpatialIndex = None
+        self.DatetimeColumns = {}
+        self.SelectionPreviewGeneration = 0
+        self.SelectionPreviewThreads = []
+        self.SelectionPreviewTimer = QTimer()
+        self.SelectionPreviewTimer.setSingleShot(True)
+        self.SelectionPreviewTimer.setInterval(300)
+        self.SelectionPreviewTimer.timeout.connect(self.StartSelectionPreview)
         self.ActionStack = []
-        self.Page3_Widget = Page3_Widget(self.df, ErrorColIdx, ErrorRowIdx)
+        # The replayable parameters of every action of ActionStack (see pipeline.load_recipe)
+        self.RecipeStack = []
+        self.PendingRecipeStep = None
+        self.RedoStack = pipeline.RedoStack()
+        self.Page3_Widget = Page3_Widget(self.df, ErrorColIdx, ErrorRowIdx, self.MissingStats)
         self.Page3_Widget.back_button.clicked.connect(self.GOTO_Page2)
         self.Page3_Widget.next_button.clicked.connect(self.GOTO_Page4)
-        self.Page3_Widget.InputLineNumber.editingFinished.connect(lambda: self.ChangePageDisplay())
+        self.Page3_Widget.InputLineNumber.editingFinished.connect(lambda: self.GoToRow(self.Page3_Widget))
+        self.Page3SearchIndex = search.SearchIndex(self.df)
+        self.Page3_Widget.SearchLE.returnPressed.connect(lambda: self.Search(self.Page3_Widget, self.Page3SearchIndex))
+        self.Page3_Widget.SearchLE.textEdited.connect(lambda: self.BuildSearchIndex(self.Page3_Widget, self.Page3SearchIndex))
+        self.Page3SortIndex = search.SortIndex(self.df)
+        self.Page3_Widget.MainWindow.horizontalHeader().sectionClicked.connect(lambda section: self.SortTable(self.Page3_Widget, section, self.ChangePageDisplay))
         self.Page3_Widget.MainWindow.customContextMenuRequested.connect(self.generateMenu)
         self.Page3_Widget.DownloadButton.clicked.connect(self.DownloadPreprocessFile)
+        self.Page3_Widget.RecipeButton.clicked.connect(self.ExportRecipe)
+        self.Page3_Widget.AnalysisButton.clicked.connect(self.AnalyzeFeatures)
         self.Page3_Widget.UndoButton.clicked.connect(self.UndoPreprocess)
+        self.Page3_Widget.RedoButton.clicked.connect(self.RedoPreprocess)
         self.Overall_Layout.addWidget(self.Page3_Widget)
         if previous_pagenum == 1:
             self.Page1_Widget.hide()
@@ -2198,80 +2700,124 @@ class Imputation_System(QWidget):
                 self.Page2_Widget.MergeProgressLE.hide()
 
     def ChangePageDisplay(self):
-        # =======================Dealing with page-jumping======================
         num_row, num_col = self.df.shape
-        display_num_row = len(self.SelectionIndex)
-        try:
-            PageNumber = int(self.Page3_Widget.InputLineNumber.text())
-        except:
-            PageNumber = 1
-        TotalPage = int(display_num_row/100) + 1
-        self.Page3_Widget.TotalNumLine.setText("/"+str(TotalPage))
-        if PageNumber > TotalPage:
-            PageNumber = TotalPage
-            self.Page3_Widget.InputLineNumber.setText(str(TotalPage))
-            QMessageBox.warning(self, "Warning", "Page number out of, jump to the last page!", QMessageBox.Yes, QMessageBox.Yes)
-        elif PageNumber <= 0:
-            PageNumber = 1
-            self.Page3_Widget.InputLineNumber.setText(str(1))
-            QMessageBox.warning(self, "Warning", "Page number out of, jump to the first page!", QMessageBox.Yes, QMessageBox.Yes)
-        display_num_col = num_col - sum(self.FeatureDeleteFlag)
-        NewMissingRate = self.MissingNum * 100 / (display_num_col*display_num_row)
+        NewMissingRate, display_num_row, display_num_col = self.MissingStats.summary(self.FeatureDeleteFlag)
         self.Page3_Widget.MissingRateLE.setText("Missing Rate: %f%%" %NewMissingRate)
         self.Page3_Widget.SampleNumLE.setText("Sample Number: %i" %display_num_row)
         self.Page3_Widget.FeatureNumLE.setText("Feature Number: %i" %display_num_col)
-        self.Page3_Widget.MainWindow.clear()
-        self.Page3_Widget.MainWindow.setColumnCount(max(15, display_num_col))
-        # get the new headers
-        HorizontalHeader = [' '] * max(15, display_num_col)
-        i_idx = 0
-        for i in range(len(self.df.columns)):
-            if self.FeatureDeleteFlag[i] == False:
-                HorizontalHeader[i_idx] = self.df.columns[i]
-                i_idx += 1
-        self.Page3_Widget.MainWindow.setHorizontalHeaderLabels(HorizontalHeader)
-
-        start_row = 100 * (PageNumber - 1)
-        end_row = min(display_num_row, PageNumber * 100)
-        for i in range(start_row, end_row):
-            i_df = self.SelectionIndex[i]
-            j_idx = 0
-            for j in range(num_col):
-                if self.FeatureDeleteFlag[j]:
-                    continue
-                if self.CategoricalFlag[j]:
-                    if str(self.df.iat[i_df, j]) == 'nan':
-                        CurItem = 'nan'
-                    else:
-                        try: 
-                            CurItem = str(self.CategoricalTransformDict[j][self.df.iat[i_df, j]])
-                        except:
-                            print(j)
-                            print(len(self.CategoricalTransformDict))
-                            print(self.df.iat[i_df,j])
-                            print(self.df.shape)
-                            str(self.CategoricalTransformDict[j][self.df.iat[i_df, j]])
-                else:
-                    CurItem = str(self.df.iat[i_df, j])
-                if CurItem == 'nan':
-                    EmptyTableItem = QTableWidgetItem()
-                    EmptyTableItem.setBackground(QBrush(QColor(201,252,255)))
-                    self.Page3_Widget.MainWindow.setItem(i-start_row, j_idx, EmptyTableItem)
-                    j_idx += 1  
-                    continue
-                elif j in self.ErrorColIdx:
-                    if [i_df] in self.ErrorRowIdx[self.ErrorColIdx.index(j)]:
-                        ErrorTableItem = QTableWidgetItem(CurItem)
-                        ErrorTableItem.setBackground(QBrush(QColor(255, 79, 66, 150)))
-                        self.Page3_Widget.MainWindow.setItem(i-start_row, j_idx, ErrorTableItem)
-                        j_idx += 1  
-                        continue
-                self.Page3_Widget.MainWindow.setItem(i-start_row, j_idx, QTableWidgetItem(CurItem))         
-                j_idx += 1   
-        vertical_header = [str(i+1) for i in range(start_row, start_row+self.Page3_Widget.MainWindow.rowCount())]
-        self.Page3_Widget.MainWindow.setVerticalHeaderLabels(vertical_header)
-        self.Page3_Widget.MainWindow.verticalHeader().show()
-        self.Page3_Widget.MainWindow.resizeColumnsToContents()
+        self.Page3_Widget.TotalNumLine.setText("/%i" %display_num_row)
+        # The model reads the raw data through the current view, no cell is copied
+        columns = [j for j in range(num_col) if self.FeatureDeleteFlag[j] == False]
+        transforms = dict([(j, self.CategoricalTransformDict[j]) for j in columns if self.CategoricalFlag[j] and self.CategoricalTransformDict[j] != None])
+        rows = self.SortedRows(self.Page3_Widget, self.Page3SortIndex, self.SelectionIndex, columns, transforms, self.ChangePageDisplay)
+        self.Page3_Widget.model.setView(rows, columns, transforms)
+        ResizeColumns(self.Page3_Widget.MainWindow)
+
+    def SortTable(self, widget, section, refresh):
+        col_idx = widget.model.columns[section]
+        if widget.SortColumn == col_idx:
+            widget.SortDescending = not widget.SortDescending
+        else:
+            widget.SortColumn = col_idx
+            widget.SortDescending = False
+        refresh()
+
+    def SortedRows(self, widget, SortIndex, rows, columns, transforms, refresh):
+        '''
+        Description:
+        The displayed rows in the order of the sorted column of widget. A permutation not
+        cached yet is computed in a SortThread: the rows are displayed unsorted meanwhile, and
+        refresh is called once it is ready.
+        '''
+        header = widget.MainWindow.horizontalHeader()
+        if widget.SortColumn not in columns:
+            widget.SortColumn = None
+            header.setSortIndicatorShown(False)
+            return rows
+        col_idx = widget.SortColumn
+        header.setSortIndicatorShown(True)
+        header.setSortIndicator(columns.index(col_idx), Qt.DescendingOrder if widget.SortDescending else Qt.AscendingOrder)
+        if SortIndex.cached(col_idx, widget.SortDescending, transforms.get(col_idx)):
+            return SortIndex.sorted_rows(col_idx, rows, widget.SortDescending, transforms.get(col_idx))
+        if widget.SortThread == None or not widget.SortThread.isRunning():
+            widget.SortThread = SortThread(SortIndex, col_idx, widget.SortDescending, transforms.get(col_idx))
+            widget.SortThread.finished.connect(refresh)
+            widget.SortThread.start()
+        return rows
+
+    def Page5SortDisplay(self):
+        columns = list(range(self.impute_df.shape[1]))
+        rows = self.SortedRows(self.Page5_Widget, self.Page5SortIndex, None, columns, {}, self.Page5SortDisplay)
+        self.Page5_Widget.model.setView(rows, columns)
+
+    def Search(self, widget, SearchIndex):
+        text = widget.SearchLE.text().strip()
+        if text == '':
+            widget.SearchResultLE.setText("")
+            return
+        model = widget.model
+        key = (text, model.generation, tuple(model.columns))
+        if key == widget.SearchKey:
+            self.NextSearchResult(widget)
+            return
+        self.StartSearchThread(widget, SearchIndex, text, key)
+
+    def BuildSearchIndex(self, widget, SearchIndex):
+        # Typing starts indexing the displayed columns, so that the search itself is instant
+        if widget.SearchThread == None:
+            self.StartSearchThread(widget, SearchIndex, None, None)
+
+    def StartSearchThread(self, widget, SearchIndex, text, key):
+        if widget.SearchThread != None and widget.SearchThread.isRunning():
+            if text != None:
+                widget.PendingSearch = SearchIndex
+            return
+        model = widget.model
+        widget.SearchThread = SearchThread(SearchIndex, text, model.columns, model.transforms, model.rows, key)
+        widget.SearchThread.SearchFinish.connect(lambda key, cells: self.SearchFinish(widget, key, cells))
+        widget.SearchThread.finished.connect(lambda: self.SearchThreadFinish(widget))
+        widget.SearchThread.start()
+
+    def SearchThreadFinish(self, widget):
+        if widget.PendingSearch != None:
+            SearchIndex = widget.PendingSearch
+            widget.PendingSearch = None
+            self.Search(widget, SearchIndex)
+
+    def SearchFinish(self, widget, key, cells):
+        widget.SearchKey = key
+        widget.SearchCells = cells
+        widget.SearchPosition = -1
+        if key == (widget.SearchLE.text().strip(), widget.model.generation, tuple(widget.model.columns)):
+            self.NextSearchResult(widget)
+
+    def NextSearchResult(self, widget):
+        cells = widget.SearchCells
+        if len(cells) == 0:
+            widget.SearchResultLE.setText("No match")
+            return
+        widget.SearchPosition = (widget.SearchPosition + 1) % len(cells)
+        index = widget.model.index(int(cells[widget.SearchPosition][0]), int(cells[widget.SearchPosition][1]))
+        widget.MainWindow.setCurrentIndex(index)
+        widget.MainWindow.scrollTo(index, QAbstractItemView.PositionAtCenter)
+        widget.SearchResultLE.setText("%i/%i" %(widget.SearchPosition + 1, len(cells)))
+
+    def GoToRow(self, widget):
+        num_row = widget.model.rowCount()
+        try:
+            RowNumber = int(widget.InputLineNumber.text())
+        except:
+            RowNumber = 1
+        if RowNumber > num_row:
+            RowNumber = num_row
+            widget.InputLineNumber.setText(str(num_row))
+            QMessageBox.warning(self, "Warning", "Row number out of range, jump to the last row!", QMessageBox.Yes, QMessageBox.Yes)
+        elif RowNumber <= 0:
+            RowNumber = 1
+            widget.InputLineNumber.setText(str(1))
+            QMessageBox.warning(self, "Warning", "Row number out of range, jump to the first row!", QMessageBox.Yes, QMessageBox.Yes)
+        if num_row > 0:
+            widget.MainWindow.scrollTo(widget.model.index(RowNumber-1, 0), QAbstractItemView.PositionAtTop)
 
     def DisablePage2Buttons(self):
         # ======================BUTTONS IN THE STEP BAR========================
@@ -2321,17 +2867,17 @@ class Imputation_System(QWidget):
             self.DeleteAction = menu.addAction("Delete")
             self.TransformAction = menu.addAction("Transform")
             self.SelectAction = menu.addAction("Select")
-            # self.AnalyzeAction = menu.addAction("Analyze")
+            self.AnalyzeAction = menu.addAction("Analyze")
             self.InfoAction.setEnabled(False)
             self.InfoAction.setCheckable(False)
             self.DeleteAction.setIcon(QIcon(QPixmap('fig/delete.png')))
             self.TransformAction.setIcon(QIcon(QPixmap('fig/transform.png')))
             self.SelectAction.setIcon(QIcon(QPixmap('fig/selection.png')))
-            # self.AnalyzeAction.setIcon(QIcon(QPixmap('analysis.png')))
+            self.AnalyzeAction.setIcon(QIcon(QPixmap('fig/analysis.png')))
             self.DeleteAction.triggered.connect(lambda: self.DeletePreprocessQuery(colNum))
             self.TransformAction.triggered.connect(lambda: self.TransformPreprocessQuery(colNum))
             self.SelectAction.triggered.connect(lambda: self.SelectPreprocess(colNum))
-            # self.AnalyzeAction.triggered.connect(lambda: self.AnalyzePreprocess(colNum))
+            self.AnalyzeAction.triggered.connect(lambda: self.AnalyzePreprocess(colNum))
             menu.setStyleSheet('*{font-size: 25px;}')
             screenpos = self.Page3_Widget.MainWindow.mapToGlobal(pos)
             _ = menu.exec_(screenpos)
@@ -2352,9 +2898,8 @@ class Imputation_System(QWidget):
                 break
         self.FeatureDeleteFlag[i] = True
         self.ActionStack.append(('Delete', i)) # delete col-i
-        # change number of missing values
-        DeleteMissingNum = self.df.iloc[:,i].isnull().sum()
-        self.MissingNum -= DeleteMissingNum
+        self.ClearRedoStack()
+        self.RecipeStack.append({'action': 'Delete', 'column': str(self.df.columns[i])})
         if len(self.ActionStack) == 1:
             self.Page3_Widget.UndoButton.setStyleSheet('''
             QPushButton{
@@ -2379,13 +2924,8 @@ class Imputation_System(QWidget):
         ''')
             self.Page3_Widget.UndoButton.setEnabled(True)
         self.ChangePageDisplay()
-        # Whenever there are operations in page3 and page4/5 already initialized, 
-        # we have to re-initializa them
-        if self.page4_init:
-            self.page4_init = False
-            self.Step_Widget.step_layout_button5.hide()
-        if self.page5_init:
-            self.page5_init =False
+        self.InvalidatePreprocessedFrame()
+        self.InvalidatePage5()
 
     def TransformPreprocessQuery(self, colNum):
         result = QMessageBox.question(self, "Comfirmation", "Transform this column to categorical data?", QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
@@ -2403,6 +2943,8 @@ class Imputation_System(QWidget):
             return
         self.CategoricalFlag[i] = True
         self.ActionStack.append(('Transform', i))
+        self.ClearRedoStack()
+        self.RecipeStack.append({'action': 'Transform', 'column': str(self.df.columns[i])})
         if len(self.ActionStack) == 1:
             self.Page3_Widget.UndoButton.setStyleSheet('''
             QPushButton{
@@ -2433,47 +2975,216 @@ class Imputation_System(QWidget):
             self.DisablePage3Buttons()
             self.TransformPreprocessThread.start()
         else:
+            self.ColumnViewCache.pop(i, None)
             self.ChangePageDisplay()
-            # Whenever there are operations in page3 and page4/5 already initialized, 
-            # we have to re-initializa them
-            if self.page4_init:
-                self.page4_init = False
-                self.Step_Widget.step_layout_button5.hide()
-            if self.page5_init:
-                self.page5_init =False
+            self.InvalidatePreprocessedFrame()
+            self.InvalidatePage5()
 
 
     def SelectPreprocess(self, colNum):
+        num_remain = 0
+        for i in range(len(self.FeatureDeleteFlag)):
+            if self.FeatureDeleteFlag[i] == False:
+                num_remain += 1
+            if num_remain == colNum + 1:
+                break
+        self.SelectionColumn = i
         self.selectionbox = SelectionDialog()
         self.selectionbox.SelectButton1.clicked.connect(self.AssertRangeSelection)
         self.selectionbox.SelectButton2.clicked.connect(self.AssertConditionSelection)
+        self.selectionbox.SelectButton3.clicked.connect(self.AssertQuerySelection)
+        self.selectionbox.SelectButton4.clicked.connect(self.AssertSpatialSelection)
+        self.selectionbox.SelectButton5.clicked.connect(self.AssertTimeSelection)
+        self.selectionbox.SpatialMethodComboBox.currentIndexChanged.connect(self.ChangeSpatialMethod)
         self.selectionbox.RangeLE1.editingFinished.connect(self.ChangeRangeDown)
         self.selectionbox.RangeLE2.editingFinished.connect(self.ChangeRangeUp)
         self.selectionbox.SelectionMethodComboBox.currentIndexChanged.connect(self.ChangeConditionMethod)
         self.selectionbox.ValueLE.editingFinished.connect(self.ChangeValueLE)
+        self.selectionbox.QueryLE.editingFinished.connect(self.ChangeQueryLE)
         self.selectionbox.CancelButton.clicked.connect(self.SelectionCancel)
         self.selectionbox.OKButton.clicked.connect(lambda: self.AssertSelectionPreprocess(colNum))
+        # Live preview of the number of matching/removed rows while typing
+        self.selectionbox.SelectButton1.clicked.connect(lambda: self.ScheduleSelectionPreview())
+        self.selectionbox.SelectButton2.clicked.connect(lambda: self.ScheduleSelectionPreview())
+        self.selectionbox.SelectButton3.clicked.connect(lambda: self.ScheduleSelectionPreview())
+        self.selectionbox.RangeLE1.textEdited.connect(lambda: self.ScheduleSelectionPreview())
+        self.selectionbox.RangeLE2.textEdited.connect(lambda: self.ScheduleSelectionPreview())
+        self.selectionbox.SelectionMethodComboBox.currentIndexChanged.connect(lambda: self.ScheduleSelectionPreview())
+        self.selectionbox.ValueLE.textEdited.connect(lambda: self.ScheduleSelectionPreview())
+        self.selectionbox.QueryLE.textEdited.connect(lambda: self.ScheduleSelectionPreview())
+        self.selectionbox.SelectButton4.clicked.connect(lambda: self.ScheduleSelectionPreview())
+        self.selectionbox.SpatialMethodComboBox.currentIndexChanged.connect(lambda: self.ScheduleSelectionPreview())
+        for SpatialLE in self.selectionbox.SpatialLEs:
+            SpatialLE.textEdited.connect(lambda: self.ScheduleSelectionPreview())
+        self.selectionbox.SelectButton5.clicked.connect(lambda: self.ScheduleSelectionPreview())
+        for TimeLE in self.selectionbox.TimeLEs:
+            TimeLE.textEdited.connect(lambda: self.ScheduleSelectionPreview())
         self.selectionbox.show()
         self.selectionbox.exec_()
+        self.CancelSelectionPreview()
+
+    def ScheduleSelectionPreview(self):
+        # (Re-)start the debounce timer, the count only starts once the user stops typing
+        self.selectionbox.PreviewLE.setText("Counting matching rows...")
+        self.SelectionPreviewTimer.start()
+
+    def StartSelectionPreview(self):
+        self.CancelSelectionPreview()
+        try:
+            query = self.SelectionPreviewQuery()
+        except ValueError as e:
+            self.selectionbox.PreviewLE.setText(str(e))
+            return
+        if query == None:
+            self.selectionbox.PreviewLE.setText("")
+            return
+        thread = SelectionPreviewThread(self.SelectionPreviewGeneration, self.df, query, self.ColumnViewCache, self.DatetimeColumns, self.FeatureDeleteFlag,
+                                        self.CategoricalFlag, self.CategoricalTransformDict, self.SelectionIndex)
+        thread.PreviewFinish.connect(self.SelectionPreviewDisplay)
+        # Keep the cancelled threads referenced until they have returned
+        self.SelectionPreviewThreads = [t for t in self.SelectionPreviewThreads if t.isRunning()] + [thread]
+        thread.start()
+
+    def CancelSelectionPreview(self):
+        self.SelectionPreviewTimer.stop()
+        self.SelectionPreviewGeneration += 1
+        for thread in self.SelectionPreviewThreads:
+            thread.cancel()
+
+    def SelectionPreviewQuery(self):
+        name = str(self.df.columns[self.SelectionColumn])
+        if self.SelectionMethod == 'Range':
+            return ('cond', name, 'Range', self.RangeBounds())
+        elif self.SelectionMethod == 'Condition':
+            condition = self.selectionbox.SelectionMethodComboBox.currentIndex()
+            value = self.selectionbox.ValueLE.text()
+            if value == '':
+                return None
+            if condition in [2,3,4,5]:
+                try:
+                    value = float(value)
+                except ValueError:
+                    raise ValueError("Please enter a numerical value!")
+            elif condition in [12,13]:
+                value = selection.compile_regex(value)
+            return ('cond', name, 'Condition', (condition, value))
+        elif self.SelectionMethod == 'Query':
+            if self.selectionbox.QueryLE.text().strip() == '':
+                return None
+            RemainColumns = [str(self.df.columns[i]) for i in range(len(self.FeatureDeleteFlag)) if self.FeatureDeleteFlag[i] == False]
+            return selection.compile_query(self.selectionbox.QueryLE.text(), RemainColumns)
+        elif self.SelectionMethod == 'Spatial':
+            lat_idx, lon_idx = self.SpatialColumns()
+            SpatialMethod, SpatialArgs = self.SpatialSelectionArgs()
+            return ('cond', (str(self.df.columns[lat_idx]), str(self.df.columns[lon_idx])), SpatialMethod, SpatialArgs)
+        elif self.SelectionMethod == 'Time':
+            TimeFormat = self.TimeFormat()
+            TimeArgs = self.TimeSelectionArgs()
+            return ('cond', str(self.df.columns[self.SelectionColumn]), 'Time', (TimeFormat,) + TimeArgs)
+        return None
+
+    def RangeBounds(self):
+        # The bounds as typed, editingFinished may not have been emitted for them yet
+        bounds = []
+        for text in [self.selectionbox.RangeLE1.text(), self.selectionbox.RangeLE2.text()]:
+            if text.strip() == '':
+                bounds.append(None)
+                continue
+            try:
+                bounds.append(float(text))
+            except ValueError:
+                raise ValueError("Please enter a numerical bound!")
+        if bounds == [None, None]:
+            raise ValueError("Please specify at least one bound for the range!")
+        return (bounds[0], bounds[1])
+
+    def TimeFormat(self):
+        if self.SelectionColumn in self.DatetimeColumns:
+            return self.DatetimeColumns[self.SelectionColumn].format
+        TimeFormat = timeindex.infer_datetime_format(self.df.iloc[:,self.SelectionColumn])
+        if TimeFormat == None:
+            raise ValueError("This column does not look like a date/time column!")
+        return TimeFormat
+
+    def TimeSelectionArgs(self):
+        texts = [TimeLE.text() for TimeLE in self.selectionbox.TimeLEs]
+        if all([text.strip() == '' for text in texts]):
+            raise ValueError("Please specify a time range, hours or days!")
+        start = timeindex.parse_bound(texts[0])
+        end = timeindex.parse_bound(texts[1], end=True)
+        if start != None and end != None and start > end:
+            raise ValueError("The start of the time range should not exceed its end!")
+        return (start, end, timeindex.parse_hours(texts[2]), timeindex.parse_weekdays(texts[3]))
+
+    def SpatialColumns(self):
+        lat_idx, lon_idx = spatial.find_coordinate_columns(self.df.columns)
+        if lat_idx == None or lon_idx == None:
+            raise ValueError("Spatial selection needs a latitude and a longitude column!")
+        if self.FeatureDeleteFlag[lat_idx] or self.FeatureDeleteFlag[lon_idx]:
+            raise ValueError("The latitude/longitude column has been deleted!")
+        return lat_idx, lon_idx
+
+    def SpatialSelectionArgs(self):
+        SpatialMethod = ['Box', 'Radius'][self.selectionbox.SpatialMethodComboBox.currentIndex()]
+        NumArgs = 4 if SpatialMethod == 'Box' else 3
+        SpatialArgs = []
+        for i in range(NumArgs):
+            try:
+                SpatialArgs.append(float(self.selectionbox.SpatialLEs[i].text()))
+            except ValueError:
+                raise ValueError("Please enter the %s!" % self.selectionbox.SpatialLEs[i].placeholderText().lower())
+        if SpatialMethod == 'Box' and (SpatialArgs[0] > SpatialArgs[1] or SpatialArgs[2] > SpatialArgs[3]):
+            raise ValueError("The minimum of the box should not exceed its maximum!")
+        if SpatialMethod == 'Radius' and SpatialArgs[2] < 0:
+            raise ValueError("The radius should not be negative!")
+        return SpatialMethod, tuple(SpatialArgs)
+
+    def SelectionPreviewDisplay(self, generation, NumKept, NumRemoved):
+        # Results of cancelled or outdated previews are dropped
+        if generation != self.SelectionPreviewGeneration:
+            return
+        self.selectionbox.PreviewLE.setText("Matching rows: %i    Removed rows: %i" %(NumKept, NumRemoved))
         
 
         
 
 
-    # def AnalyzePreprocess(self, colNum):
-    #     pass
+    def AnalyzePreprocess(self, colNum):
+        num_remain = 0
+        for i in range(len(self.FeatureDeleteFlag)):
+            if self.FeatureDeleteFlag[i] == False:
+                num_remain += 1
+            if num_remain == colNum + 1:
+                break
+        # The block profiles of a column are kept, so profiling it again after a selection
+        # only goes through the blocks the selection cuts. A transformed column is profiled as
+        # displayed, on its class codes, with a profiler of its current TransformDict.
+        TransformDict = self.CategoricalTransformDict[i] if self.CategoricalFlag[i] else None
+        if i not in self.ColumnProfilers or self.ColumnProfilers[i][0] is not TransformDict:
+            feature = self.df.iloc[:,i]
+            if TransformDict != None:
+                feature = pd.Series(plan.transform_to_categorical(feature, TransformDict), index=feature.index)
+            self.ColumnProfilers[i] = (TransformDict, stats.ColumnProfiler(feature))
+        ProfileThread_ = ProfileThread(self.ColumnProfilers[i][1], i, self.SelectionIndex)
+        ProfileThread_.ProfileFinish.connect(self.ProfileDisplay)
+        ProfileThread_.finished.connect(lambda: self.ProfileThreads.remove(ProfileThread_))
+        self.ProfileThreads.append(ProfileThread_)
+        ProfileThread_.start()
+
+    def ProfileDisplay(self, col_idx, summary):
+        name = str(self.df.columns[col_idx])
+        if self.CategoricalFlag[col_idx]:
+            name += ' (class codes)'
+        self.profilebox = ProfileDialog(name, summary)
+        self.profilebox.show()
 
     def TransformDisplay(self, TransformDict, col_idx):
         self.EnablePage3Buttons()
         self.CategoricalTransformDict[col_idx] = TransformDict
+        self.ColumnViewCache.pop(col_idx, None)
         self.ChangePageDisplay()
-        # Whenever there are operations in page3 and page4/5 already initialized, 
-        # we have to re-initializa them
-        if self.page4_init:
-            self.page4_init = False
-            self.Step_Widget.step_layout_button5.hide()
-        if self.page5_init:
-            self.page5_init =False
+        self.InvalidatePreprocessedFrame()
+        self.InvalidatePage5()
 
     def TransformProgressDisplay(self, counter):
         if counter == 1:
@@ -2492,7 +3203,12 @@ class Imputation_System(QWidget):
         savefile, _ = QFileDialog.getSaveFileName(self, 'Save File', '.', '(*.csv)')
         if savefile == '':
             return
+        if self.CachedPreprocessedFrame() is not None:
+            self.DownloadFinish(self.CachedPreprocessedFrame(), savefile)
+            return
         self.DownloadThread = DownloadThread(self.df, self.FeatureDeleteFlag, self.CategoricalFlag, self.CategoricalTransformDict, self.SelectionIndex, savefile)
+        version = self.Page3Version
+        self.DownloadThread.PreprocessFinish.connect(lambda df: self.StorePreprocessedFrame(df, version))
         self.DownloadThread.ThirdProgress.connect(self.DownloadProgressDisplay)
         self.DownloadThread.DownloadFinish.connect(self.DownloadFinish)
         self.DisablePage3Buttons()
@@ -2503,24 +3219,40 @@ class Imputation_System(QWidget):
         # QMessageBox.information(self, "Download Successfully", "The file has been downloaded successfully!", QMessageBox.Yes, QMessageBox.Yes)
 
     def AssertRangeSelection(self):
-        # Enable the range-selection LEs
-        self.selectionbox.RangeLE1.setEnabled(True)
-        self.selectionbox.RangeLE2.setEnabled(True)
-        # Disable the condition-selection LEs
-        self.selectionbox.SelectionMethodComboBox.setEnabled(False)
-        self.selectionbox.ValueLE.setEnabled(False)
-        # Change the value of some variables
-        self.SelectionMethod = "Range"
+        self.SetSelectionWidgets("Range")
     
     def AssertConditionSelection(self):
-        # Enable the condition-selection LEs
-        self.selectionbox.SelectionMethodComboBox.setEnabled(True)
-        self.selectionbox.ValueLE.setEnabled(True)
-        # Disable the range-selection LEs
-        self.selectionbox.RangeLE1.setEnabled(False)
-        self.selectionbox.RangeLE2.setEnabled(False)
-        # Change the value of some variable
-        self.SelectionMethod = "Condition"
+        self.SetSelectionWidgets("Condition")
+
+    def AssertQuerySelection(self):
+        self.SetSelectionWidgets("Query")
+
+    def AssertSpatialSelection(self):
+        self.SetSelectionWidgets("Spatial")
+
+    def AssertTimeSelection(self):
+        self.SetSelectionWidgets("Time")
+
+    def SetSelectionWidgets(self, method):
+        # Only enable the LEs of the chosen selection method
+        self.selectionbox.RangeLE1.setEnabled(method == "Range")
+        self.selectionbox.RangeLE2.setEnabled(method == "Range")
+        self.selectionbox.SelectionMethodComboBox.setEnabled(method == "Condition")
+        self.selectionbox.ValueLE.setEnabled(method == "Condition")
+        self.selectionbox.QueryLE.setEnabled(method == "Query")
+        self.selectionbox.SpatialMethodComboBox.setEnabled(method == "Spatial")
+        for i in range(4):
+            self.selectionbox.SpatialLEs[i].setEnabled(method == "Spatial" and (i < 3 or self.selectionbox.SpatialMethodComboBox.currentIndex() == 0))
+            self.selectionbox.TimeLEs[i].setEnabled(method == "Time")
+        # Change the value of some variables
+        self.SelectionMethod = method
+
+    def ChangeSpatialMethod(self, i):
+        # Bounding box: 4 bounds, Radius around point: center and radius
+        placeholders = [["Min latitude", "Max latitude", "Min longitude", "Max longitude"], ["Center latitude", "Center longitude", "Radius (km)", ""]][i]
+        for j in range(4):
+            self.selectionbox.SpatialLEs[j].setPlaceholderText(placeholders[j])
+        self.selectionbox.SpatialLEs[3].setEnabled(self.SelectionMethod == "Spatial" and i == 0)
 
     def ChangeRangeDown(self):
         try:
@@ -2546,6 +3278,15 @@ class Imputation_System(QWidget):
                 self.selectionbox.ValueLE.setText('0')
                 self.SelectionValue = 0
                 QMessageBox.critical(self.selectionbox, "Error", "Please enter a numerical value!", QMessageBox.Yes, QMessageBox.Yes)
+        elif self.SelectionCondition in [12,13]:
+            try:
+                self.SelectionValue = selection.compile_regex(self.SelectionValue)
+            except ValueError as e:
+                self.SelectionValue = None
+                QMessageBox.critical(self.selectionbox, "Error", str(e), QMessageBox.Yes, QMessageBox.Yes)
+
+    def ChangeQueryLE(self):
+        self.SelectionQuery = self.selectionbox.QueryLE.text()
                 
     def SelectionCancel(self):
         # None-lize all the variables
@@ -2554,6 +3295,7 @@ class Imputation_System(QWidget):
         self.SelectionRangeDown = None
         self.SelectionCondition = 0
         self.SelectionValue = None
+        self.SelectionQuery = None
         # Close the QDialog
         self.selectionbox.close()
 
@@ -2562,12 +3304,35 @@ class Imputation_System(QWidget):
         if self.SelectionMethod == None:
             QMessageBox.critical(self.selectionbox, "Error", "Please choose one selection method!", QMessageBox.Yes, QMessageBox.Yes)
             return
-        elif self.SelectionMethod == 'Range' and self.SelectionRangeDown == None and self.SelectionRangeUp == None:
-            QMessageBox.critical(self.selectionbox, "Error", "Please specify at least one bound for the range!", QMessageBox.Yes, QMessageBox.Yes)
-            return
+        elif self.SelectionMethod == 'Range':
+            try:
+                self.SelectionRangeDown, self.SelectionRangeUp = self.RangeBounds()
+            except ValueError as e:
+                QMessageBox.critical(self.selectionbox, "Error", str(e), QMessageBox.Yes, QMessageBox.Yes)
+                return
         elif self.SelectionMethod == 'Condition' and self.SelectionValue == None:
             QMessageBox.critical(self.selectionbox, "Error", "Please specify the value for the chosen condition!", QMessageBox.Yes, QMessageBox.Yes)
             return
+        elif self.SelectionMethod == 'Condition' and self.SelectionCondition in [12,13]:
+            try:
+                self.SelectionValue = selection.compile_regex(self.SelectionValue)
+            except ValueError as e:
+                QMessageBox.critical(self.selectionbox, "Error", str(e), QMessageBox.Yes, QMessageBox.Yes)
+                return
+        try:
+            self.PendingRecipeStep = self.SelectionRecipeStep()
+        except ValueError as e:
+            QMessageBox.critical(self.selectionbox, "Error", str(e), QMessageBox.Yes, QMessageBox.Yes)
+            return
+        if self.SelectionMethod == 'Query':
+            self.QueryPreprocess()
+            return
+        elif self.SelectionMethod == 'Spatial':
+            self.SpatialPreprocess()
+            return
+        elif self.SelectionMethod == 'Time':
+            self.TimePreprocess()
+            return
         # Start the Selection
         num_remain = 0
         for i in range(len(self.FeatureDeleteFlag)):
@@ -2578,77 +3343,98 @@ class Imputation_System(QWidget):
         if self.CategoricalFlag[i] == False:
             feature = self.df.iloc[:,i]
         else:
-            feature = self.df.iloc[:,i].map(lambda x:self.TransformToCategorical(x, i))
-            # print(self.df.iloc[:,i][:20])
-            # print(feature[:20])
-        self.SelectionPreprocessThread = SelectionThread(feature, self.SelectionMethod, self.SelectionRangeDown, self.SelectionRangeUp, self.SelectionCondition, self.SelectionValue, self.SelectionIndex, i)
+            feature = pd.Series(plan.transform_to_categorical(self.df.iloc[:,i], self.CategoricalTransformDict[i]), index=self.df.index)
+        self.SelectionPreprocessThread = SelectionThread(feature, self.SelectionMethod, self.SelectionRangeDown, self.SelectionRangeUp, self.SelectionCondition, self.SelectionValue, i)
         self.SelectionPreprocessThread.SelectionFinish.connect(self.SelectionDisplay)
         self.SelectionPreprocessThread.TenPercent.connect(self.SelectionProgressDisplay)
         self.DisablePage3Buttons()
         self.SelectionPreprocessThread.start()
 
-    def TransformToCategorical(self, x, i):
-        if str(x) == 'nan':
-            return np.nan
-        else:
-            return self.CategoricalTransformDict[i][x]
+    def QueryPreprocess(self):
+        if self.SelectionQuery == None or self.SelectionQuery.strip() == '':
+            QMessageBox.critical(self.selectionbox, "Error", "Please enter the query!", QMessageBox.Yes, QMessageBox.Yes)
+            return
+        # Only the remaining (not deleted) features can be referenced in the query
+        RemainColumns = [str(self.df.columns[i]) for i in range(len(self.FeatureDeleteFlag)) if self.FeatureDeleteFlag[i] == False]
+        try:
+            query = selection.compile_query(self.SelectionQuery, RemainColumns)
+        except ValueError as e:
+            QMessageBox.critical(self.selectionbox, "Error", str(e), QMessageBox.Yes, QMessageBox.Yes)
+            return
+        self.QueryPreprocessThread = QueryThread(self.df, query, self.SelectionQuery, self.FeatureDeleteFlag, self.CategoricalFlag, self.CategoricalTransformDict, self.SelectionIndex)
+        self.QueryPreprocessThread.QueryFinish.connect(self.QueryDisplay)
+        self.QueryPreprocessThread.TenPercent.connect(self.SelectionProgressDisplay)
+        self.DisablePage3Buttons()
+        self.QueryPreprocessThread.start()
+
+    def SpatialPreprocess(self):
+        try:
+            lat_idx, lon_idx = self.SpatialColumns()
+            SpatialMethod, SpatialArgs = self.SpatialSelectionArgs()
+        except ValueError as e:
+            QMessageBox.critical(self.selectionbox, "Error", str(e), QMessageBox.Yes, QMessageBox.Yes)
+            return
+        self.SpatialPreprocessThread = SpatialSelectionThread(self.SpatialIndex, self.df.iloc[:,lat_idx], self.df.iloc[:,lon_idx], SpatialMethod, SpatialArgs, self.SelectionIndex)
+        self.SpatialPreprocessThread.SpatialFinish.connect(self.SpatialDisplay)
+        self.SpatialPreprocessThread.TenPercent.connect(self.SelectionProgressDisplay)
+        self.DisablePage3Buttons()
+        self.SpatialPreprocessThread.start()
+
+    def TimePreprocess(self):
+        try:
+            TimeFormat = self.TimeFormat()
+            TimeArgs = self.TimeSelectionArgs()
+        except ValueError as e:
+            QMessageBox.critical(self.selectionbox, "Error", str(e), QMessageBox.Yes, QMessageBox.Yes)
+            return
+        i = self.SelectionColumn
+        self.TimePreprocessThread = TimeSelectionThread(self.DatetimeColumns.get(i), self.df.iloc[:,i], TimeFormat, TimeArgs, self.SelectionIndex)
+        self.TimePreprocessThread.TimeFinish.connect(lambda RejectedRows, TimeArgs: self.TimeDisplay(RejectedRows, TimeArgs, i))
+        self.TimePreprocessThread.TenPercent.connect(self.SelectionProgressDisplay)
+        self.DisablePage3Buttons()
+        self.TimePreprocessThread.start()
+
+    def TimeDisplay(self, RejectedRows, TimeArgs, col_idx):
+        # Keep the parsed column and its sorted time index for the following time selections
+        self.DatetimeColumns[col_idx] = self.TimePreprocessThread.DatetimeColumn
+        self.QueryDisplay(RejectedRows, (col_idx,) + TimeArgs, 'Time')
+
+    def SpatialDisplay(self, RejectedRows, SpatialSelection):
+        # Keep the (lazily built) grid index for the following spatial selections
+        self.SpatialIndex = self.SpatialPreprocessThread.SpatialIndex
+        self.QueryDisplay(RejectedRows, SpatialSelection, 'Spatial')
 
-    def SelectionDisplay(self, SelectedIndicator, SelectionIndex, col_idx):
+    def QueryDisplay(self, RejectedRows, QueryText, Action='Query'):
         self.EnablePage3Buttons()
-        self.SelectionIndex = SelectionIndex
-        if self.SelectionFlag[col_idx] == False:
-            self.SelectionFlag[col_idx] = True
-            self.SelectionIndicator[col_idx] = [SelectedIndicator]
-            self.ActionStack.append(('Select', col_idx))
-            if len(self.ActionStack) == 1:
-                self.Page3_Widget.UndoButton.setStyleSheet('''
-                QPushButton{
-                    font: 28px "Microsoft YaHei UI";
-                    border: none;
-                    background-color: none;
-                    color: #3B8BB9;
-                    qproperty-icon:url(fig/undo.png);
-                    qproperty-iconSize:29px 29px;
-                    margin-left: 35px;
-                    width: 120px;
-                }
-                QPushButton:hover{
-                    font: bold 28px "Microsoft YaHei UI";
-                    border: none;
-                    background-color: none;
-                    color: #3B8BB9;
-                    qproperty-icon:url(fig/undo.png);
-                    qproperty-iconSize:29px 29px;
-                    margin-left: 35px;
-                }
-            ''')
-                self.Page3_Widget.UndoButton.setEnabled(True)
-        else:
-            self.SelectionIndicator[col_idx].append(SelectedIndicator)
-            self.ActionStack.append(('Select', col_idx))
-            if len(self.ActionStack) == 1:
-                self.Page3_Widget.UndoButton.setStyleSheet('''
-                QPushButton{
-                    font: 28px "Microsoft YaHei UI";
-                    border: none;
-                    background-color: none;
-                    color: #3B8BB9;
-                    qproperty-icon:url(fig/undo.png);
-                    qproperty-iconSize:29px 29px;
-                    margin-left: 35px;
-                    width: 120px;
-                }
-                QPushButton:hover{
-                    font: bold 28px "Microsoft YaHei UI";
-                    border: none;
-                    background-color: none;
-                    color: #3B8BB9;
-                    qproperty-icon:url(fig/undo.png);
-                    qproperty-iconSize:29px 29px;
-                    margin-left: 35px;
-                }
-            ''')
-                self.Page3_Widget.UndoButton.setEnabled(True)
+        # The whole query is recorded as one undoable action
+        self.SelectionIndex = self.SelectionState.apply(RejectedRows)
+        self.MissingStats.remove(self.SelectionState.changed)
+        self.ActionStack.append((Action, QueryText))
+        self.ClearRedoStack()
+        self.RecipeStack.append(self.PendingRecipeStep)
+        if len(self.ActionStack) == 1:
+            self.Page3_Widget.UndoButton.setStyleSheet('''
+            QPushButton{
+                font: 28px "Microsoft YaHei UI";
+                border: none;
+                background-color: none;
+                color: #3B8BB9;
+                qproperty-icon:url(fig/undo.png);
+                qproperty-iconSize:29px 29px;
+                margin-left: 35px;
+                width: 120px;
+            }
+            QPushButton:hover{
+                font: bold 28px "Microsoft YaHei UI";
+                border: none;
+                background-color: none;
+                color: #3B8BB9;
+                qproperty-icon:url(fig/undo.png);
+                qproperty-iconSize:29px 29px;
+                margin-left: 35px;
+            }
+        ''')
+            self.Page3_Widget.UndoButton.setEnabled(True)
         self.ChangePageDisplay()
         self.selectionbox.close()
         self.SelectionMethod = None
@@ -2656,13 +3442,50 @@ class Imputation_System(QWidget):
         self.SelectionRangeDown = None
         self.SelectionCondition = 0
         self.SelectionValue = None
-        # Whenever there are operations in page3 and page4/5 already initialized, 
-        # we have to re-initializa them
-        if self.page4_init:
-            self.page4_init = False
-            self.Step_Widget.step_layout_button5.hide()
-        if self.page5_init:
-            self.page5_init = False
+        self.SelectionQuery = None
+        self.InvalidatePreprocessedFrame()
+        self.InvalidatePage5()
+
+    def SelectionDisplay(self, RejectedRows, col_idx):
+        self.EnablePage3Buttons()
+        self.SelectionIndex = self.SelectionState.apply(RejectedRows)
+        self.MissingStats.remove(self.SelectionState.changed)
+        self.ActionStack.append(('Select', col_idx))
+        self.ClearRedoStack()
+        self.RecipeStack.append(self.PendingRecipeStep)
+        if len(self.ActionStack) == 1:
+            self.Page3_Widget.UndoButton.setStyleSheet('''
+            QPushButton{
+                font: 28px "Microsoft YaHei UI";
+                border: none;
+                background-color: none;
+                color: #3B8BB9;
+                qproperty-icon:url(fig/undo.png);
+                qproperty-iconSize:29px 29px;
+                margin-left: 35px;
+                width: 120px;
+            }
+            QPushButton:hover{
+                font: bold 28px "Microsoft YaHei UI";
+                border: none;
+                background-color: none;
+                color: #3B8BB9;
+                qproperty-icon:url(fig/undo.png);
+                qproperty-iconSize:29px 29px;
+                margin-left: 35px;
+            }
+        ''')
+            self.Page3_Widget.UndoButton.setEnabled(True)
+        self.ChangePageDisplay()
+        self.selectionbox.close()
+        self.SelectionMethod = None
+        self.SelectionRangeUp = None
+        self.SelectionRangeDown = None
+        self.SelectionCondition = 0
+        self.SelectionValue = None
+        self.SelectionQuery = None
+        self.InvalidatePreprocessedFrame()
+        self.InvalidatePage5()
 
     def SelectionProgressDisplay(self, counter):
         if counter == 1:
@@ -2677,6 +3500,42 @@ class Imputation_System(QWidget):
                 self.Page3_Widget.progressbar.hide()
                 self.Page3_Widget.PreprocessProgressLE.hide()        
 
+    def AnalyzeFeatures(self):
+        if self.AnalysisCache != None and self.AnalysisCache[0] == self.Page3Version:
+            self.AnalysisDisplay(*self.AnalysisCache)
+            return
+        version = self.Page3Version
+        self.AnalysisThread = AnalysisThread(self.df, self.FeatureDeleteFlag, self.CategoricalFlag, self.CategoricalTransformDict,
+                                             self.SelectionIndex, version, self.CachedPreprocessedFrame())
+        self.AnalysisThread.ThirdProgress.connect(self.AnalysisProgressDisplay)
+        self.AnalysisThread.AnalysisFinish.connect(self.AnalysisFinish)
+        self.DisablePage3Buttons()
+        self.AnalysisThread.start()
+
+    def AnalysisFinish(self, version, preprocessed, correlation, comissing):
+        self.EnablePage3Buttons()
+        self.StorePreprocessedFrame(preprocessed, version)
+        if version == self.Page3Version:
+            self.AnalysisCache = (version, correlation, comissing)
+        self.AnalysisDisplay(version, correlation, comissing)
+
+    def AnalysisDisplay(self, version, correlation, comissing):
+        self.analysisbox = AnalysisDialog(correlation, comissing)
+        self.analysisbox.show()
+
+    def AnalysisProgressDisplay(self, counter):
+        if counter == 1:
+            self.Page3_Widget.PreprocessProgressLE.setText("Analysis Process: ")
+            self.Page3_Widget.PreprocessProgressLE.show()
+            self.Page3_Widget.progressbar.setMaximum(3)
+            self.Page3_Widget.progressbar.show()
+            self.Page3_Widget.progressbar.setValue(counter)
+        else:
+            self.Page3_Widget.progressbar.setValue(counter)
+            if counter == 3:
+                self.Page3_Widget.progressbar.hide()
+                self.Page3_Widget.PreprocessProgressLE.hide()
+
     def DownloadProgressDisplay(self, counter):
         if counter == 1:
             self.Page3_Widget.PreprocessProgressLE.setText("Download Process: ")
@@ -2698,9 +3557,82 @@ class Imputation_System(QWidget):
         except PermissionError:
             QMessageBox.critical(self, "Permission Error", "Permission Error: The saved file is currently opened!", QMessageBox.Yes, QMessageBox.Yes)
 
+    def SelectionRecipeStep(self):
+        # The selection about to be started, with the parameters needed to replay it
+        name = str(self.df.columns[self.SelectionColumn])
+        if self.SelectionMethod == 'Range':
+            down, up = self.RangeBounds()
+            return self.RecipeClasses({'action': 'Select', 'column': name, 'method': 'Range', 'down': down, 'up': up}, [name])
+        elif self.SelectionMethod == 'Condition':
+            value = self.SelectionValue
+            if self.SelectionCondition in [12,13]:
+                value = value.pattern
+            return self.RecipeClasses({'action': 'Select', 'column': name, 'method': 'Condition', 'condition': selection.CONDITIONS[self.SelectionCondition], 'value': value}, [name])
+        elif self.SelectionMethod == 'Query':
+            RemainColumns = [str(self.df.columns[i]) for i in range(len(self.FeatureDeleteFlag)) if self.FeatureDeleteFlag[i] == False]
+            names = selection.query_columns(selection.compile_query(self.SelectionQuery, RemainColumns))
+            return self.RecipeClasses({'action': 'Query', 'query': self.SelectionQuery}, names)
+        elif self.SelectionMethod == 'Spatial':
+            SpatialMethod = ['Box', 'Radius'][self.selectionbox.SpatialMethodComboBox.currentIndex()]
+            return {'action': 'Spatial', 'method': SpatialMethod, 'args': [SpatialLE.text() for SpatialLE in self.selectionbox.SpatialLEs[:4 if SpatialMethod == 'Box' else 3]]}
+        texts = [TimeLE.text() for TimeLE in self.selectionbox.TimeLEs]
+        return {'action': 'Time', 'column': name, 'format': self.TimeFormat(), 'start': texts[0], 'end': texts[1], 'hours': texts[2], 'weekdays': texts[3]}
+
+    def RecipeClasses(self, step, names):
+        # The class codes of another extract may differ: keep the values behind the codes
+        classes = {}
+        for i in range(len(self.FeatureDeleteFlag)):
+            name = str(self.df.columns[i])
+            if name in names and self.FeatureDeleteFlag[i] == False and self.CategoricalFlag[i]:
+                classes[name] = pipeline.transform_classes(self.CategoricalTransformDict[i])
+        if len(classes) > 0:
+            step['classes'] = classes
+        return step
+
+    def ExportRecipe(self):
+        if len(self.RecipeStack) == 0:
+            QMessageBox.information(self, "Empty Recipe", "There are no preprocessing steps to export yet.", QMessageBox.Yes, QMessageBox.Yes)
+            return
+        savefile, _ = QFileDialog.getSaveFileName(self, 'Save Recipe', '.', '(*.json)')
+        if savefile == '':
+            return
+        try:
+            pipeline.save_recipe(self.RecipeStack, savefile)
+            QMessageBox.information(self, "Export Successfully", "The recipe has been exported successfully!", QMessageBox.Yes, QMessageBox.Yes)
+        except PermissionError:
+            QMessageBox.critical(self, "Permission Error", "Permission Error: The saved file is currently opened!", QMessageBox.Yes, QMessageBox.Yes)
+
+    def CachedPreprocessedFrame(self):
+        if self.PreprocessedFrame != None and self.PreprocessedFrame[0] == self.Page3Version:
+            return self.PreprocessedFrame[1]
+        return None
+
+    def StorePreprocessedFrame(self, df, version):
+        # A frame computed while Page 3 changed again is outdated already
+        if version == self.Page3Version:
+            self.PreprocessedFrame = (version, df)
+
+    def InvalidatePreprocessedFrame(self):
+        self.Page3Version += 1
+        self.PreprocessedFrame = None
+
+    def InvalidatePage5(self):
+        '''
+        Description:
+        Called on every Page 3 change: Page 4 (imputer, algorithm/parameter files) does not
+        depend on Page 3 and is kept, while Page 5 is imputed again on the next visit. With a
+        built-in imputer, the ImputationCache then only recomputes the affected columns and rows.
+        '''
+        if self.page5_init:
+            self.page5_init = False
+
     def UndoPreprocess(self):
         LastAction, col_idx = self.ActionStack[-1]
         self.ActionStack.pop(-1)
+        RecipeStep = self.RecipeStack.pop(-1)
+        # Keep what is needed to redo the action without recomputing it
+        Artifact = None
+        ArtifactBytes = 0
         if len(self.ActionStack) == 0:
             self.Page3_Widget.UndoButton.setStyleSheet('''
             QPushButton{
@@ -2726,38 +3658,77 @@ class Imputation_System(QWidget):
             self.Page3_Widget.UndoButton.setEnabled(False)
         if LastAction == 'Delete':
             self.FeatureDeleteFlag[col_idx] = False
-            AddMissingNum = self.df.iloc[:,col_idx].isnull().sum()
-            self.MissingNum += AddMissingNum
         elif LastAction == 'Transform':
             self.CategoricalFlag[col_idx] = False
-        elif LastAction ==  'Select':
-            self.SelectionIndicator[col_idx].pop(-1)
-            if len(self.SelectionIndicator[col_idx]) == 0:
-                self.SelectionFlag[col_idx] = False
-                self.SelectionIndicator[col_idx] = None
-            num_sample, _ = self.df.shape
-            OverallSelectionIndicator = np.array([True]*num_sample)
-            for i in range(len(self.SelectionIndicator)):
-                if self.SelectionIndicator[i] == None:
-                    continue
-                else:
-                    for indicator in self.SelectionIndicator[i]:
-                        try:
-                            OverallSelectionIndicator *= indicator
-                        except:
-                            print(OverallSelectionIndicator[0:20])
-                            print(indicator[0:20])
-                            OverallSelectionIndicator *= indicator
-            self.SelectionIndex = np.argwhere(OverallSelectionIndicator).reshape(-1,)
+            self.ColumnViewCache.pop(col_idx, None)
+            Artifact = self.CategoricalTransformDict[col_idx]
+            ArtifactBytes = pipeline.transform_dict_nbytes(Artifact)
+        elif LastAction in ['Select', 'Query', 'Spatial', 'Time']:
+            # Only the rows rejected by the last selection are touched
+            Artifact = self.SelectionState.pop()
+            self.MissingStats.add(self.SelectionState.changed)
+            ArtifactBytes = Artifact[0][1].nbytes
+            self.SelectionIndex = self.SelectionState.index
+        self.RedoStack.push(((LastAction, col_idx), RecipeStep, Artifact), ArtifactBytes)
+        self.SetRedoButton()
         self.ChangePageDisplay()
-        # Whenever there are operations in page3 and page4/5 already initialized, 
-        # we have to re-initializa them
-        if self.page4_init:
-            self.page4_init = False
-            self.Step_Widget.step_layout_button5.hide()
-        if self.page5_init:
-            self.page5_init = False
+        self.InvalidatePreprocessedFrame()
+        self.InvalidatePage5()
         
+    def RedoPreprocess(self):
+        (LastAction, col_idx), RecipeStep, Artifact = self.RedoStack.pop()
+        self.ActionStack.append((LastAction, col_idx))
+        self.RecipeStack.append(RecipeStep)
+        if LastAction == 'Delete':
+            self.FeatureDeleteFlag[col_idx] = True
+        elif LastAction == 'Transform':
+            # The transform dictionary of the undone action is reused
+            self.CategoricalFlag[col_idx] = True
+            self.CategoricalTransformDict[col_idx] = Artifact
+            self.ColumnViewCache.pop(col_idx, None)
+        elif LastAction in ['Select', 'Query', 'Spatial', 'Time']:
+            # The packed rejected rows are pushed back with their serial number, so the
+            # ImputationCache entries of this selection are found again
+            self.SelectionState.push(*Artifact)
+            self.SelectionIndex = self.SelectionState.index
+            self.MissingStats.remove(self.SelectionState.changed)
+        if len(self.ActionStack) == 1:
+            self.Page3_Widget.UndoButton.setStyleSheet('''
+            QPushButton{
+                font: 28px "Microsoft YaHei UI";
+                border: none;
+                background-color: none;
+                color: #3B8BB9;
+                qproperty-icon:url(fig/undo.png);
+                qproperty-iconSize:29px 29px;
+                margin-left: 35px;
+                width: 120px;
+            }
+            QPushButton:hover{
+                font: bold 28px "Microsoft YaHei UI";
+                border: none;
+                background-color: none;
+                color: #3B8BB9;
+                qproperty-icon:url(fig/undo.png);
+                qproperty-iconSize:29px 29px;
+                margin-left: 35px;
+            }
+        ''')
+            self.Page3_Widget.UndoButton.setEnabled(True)
+        self.SetRedoButton()
+        self.ChangePageDisplay()
+        self.InvalidatePreprocessedFrame()
+        self.InvalidatePage5()
+
+    def ClearRedoStack(self):
+        if len(self.RedoStack) > 0:
+            self.RedoStack.clear()
+            self.SetRedoButton()
+
+    def SetRedoButton(self):
+        self.Page3_Widget.RedoButton.setStyleSheet(RedoButtonStyle('#3B8BB9' if len(self.RedoStack) > 0 else '#bfbfbf'))
+        self.Page3_Widget.RedoButton.setEnabled(len(self.RedoStack) > 0)
+
     def DisablePage3Buttons(self):
         # ======================BUTTONS IN THE STEP BAR========================
         self.Step_Widget.step_layout_button1.setEnabled(False)
@@ -2768,7 +3739,10 @@ class Imputation_System(QWidget):
         # ======================BUTTONS IN THE TOOLBAR=========================
         self.Page3_Widget.InputLineNumber.setEnabled(False)
         self.Page3_Widget.UndoButton.setEnabled(False)
+        self.Page3_Widget.RedoButton.setEnabled(False)
         self.Page3_Widget.DownloadButton.setEnabled(False)
+        self.Page3_Widget.RecipeButton.setEnabled(False)
+        self.Page3_Widget.AnalysisButton.setEnabled(False)
         # ========================BACK-NEXT BUTTONS============================
         self.Page3_Widget.back_button.setEnabled(False)
         self.Page3_Widget.next_button.setEnabled(False)
@@ -2786,7 +3760,10 @@ class Imputation_System(QWidget):
             self.Page3_Widget.UndoButton.setEnabled(False)
         else:
             self.Page3_Widget.UndoButton.setEnabled(True)
+        self.Page3_Widget.RedoButton.setEnabled(len(self.RedoStack) > 0)
         self.Page3_Widget.DownloadButton.setEnabled(True)
+        self.Page3_Widget.RecipeButton.setEnabled(True)
+        self.Page3_Widget.AnalysisButton.setEnabled(True)
         # ========================BACK-NEXT BUTTONS============================
         self.Page3_Widget.back_button.setEnabled(True)
         self.Page3_Widget.next_button.setEnabled(True)        
@@ -2836,6 +3813,17 @@ class Imputation_System(QWidget):
         if self.page5_init:
             self.page5_init = False
 
+    def Page4Imputer(self):
+        # The selected built-in imputer, None for the uploaded algorithm
+        return self.Page4_Widget.Imputers[max(0, self.Page4_Widget.ImputerComboBox.currentIndex())]
+
+    def Page4ChangeImputer(self):
+        self.Page4_Widget.FillValueLE.setEnabled(self.Page4Imputer() == 'constant')
+        self.Page4_Widget.NeighborsLE.setEnabled(self.Page4Imputer() == 'knn')
+        self.Page4_Widget.WeightsComboBox.setEnabled(self.Page4Imputer() == 'knn')
+        if self.page5_init:
+            self.page5_init = False
+
     def DisablePage4Buttons(self):
         # ======================BUTTONS IN THE STEP BAR========================
         self.Step_Widget.step_layout_button1.setEnabled(False)
@@ -2846,9 +3834,16 @@ class Imputation_System(QWidget):
         # ==========================SELECT BUTTONS=============================
         self.Page4_Widget.AlgUploadButton.setEnabled(False)
         self.Page4_Widget.ParUploadButton.setEnabled(False)
+        self.Page4_Widget.ImputerComboBox.setEnabled(False)
+        self.Page4_Widget.FillValueLE.setEnabled(False)
+        self.Page4_Widget.NeighborsLE.setEnabled(False)
+        self.Page4_Widget.WeightsComboBox.setEnabled(False)
         # ==========================DELETE BUTTONS=============================
-        self.Page4_Widget.AlgFileTable.cellWidget(0, 1).delete_button.setEnabled(False)
-        self.Page4_Widget.ParFileTable.cellWidget(0, 1).delete_button.setEnabled(False)
+        # With a built-in imputer, the files need not be uploaded
+        if self.Page4_Widget.AlgFileTable.rowCount() > 0:
+            self.Page4_Widget.AlgFileTable.cellWidget(0, 1).delete_button.setEnabled(False)
+        if self.Page4_Widget.ParFileTable.rowCount() > 0:
+            self.Page4_Widget.ParFileTable.cellWidget(0, 1).delete_button.setEnabled(False)
         # ========================BACK-NEXT BUTTONS============================
         self.Page4_Widget.back_button.setEnabled(False)
         self.Page4_Widget.next_button.setEnabled(False)
@@ -2863,9 +3858,16 @@ class Imputation_System(QWidget):
         # ==========================SELECT BUTTONS=============================
         self.Page4_Widget.AlgUploadButton.setEnabled(True)
         self.Page4_Widget.ParUploadButton.setEnabled(True)
+        self.Page4_Widget.ImputerComboBox.setEnabled(True)
+        self.Page4_Widget.FillValueLE.setEnabled(self.Page4Imputer() == 'constant')
+        self.Page4_Widget.NeighborsLE.setEnabled(self.Page4Imputer() == 'knn')
+        self.Page4_Widget.WeightsComboBox.setEnabled(self.Page4Imputer() == 'knn')
         # ==========================DELETE BUTTONS=============================
-        self.Page4_Widget.AlgFileTable.cellWidget(0, 1).delete_button.setEnabled(True)
-        self.Page4_Widget.ParFileTable.cellWidget(0, 1).delete_button.setEnabled(True)
+        # With a built-in imputer, the files need not be uploaded
+        if self.Page4_Widget.AlgFileTable.rowCount() > 0:
+            self.Page4_Widget.AlgFileTable.cellWidget(0, 1).delete_button.setEnabled(True)
+        if self.Page4_Widget.ParFileTable.rowCount() > 0:
+            self.Page4_Widget.ParFileTable.cellWidget(0, 1).delete_button.setEnabled(True)
         # ========================BACK-NEXT BUTTONS============================
         self.Page4_Widget.back_button.setEnabled(True)
         self.Page4_Widget.next_button.setEnabled(True)
@@ -2880,7 +3882,25 @@ class Imputation_System(QWidget):
             self.Page4_Widget.progressbar.setValue(CurrentNum)
             if CurrentNum == TotalNum:
                 self.Page4_Widget.progressbar.hide()
-                self.Page4_Widget.ImputeProgressLE.hide()        
+                self.Page4_Widget.ImputeProgressLE.hide()
+                self.Page4_Widget.StopButton.hide()
+
+    def Page5ImputationFailed(self, message):
+        self.Page5ImputationCancelled()
+        QMessageBox.critical(self, "Imputation Error", message, QMessageBox.Yes, QMessageBox.Yes)
+
+    def Page5ImputationCancelled(self):
+        # Stay on page 4, the next attempt runs the imputation again
+        self.pagenum = 4
+        self.page5_init = False
+        self.Page4_Widget.progressbar.hide()
+        self.Page4_Widget.ImputeProgressLE.hide()
+        self.Page4_Widget.StopButton.hide()
+        self.EnablePage4Buttons()
+
+    def Page4StopImputation(self):
+        if isinstance(self.page5_ImputationThread, PluginImputationThread):
+            self.page5_ImputationThread.cancel()
 
     def Page5_DisplayTable(self, df, dfisnull):
         self.EnablePage4Buttons()
@@ -2892,7 +3912,12 @@ class Imputation_System(QWidget):
         self.Page5_Widget.back_button.clicked.connect(self.GOTO_Page4)
         self.Page5_Widget.DownloadButton.clicked.connect(self.Page5DownloadFile)
         self.Page5_Widget.RedoButton.clicked.connect(self.ReImpute)
-        self.Page5_Widget.InputLineNumber.editingFinished.connect(self.Page5ChangeDisplay)
+        self.Page5_Widget.InputLineNumber.editingFinished.connect(lambda: self.GoToRow(self.Page5_Widget))
+        self.Page5SearchIndex = search.SearchIndex(self.impute_df)
+        self.Page5_Widget.SearchLE.returnPressed.connect(lambda: self.Search(self.Page5_Widget, self.Page5SearchIndex))
+        self.Page5_Widget.SearchLE.textEdited.connect(lambda: self.BuildSearchIndex(self.Page5_Widget, self.Page5SearchIndex))
+        self.Page5SortIndex = search.SortIndex(self.impute_df)
+        self.Page5_Widget.MainWindow.horizontalHeader().sectionClicked.connect(lambda section: self.SortTable(self.Page5_Widget, section, self.Page5SortDisplay))
         self.Page5_Widget.MainWindow.customContextMenuRequested.connect(self.generateMenuPage5)
         # It seems that people can only jump to page5 from page4
         self.Page4_Widget.hide()
@@ -2910,38 +3935,6 @@ class Imputation_System(QWidget):
         except PermissionError:
             QMessageBox.critical(self, "Permission Error", "Permission Error: The saved file is currently opened!", QMessageBox.Yes, QMessageBox.Yes)
 
-    def Page5ChangeDisplay(self):
-        num_row, num_col = self.impute_df.shape
-        try:
-            PageNumber = int(self.Page5_Widget.InputLineNumber.text())
-        except:
-            PageNumber = 1
-        TotalPage = int(num_row/100)+1
-        if PageNumber > TotalPage:
-            PageNumber = TotalPage
-            self.Page5_Widget.InputLineNumber.setText(str(TotalPage))
-            QMessageBox.warning(self, "Warning", "Page number out of, jump to the last page!", QMessageBox.Yes, QMessageBox.Yes)
-        elif PageNumber <= 0:
-            PageNumber = 1
-            self.Page5_Widget.InputLineNumber.setText(str(1))
-            QMessageBox.warning(self, "Warning", "Page number out of, jump to the first page!", QMessageBox.Yes, QMessageBox.Yes)
-        self.Page5_Widget.MainWindow.clear()
-        start_row = 100 * (PageNumber - 1)
-        end_row = min(num_row, 100 * PageNumber)
-        for i in range(start_row, end_row):
-            for j in range(num_col):
-                CurItem = QTableWidgetItem(str(self.impute_df.iat[i, j]))
-                if self.dfisnull.iat[i, j]:
-                    if str(self.impute_df.iat[i, j]) == 'nan':
-                        CurItem = QTableWidgetItem()
-                    CurItem.setBackground(QBrush(QColor(201,252,255)))
-                self.Page5_Widget.MainWindow.setItem(i-start_row, j, CurItem)
-        vertical_header = [str(i+1) for i in range(start_row, start_row+self.Page5_Widget.MainWindow.rowCount())]
-        self.Page5_Widget.MainWindow.setVerticalHeaderLabels(vertical_header)
-        self.Page5_Widget.MainWindow.verticalHeader().show()
-        self.Page5_Widget.MainWindow.setHorizontalHeaderLabels(list(self.impute_df.columns))
-        self.Page5_Widget.MainWindow.resizeColumnsToContents()
-
     def generateMenuPage5(self, pos):
         colNum = float('inf')
         for i in self.Page5_Widget.MainWindow.selectionModel().selection().indexes():
@@ -2961,20 +3954,14 @@ class Imputation_System(QWidget):
             _ = menu.exec_(screenpos)
 
     def RejectValueProcess(self, rowNum, colNum):
-        try:
-            pagenum = int(self.Page5_Widget.InputLineNumber.text())
-        except:
-            pagenum = 1
-        rowNum_all = (pagenum-1)*100 + rowNum
-        currentvalue = str(self.impute_df.iat[rowNum_all, colNum])
+        currentvalue = str(self.Page5_Widget.model.value(*self.Page5_Widget.model.position(rowNum, colNum)))
         question = "Reject this value: "+currentvalue+"?"
         result = QMessageBox.question(self, "Comfirmation", question, QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
         if result == QMessageBox.Yes:
-            self.impute_df.iat[rowNum_all, colNum] = np.nan
-            self.dfisnull.iat[rowNum_all, colNum] = True
-            EmptyTableItem = QTableWidgetItem()
-            EmptyTableItem.setBackground(QBrush(QColor(201,252,255)))
-            self.Page5_Widget.MainWindow.setItem(rowNum, colNum, EmptyTableItem)
+            self.Page5_Widget.model.setValue(rowNum, colNum, np.nan, True)
+            self.impute_df, self.dfisnull = self.Page5_Widget.model.df, self.Page5_Widget.model.isnull
+            self.Page5SearchIndex.drop(self.impute_df, colNum)
+            self.Page5SortIndex.drop(self.impute_df, colNum)
             self.Page5_Widget.RedoButton.setEnabled(True)
             self.Page5_Widget.RedoButton.setStyleSheet('''
             QPushButton{
@@ -3001,12 +3988,7 @@ class Imputation_System(QWidget):
         ''')
     
     def RewriteValueProcess(self, rowNum, colNum):
-        try:
-            pagenum = int(self.Page5_Widget.InputLineNumber.text())
-        except:
-            pagenum = 1
-        rowNum_all = (pagenum-1)*100 + rowNum
-        currentvalue = str(self.impute_df.iat[rowNum_all, colNum])
+        currentvalue = str(self.Page5_Widget.model.value(*self.Page5_Widget.model.position(rowNum, colNum)))
         self.page5RewriteDialog = RewriteDialog(currentvalue)
         self.page5RewriteDialog.Newvalue.editingFinished.connect(self.GetRewriteValue)
         self.page5RewriteDialog.OKButton.clicked.connect(lambda: self.AssertRewriteValue(rowNum, colNum))
@@ -3031,14 +4013,10 @@ class Imputation_System(QWidget):
         if self.RewriteNewValue == None:
             QMessageBox.critical(self.selectionbox, "Error", "Please enter new value!", QMessageBox.Yes, QMessageBox.Yes)
             return
-        try:
-            pagenum = int(self.Page5_Widget.InputLineNumber.text())
-        except:
-            pagenum = 1
-        rowNum_all = (pagenum-1)*100 + rowNum
-        self.impute_df.iat[rowNum_all, colNum] = self.RewriteNewValue
-        self.dfisnull.iat[rowNum_all, colNum] = False
-        self.Page5_Widget.MainWindow.setItem(rowNum, colNum, QTableWidgetItem(str(self.RewriteNewValue)))
+        self.Page5_Widget.model.setValue(rowNum, colNum, self.RewriteNewValue, False)
+        self.impute_df, self.dfisnull = self.Page5_Widget.model.df, self.Page5_Widget.model.isnull
+        self.Page5SearchIndex.drop(self.impute_df, colNum)
+        self.Page5SortIndex.drop(self.impute_df, colNum)
         self.Page5_Widget.RedoButton.setEnabled(True)
         self.Page5_Widget.RedoButton.setStyleSheet('''
             QPushButton{
@@ -3069,10 +4047,13 @@ class Imputation_System(QWidget):
     def ReImpute(self):
         pass
 
-if __name__ == '__main__':
+def main():
     app = QApplication(sys.argv)
     app.setWindowIcon(QIcon('fig/zju.png'))
-    main = Imputation_System()
-    main.showMaximized()
-    sys.exit(app.exec_())
+    window = Imputation_System()
+    window.showMaximized()
+    return app.exec_()
+
+if __name__ == '__main__':
+    sys.exit(main())
     
\ No newline at end of file
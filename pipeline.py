@@ -0,0 +1,704 @@
+import sys
+import json
+import warnings
+import collections
+import itertools
+import numpy as np
+import pandas as pd
+import merge
+import plan
+import selection
+import spatial
+import timeindex
+
+MERGE_METHODS = ['Smart', 'Union', 'Intersection', 'First']
+IMPUTERS = ['mean', 'median', 'most_frequent', 'constant', 'none']
+
+def merge_two_file(file1, file2, how):
+    '''
+    Description:
+    Merging two files according to the user-specified methods
+    
+    Parameters:
+    file1: str - name of the first file
+    file2: str - name of the second file
+    how:   str - user-specified merge method 
+        *Note*: all files should have their first columns as 'index/id'
+
+        Explanations for different choices of 'how':
+        (1) 'intersection':
+            When merging files, for overlapping features, we only choose the intersected samples
+        (2) 'union': (default)
+            When merging files, we create new samples for those do not overlap with each other
+        (3) 'first'
+            All other files align to the first file, i.e., all samples in the merged file is all  
+            tge samples in the first file. This is commonly used if the first file contains most
+            of the data and following files are used to provide some samll amount of additional info.
+
+    Output:
+    df:    pd.DataFrame - the merged DataFrame for given two files
+    '''
+    if type(file1) == str:
+        # check the file-type first
+        if file1[len(file1) - 4:] == '.csv':
+            df1 = pd.read_csv(file1)
+        elif file1[len(file1) - 5:] == '.xlsx':
+            df1 = pd.read_excel(file1)
+        else:
+            raise ValueError("Invalid input file type!!")
+
+        # Pre-process the DataFrame
+        # (1) Drop the completely empty columns        
+        empty_col1 = np.sum(df1.isnull(), axis=0) == df1.shape[0]
+        empty_col_idx1 = df1.columns[np.array(range(df1.shape[1]))[empty_col1]]
+        df1.drop(empty_col_idx1, axis=1, inplace=True)
+        # (2) Drop the completely empty rows
+        empty_row1 = np.sum(df1.isnull(), axis=1) == df1.shape[1]
+        empty_row_idx1 = df1.index[np.array(range(df1.shape[0]))[empty_row1]]
+        df1.drop(empty_row_idx1, axis=0, inplace=True)
+        # (3) Change the name of the first column
+        first_col_name1 = df1.columns[0]
+        df1.rename(columns={first_col_name1: '__id__'}, inplace=True)
+    elif type(file1) == pd.core.frame.DataFrame:
+        df1 = file1
+    else:
+        raise ValueError("Invalid input file type!!")
+
+    if type(file2) == str:
+        if file2[len(file2) - 4:] == '.csv':
+            df2 = pd.read_csv(file2)
+        elif file2[len(file2) - 5:] == '.xlsx':
+            df2 = pd.read_excel(file2)
+        else:
+            raise ValueError("Invalid input file type")
+
+        empty_col2 = np.sum(df2.isnull(), axis=0) == df2.shape[0]
+        empty_col_idx2 = df2.columns[np.array(range(df2.shape[1]))[empty_col2]]
+        df2.drop(empty_col_idx2, axis=1, inplace=True)
+
+        empty_row2 = np.sum(df2.isnull(), axis=1) == df2.shape[1]
+        empty_row_idx2 = df2.index[np.array(range(df2.shape[0]))[empty_row2]]
+        df2.drop(empty_row_idx2, axis=0, inplace=True)
+        first_col_name2 = df2.columns[0]
+        df2.rename(columns={first_col_name2: '__id__'}, inplace=True)
+    elif type(file2) == pd.core.frame.DataFrame:
+        df2 = file2
+    else:
+        raise ValueError("Invalid input file type!!")
+
+    # Start the merging
+    # Case3: (N1, d1) and (N2, d2) - differnt samples & different features - 'intersection'
+    if how == 'Intersection':
+        df = pd.merge(df1, df2, how='inner')
+    # Case4: (N1, d1) and (N2, d2) - differnt samples & different features - 'union'
+    elif how == 'Union':
+        df = pd.merge(df1, df2, how='outer')
+    # Case5: (N1, d1) and (N2, d2) - differnt samples & different features - 'first'
+    elif how == 'First':
+        df = pd.merge(df1, df2, 'left')
+    else:
+        raise ValueError("The parameter how is invalid")
+    return df
+
+def merge_files(files, how='Union'):
+    '''
+    Description:
+    Merging a list of input files according to the user-specified methods
+    
+    Parameters:
+    files: list of str - list of all input strings to be merged
+    how:   str         - user-specified merge method, one of MERGE_METHODS but 'Smart'
+        
+    Output:
+    df:    pd.DataFrame - the merged DataFrame for all given files
+    '''
+    if not how in MERGE_METHODS or how == 'Smart':
+        raise ValueError("Unknown merge method '%s'!" % how)
+    if len(files) == 0:
+        return 0
+    if len(files) == 1:
+        return merge_two_file(files[0], files[0], how=how)
+    df = merge_two_file(files[0], files[1], how)
+    for i in range(2, len(files)):
+        df = merge_two_file(df, files[i], how)
+    return df
+
+def is_text(item):
+    try:
+        float(item)
+        return False
+    except:
+        return True
+
+def error_detection(df):
+    '''
+    Description:
+    Given a panda dataframe, detect all possible errors according to *datatype* in each column
+    
+    Parameter:
+    df:         pd.DataFrame - Input dataframe to be detected
+
+    Output:
+    col_idx:    list of column indices, which contain errors
+    row_idx:    list of list of row indices
+    '''
+    col_idx = []
+    row_idx = []
+    num_sample, num_feature = df.shape
+    for j in range(num_feature):
+        feature_istext = np.array(df.iloc[:,j].map(lambda x : is_text(x)))
+        num_text = np.sum(feature_istext)
+        if num_sample == 0:
+            break
+        if num_text/num_sample >= 0.05:
+            continue
+        else:
+            col_idx.append(j)
+            row_idx.append(np.argwhere(feature_istext))
+    return col_idx, row_idx
+
+def load_files(files, how='Smart'):
+    '''
+    Description:
+    Read and merge the input files. 'Smart' is the merge of the GUI (MergeFileThread): columns
+    with the same name are matched on their values; the other methods are those of merge_files
+
+    Parameters:
+    files: list of str - the input .csv/.xlsx files
+    how:   str         - one of MERGE_METHODS
+
+    Output:
+    df:    pd.DataFrame - the merged DataFrame
+    '''
+    if len(files) == 0:
+        raise ValueError("There are no input files!")
+    if how == 'Smart':
+        return merge_smart(files)
+    elif how in MERGE_METHODS:
+        return merge_files(files, how)
+    raise ValueError("Unknown merge method '%s'!" % how)
+
+def merge_smart(files, progress=None):
+    '''
+    Description:
+    The merge of MergeFileThread (see merge.MergeTwoFile), file after file
+
+    Parameters:
+    files:    list of str - the input files
+    progress: callable    - progress(num_merged, num_files), called after every merge step
+    '''
+    if progress == None:
+        progress = lambda num_merged, num_files: None
+    if len(files) == 1:
+        df = merge.FilePreprocess(files[0])
+        progress(1, 1)
+        return df
+    progress(0, len(files))
+    df, RealCol = merge.MergeTwoFile(files[0], files[1], None)
+    progress(2, len(files))
+    for i in range(2, len(files)):
+        df, RealCol = merge.MergeTwoFile(df, files[i], RealCol)
+        progress(i+1, len(files))
+    return df
+
+def select_rows(features, SelectionMethod, SelectionRangeDown=None, SelectionRangeUp=None, SelectionCondition=0, SelectionValue=None):
+    '''
+    Description:
+    The 'Range'/'Condition' selection of SelectionThread on one feature
+
+    Parameters:
+    features:           pd.Series - the (transformed) feature
+    SelectionMethod:    str       - 'Range' or 'Condition'
+    SelectionRangeDown: float     - lower bound of 'Range', None for no lower bound
+    SelectionRangeUp:   float     - upper bound of 'Range', None for no upper bound
+    SelectionCondition: int       - index in selection.CONDITIONS
+    SelectionValue:     str/float - the value of 'Condition' (a compiled pattern for the regex conditions)
+
+    Output:
+    SelectedIndicator:  np.ndarray of bool
+    '''
+    if SelectionMethod == 'Range':
+        return selection.range_mask(features, SelectionRangeDown, SelectionRangeUp)
+    elif SelectionMethod == 'Condition':
+        return selection.condition_mask(features, SelectionCondition, SelectionValue)
+    raise ValueError("Unknown selection method '%s'!" % str(SelectionMethod))
+
+def build_transform_dict(features):
+    '''
+    Description:
+    Categorical transform of a feature, as computed by TransformThread: every distinct
+    non-missing value gets a class code, in the order of first appearance
+
+    Output:
+    TransformDict: dict - value -> class code
+    '''
+    TransformDict = {}
+    for x in pd.unique(np.asarray(features, dtype=object)):
+        if str(x) != 'nan' and not x in TransformDict:
+            TransformDict[x] = len(TransformDict)
+    return TransformDict
+
+def transform_classes(TransformDict):
+    '''
+    Description:
+    The values of a categorical transform in the order of their class codes, as saved in a
+    recipe: the codes of another extract may differ, the values do not
+
+    Output:
+    classes: list - classes[code] is the value transformed into code
+    '''
+    classes = [None] * len(TransformDict)
+    for x, code in TransformDict.items():
+        classes[code] = x.item() if isinstance(x, np.generic) else x
+    return classes
+
+def impute(df, imputer='mean', fill_value=0, categorical=()):
+    '''
+    Description:
+    Imputation with a built-in imputer (see imputation_fills). Only the imputed columns are
+    materialized, all the others are shared with df.
+
+    Output:
+    df: pd.DataFrame - the imputed data
+    '''
+    return fill_missing(df, imputation_fills(df, imputer, fill_value, categorical))
+
+def parse_fill_value(text):
+    # The constant of the 'constant' imputer: a number when it reads as one, the text otherwise
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return text
+
+def imputation_fills(df, imputer='mean', fill_value=0, categorical=()):
+    '''
+    Description:
+    The fill value of every column with missing values, computed for all the columns at once:
+    (1) 'mean'/'median': a single nanmean/nanmedian reduction over the numerical columns,
+        stacked as one 2-D array
+    (2) 'most_frequent': through the codes of the columns (see most_frequent)
+    (3) 'constant': fill_value everywhere
+    The categorical columns (class codes) and the non-numerical ones get their most frequent
+    value with 'mean'/'median' too, the mean of class codes or of texts being meaningless.
+
+    Parameters:
+    imputer:     str         - one of IMPUTERS but 'none'
+    fill_value:  object      - the constant of the 'constant' imputer
+    categorical: list of int - positions of the columns holding class codes
+
+    Output:
+    fills: dict - col_idx -> fill value
+    '''
+    if not imputer in IMPUTERS or imputer == 'none':
+        raise ValueError("Unknown imputer '%s'!" % imputer)
+    missing = np.flatnonzero(df.isnull().any().to_numpy()).tolist()
+    if imputer == 'constant':
+        return dict([(i, fill_value) for i in missing])
+    fills = {}
+    if imputer in ['mean', 'median']:
+        numerical = [i for i in missing if not i in categorical and pd.api.types.is_numeric_dtype(df.dtypes.iloc[i])
+                     and not pd.api.types.is_bool_dtype(df.dtypes.iloc[i])]
+        if len(numerical) > 0:
+            values = df.iloc[:, numerical].to_numpy(dtype=np.float64, na_value=np.nan)
+            with warnings.catch_warnings():
+                # An all-missing column reduces to NaN and is left as it is
+                warnings.simplefilter('ignore', RuntimeWarning)
+                reduced = np.nanmean(values, axis=0) if imputer == 'mean' else np.nanmedian(values, axis=0)
+            fills.update(zip(numerical, reduced))
+    fills.update(most_frequent(df, [i for i in missing if not i in fills]))
+    return dict([(i, value) for i, value in sorted(fills.items()) if not pd.isnull(value)])
+
+def most_frequent(df, columns):
+    '''
+    Description:
+    The most frequent value of each of the given columns (the first one met on ties). Every
+    column is turned into codes, its counts are taken by one bincount into its segment of a
+    shared counts array, and the argmax of all the segments is then found at once.
+
+    Output:
+    fills: dict - col_idx -> most frequent value, for the columns with at least one value
+    '''
+    uniques = []
+    counts = []
+    for i in columns:
+        codes, values = pd.factorize(df.iloc[:,i])
+        if len(values) > 0:
+            uniques.append((i, values))
+            counts.append(np.bincount(codes[codes >= 0], minlength=len(values)))
+    if len(counts) == 0:
+        return {}
+    lengths = np.array([len(values) for _, values in uniques])
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    counts = np.concatenate(counts)
+    maxima = np.maximum.reduceat(counts, starts)
+    best = np.flatnonzero(counts == np.repeat(maxima, lengths))
+    # First maximum of every segment
+    best = best[np.searchsorted(best, starts)] - starts
+    return dict([(uniques[k][0], uniques[k][1][best[k]]) for k in range(len(uniques))])
+
+def fill_missing(df, fills):
+    '''
+    Description:
+    Fill the missing values of df in a single fillna over the columns to fill; only those
+    columns are materialized, all the others are shared with df
+
+    Parameters:
+    fills: dict - col_idx -> fill value, as returned by imputation_fills
+    '''
+    if len(fills) == 0:
+        return df
+    columns = list(fills.keys())
+    block = df.iloc[:, columns]
+    block.columns = range(len(columns))
+    block = block.fillna(dict(enumerate(fills.values())))
+    return plan.replace_columns(df, dict([(columns[k], block.iloc[:,k]) for k in range(len(columns))]))
+
+class ImputationCache(object):
+    '''
+    Description:
+    Per-column cache of the preprocessed and imputed columns, so that a Page 3 change only
+    recomputes what depends on it. An imputed column depends on its raw values, its categorical
+    transform and the row selection:
+    (1) deleting/transforming a column leaves the cached entries of the other columns valid
+    (2) a new selection derives the column from the cached entry of the previous selection by
+        keeping its remaining rows (the raw data is not read and the transform is not redone);
+        only the imputation itself is recomputed
+    (3) undoing finds the entry of the restored selection again
+    The imputed columns of an entry are kept for the imputer they were computed with; all the
+    columns still to impute are then imputed together (see impute).
+
+    Parameters:
+    df:          pd.DataFrame - the raw data, never modified
+    max_entries: int          - number of cached selections per column
+    '''
+    def __init__(self, df, max_entries=3):
+        self.df = df
+        self.max_entries = max_entries
+        self.entries = dict([(i, []) for i in range(df.shape[1])])
+
+    def lookup(self, i, TransformDict, key):
+        # The entry of this very selection, else the entry of the largest enclosing selection
+        exact = None
+        parent = None
+        for entry in self.entries[i]:
+            if entry['TransformDict'] is not TransformDict:
+                continue
+            if entry['key'] == key:
+                exact = entry
+            elif entry['key'] == key[:len(entry['key'])] and (parent == None or len(entry['key']) > len(parent['key'])):
+                parent = entry
+        return exact, parent
+
+    def store(self, i, entry):
+        # Most recently used first
+        self.entries[i] = [entry] + [old for old in self.entries[i] if old is not entry][:self.max_entries - 1]
+
+    def impute(self, FeatureDeleteFlag, CategoricalFlag, CategoricalTransformDict, SelectionIndex, SelectionKey, imputer='mean', fill_value=0):
+        '''
+        Description:
+        The preprocessed and imputed frames of the given Page 3 state
+
+        Parameters:
+        SelectionKey: tuple  - selection.SelectionState.key of SelectionIndex
+        imputer:      str    - one of IMPUTERS but 'none'
+        fill_value:   object - the constant of the 'constant' imputer
+
+        Output:
+        preprocessed: pd.DataFrame - as returned by plan.preprocess
+        imputed:      pd.DataFrame - as returned by impute(preprocessed, imputer, fill_value, categorical)
+        isnull:       pd.DataFrame - the missing indicator of preprocessed
+        counts:       dict         - number of columns 'reused', 'derived' and 'computed'
+        '''
+        rows = np.asarray(SelectionIndex).reshape(-1,)
+        kept = [i for i in range(len(FeatureDeleteFlag)) if FeatureDeleteFlag[i] == False]
+        counts = {'reused': 0, 'derived': 0, 'computed': 0}
+        columns = {}
+        missing = []
+        for i in kept:
+            TransformDict = CategoricalTransformDict[i] if CategoricalFlag[i] else None
+            exact, parent = self.lookup(i, TransformDict, SelectionKey)
+            if exact != None:
+                counts['reused'] += 1
+                columns[i] = exact
+            elif parent != None:
+                counts['derived'] += 1
+                # Both row sets are sorted and the new one is a subset of the parent one
+                feature = parent['feature'].iloc[np.searchsorted(parent['rows'], rows)]
+                columns[i] = self.entry(TransformDict, SelectionKey, rows, feature)
+            else:
+                missing.append(i)
+        if len(missing) > 0:
+            counts['computed'] = len(missing)
+            scan = ('Scan', rows, [(i, CategoricalTransformDict[i] if CategoricalFlag[i] else None) for i in missing])
+            computed = plan.execute_plan(self.df, scan)
+            for k in range(len(missing)):
+                i = missing[k]
+                columns[i] = self.entry(scan[2][k][1], SelectionKey, rows, computed.iloc[:,k])
+        # The columns not imputed yet with this imputer are imputed together
+        method = (imputer, fill_value)
+        pending = [i for i in kept if columns[i]['imputer'] != method]
+        if len(pending) > 0:
+            frame = pd.DataFrame(dict([(k, columns[pending[k]]['feature'].array) for k in range(len(pending))]), copy=False)
+            categorical = [k for k in range(len(pending)) if columns[pending[k]]['TransformDict'] is not None]
+            imputed = impute(frame, imputer, fill_value, categorical)
+            for k in range(len(pending)):
+                columns[pending[k]]['imputer'] = method
+                columns[pending[k]]['imputed'] = imputed.iloc[:,k]
+        for i in kept:
+            self.store(i, columns[i])
+        index = self.df.index[rows]
+        frames = []
+        for name in ['feature', 'imputed', 'isnull']:
+            frame = pd.DataFrame(dict([(k, columns[kept[k]][name].array) for k in range(len(kept))]), index=index, copy=False)
+            frame.columns = self.df.columns[kept]
+            frames.append(frame)
+        return frames[0], frames[1], frames[2], counts
+
+    def entry(self, TransformDict, key, rows, feature):
+        feature = feature.reset_index(drop=True)
+        return {'TransformDict': TransformDict, 'key': key, 'rows': rows, 'feature': feature, 'imputer': None, 'imputed': None,
+                'isnull': feature.isnull()}
+
+def transform_dict_nbytes(TransformDict, num_sample=1000):
+    '''
+    Description:
+    Memory estimate of a transform dictionary: sys.getsizeof only counts the table of the dict,
+    so the average size of its keys and values, measured on a sample of entries, is added for
+    every entry
+
+    Output:
+    nbytes: int
+    '''
+    nbytes = sys.getsizeof(TransformDict)
+    if len(TransformDict) == 0:
+        return nbytes
+    sample = list(itertools.islice(TransformDict.items(), num_sample))
+    per_entry = sum([sys.getsizeof(key) + sys.getsizeof(value) for key, value in sample]) / len(sample)
+    return int(nbytes + per_entry * len(TransformDict))
+
+class RedoStack(object):
+    '''
+    Description:
+    The undone Page 3 actions, with the artifacts needed to redo them without recomputation
+    (transform dictionaries, packed selection actions). The artifacts are kept under a memory
+    cap: the least recently undone entries, at the bottom of the stack, are evicted first.
+
+    Parameters:
+    max_bytes: int - memory cap of the artifacts
+    '''
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self.entries = []
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def push(self, entry, nbytes):
+        self.entries.append((entry, nbytes))
+        self.nbytes += nbytes
+        # The top entry is always kept, so the last undo can be redone
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            self.nbytes -= self.entries.pop(0)[1]
+
+    def pop(self):
+        entry, nbytes = self.entries.pop(-1)
+        self.nbytes -= nbytes
+        return entry
+
+    def clear(self):
+        self.entries = []
+        self.nbytes = 0
+
+def write_csv(df, savefile, imputer='none', chunk_size=100000, fill_value=0, categorical=()):
+    '''
+    Description:
+    Stream a preprocessed frame to a .csv file chunk by chunk, imputing each chunk on the fly,
+    so that no full imputed copy of the data is ever held in memory. The output is the same as
+    imputing the whole frame first: the fill values are computed once on the whole columns.
+
+    Parameters:
+    df:          pd.DataFrame - the preprocessed data
+    savefile:    str          - the output file
+    imputer:     str          - one of IMPUTERS
+    chunk_size:  int          - number of rows written at a time
+    fill_value:  object       - the constant of the 'constant' imputer
+    categorical: list of int  - positions of the columns holding class codes
+    '''
+    if not imputer in IMPUTERS:
+        raise ValueError("Unknown imputer '%s'!" % imputer)
+    fills = imputation_fills(df, imputer, fill_value, categorical) if imputer != 'none' else {}
+    with open(savefile, 'w', newline='') as f:
+        for start in range(0, max(df.shape[0], 1), chunk_size):
+            chunk = fill_missing(df.iloc[start:start+chunk_size], fills)
+            chunk.to_csv(f, header=(start == 0), index=False)
+
+def load_recipe(recipefile):
+    '''
+    Description:
+    Read a recipe file: a JSON object {"steps": [...]} (or the bare list of steps). Every step
+    is a dict with an "action" among 'Delete', 'Transform', 'Select', 'Query', 'Spatial' and
+    'Time'; columns are referenced by name, e.g.
+        {"action": "Delete", "column": "grid"}
+        {"action": "Transform", "column": "district"}
+        {"action": "Select", "column": "beat", "method": "Condition", "condition": "Start with", "value": "3"}
+        {"action": "Select", "column": "district", "method": "Range", "down": 1, "up": 3}
+        {"action": "Query", "query": "district >= 3 and beat startswith '3'"}
+        {"action": "Spatial", "method": "Radius", "args": [38.55, -121.45, 2.5]}
+        {"action": "Time", "column": "cdatetime", "start": "1/5/2006", "hours": "8-17", "weekdays": "Mon-Fri"}
+    A Time step may also give the "format" of its column, which is inferred otherwise. A Select
+    or Query step on transformed columns gives their "classes" (see transform_classes), e.g.
+        {"action": "Select", "column": "district", "method": "Range", "down": 1, "up": 3, "classes": {"district": [3, 1, 5, 2, 6, 4]}}
+    so that it selects the same values on an extract whose classes are coded in another order.
+    '''
+    with open(recipefile, 'r') as f:
+        recipe = json.load(f)
+    if type(recipe) == dict:
+        recipe = recipe.get('steps', [])
+    if type(recipe) != list:
+        raise ValueError("Invalid recipe file!")
+    return recipe
+
+def save_recipe(recipe, recipefile):
+    '''
+    Description:
+    Write the steps of a Page 3 session to a recipe file (see load_recipe)
+    '''
+    with open(recipefile, 'w') as f:
+        json.dump({'version': 1, 'steps': list(recipe)}, f, indent=2)
+
+class PreprocessSession(object):
+    '''
+    Description:
+    The Page 3 state of the GUI without the GUI: deleted/transformed columns and the row
+    selection, driven by recipe steps instead of the toolbar
+
+    Parameters:
+    df: pd.DataFrame - the merged data, never modified
+    '''
+    def __init__(self, df):
+        self.df = df
+        num_sample, num_col = df.shape
+        self.ColumnNames = [str(col) for col in df.columns]
+        self.FeatureDeleteFlag = [False] * num_col
+        self.CategoricalFlag = [False] * num_col
+        self.CategoricalTransformDict = [None] * num_col
+        self.SelectionState = selection.SelectionState(num_sample)
+        self.SelectionIndex = self.SelectionState.index
+        # col_idx -> timeindex.DatetimeColumn, parsed on the first time selection of the column
+        self.DatetimeColumns = {}
+
+    def column_index(self, name):
+        # Only the remaining (not deleted) features can be referenced
+        for i in range(len(self.ColumnNames)):
+            if self.ColumnNames[i] == str(name) and self.FeatureDeleteFlag[i] == False:
+                return i
+        raise ValueError("Unknown column '%s'!" % str(name))
+
+    def GetColumn(self, name, rows, classes=None):
+        i = self.column_index(name)
+        feature = self.df.iloc[rows, i]
+        if classes != None and name in classes:
+            # The codes of the recipe, the values it did not know are missing
+            codes = {classes[name][code]: code for code in range(len(classes[name]))}
+            feature = pd.Series(plan.transform_to_categorical(feature, collections.defaultdict(lambda: np.nan, codes)), index=feature.index)
+        elif self.CategoricalFlag[i]:
+            feature = pd.Series(plan.transform_to_categorical(feature, self.CategoricalTransformDict[i]), index=feature.index)
+        return feature
+
+    def GetDatetime(self, name, fmt):
+        i = self.column_index(name)
+        if i not in self.DatetimeColumns or self.DatetimeColumns[i].format != fmt:
+            self.DatetimeColumns[i] = timeindex.DatetimeColumn(self.df.iloc[:,i], fmt)
+        return self.DatetimeColumns[i]
+
+    def delete(self, name):
+        self.FeatureDeleteFlag[self.column_index(name)] = True
+
+    def transform(self, name):
+        i = self.column_index(name)
+        if self.CategoricalFlag[i]:
+            return
+        self.CategoricalTransformDict[i] = build_transform_dict(self.df.iloc[:,i])
+        self.CategoricalFlag[i] = True
+
+    def select(self, query, classes=None):
+        # Only the currently selected rows are candidates, so only those can be rejected.
+        # The transformed columns given classes are coded as when the query was written.
+        mask = selection.evaluate_query(query, lambda name, rows: self.GetColumn(name, rows, classes), self.SelectionIndex, self.GetDatetime)
+        self.SelectionIndex = self.SelectionState.apply(self.SelectionIndex[~mask])
+
+    def step_query(self, step):
+        '''
+        Compile a selection step of a recipe into a query (see selection.compile_query)
+        '''
+        action = step.get('action')
+        if action == 'Select':
+            name = str(self.ColumnNames[self.column_index(step.get('column'))])
+            method = step.get('method', 'Condition')
+            if method == 'Range':
+                down, up = step.get('down'), step.get('up')
+                if down == None and up == None:
+                    raise ValueError("Please specify at least one bound for the range!")
+                return ('cond', name, 'Range', (None if down == None else float(down), None if up == None else float(up)))
+            elif method == 'Condition':
+                condition = step.get('condition', 0)
+                if condition in selection.CONDITIONS:
+                    condition = selection.CONDITIONS.index(condition)
+                if not condition in range(len(selection.CONDITIONS)):
+                    raise ValueError("Unknown condition '%s'!" % str(condition))
+                value = step.get('value')
+                if condition in [2,3,4,5]:
+                    value = float(value)
+                elif condition in [12,13]:
+                    value = selection.compile_regex(str(value))
+                return ('cond', name, 'Condition', (condition, value))
+            raise ValueError("Unknown selection method '%s'!" % str(method))
+        elif action == 'Query':
+            RemainColumns = [self.ColumnNames[i] for i in range(len(self.ColumnNames)) if self.FeatureDeleteFlag[i] == False]
+            return selection.compile_query(step.get('query', ''), RemainColumns)
+        elif action == 'Spatial':
+            lat_idx, lon_idx = spatial.find_coordinate_columns(self.ColumnNames)
+            if lat_idx == None or lon_idx == None:
+                raise ValueError("Cannot find the latitude/longitude columns!")
+            method = step.get('method', 'Box')
+            args = tuple([float(arg) for arg in step.get('args', [])])
+            if not method in ['Box', 'Radius'] or len(args) != (4 if method == 'Box' else 3):
+                raise ValueError("Invalid spatial selection!")
+            return ('cond', (self.ColumnNames[lat_idx], self.ColumnNames[lon_idx]), method, args)
+        elif action == 'Time':
+            i = self.column_index(step.get('column'))
+            TimeFormat = step.get('format') or (self.DatetimeColumns[i].format if i in self.DatetimeColumns else None) \
+                or timeindex.infer_datetime_format(self.df.iloc[:,i])
+            if TimeFormat == None:
+                raise ValueError("The column '%s' does not look like a date/time column!" % self.ColumnNames[i])
+            TimeArgs = (timeindex.parse_bound(step.get('start') or ''), timeindex.parse_bound(step.get('end') or '', end=True),
+                        timeindex.parse_hours(step.get('hours') or ''), timeindex.parse_weekdays(step.get('weekdays') or ''))
+            return ('cond', self.ColumnNames[i], 'Time', (TimeFormat,) + TimeArgs)
+        raise ValueError("Unknown recipe action '%s'!" % str(action))
+
+    def apply_step(self, step):
+        action = step.get('action')
+        if action == 'Delete':
+            self.delete(step.get('column'))
+        elif action == 'Transform':
+            self.transform(step.get('column'))
+        else:
+            self.select(self.step_query(step), step.get('classes'))
+
+    def apply_recipe(self, recipe):
+        for step in recipe:
+            self.apply_step(step)
+
+    def categorical_columns(self):
+        '''
+        Positions of the transformed (class code) columns in the preprocessed frame
+        '''
+        kept = [i for i in range(len(self.FeatureDeleteFlag)) if self.FeatureDeleteFlag[i] == False]
+        return [k for k in range(len(kept)) if self.CategoricalFlag[kept[k]]]
+
+    def preprocessed(self):
+        '''
+        The preprocessed frame, as downloaded on Page 3
+        '''
+        return plan.preprocess(self.df, self.FeatureDeleteFlag, self.CategoricalFlag, self.CategoricalTransformDict, self.SelectionIndex)
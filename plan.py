@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+
+def build_plan(FeatureDeleteFlag, CategoricalFlag, CategoricalTransformDict, SelectionIndex):
+    '''
+    Description:
+    Capture the Page 3 actions as a lazy logical plan, in the order they used to be replayed
+    eagerly: transform the categorical columns, delete columns, then delete rows
+
+    Parameters:
+    FeatureDeleteFlag:        list of bool - whether each column is deleted
+    CategoricalFlag:          list of bool - whether each column is transformed to categorical
+    CategoricalTransformDict: list of dict - value -> category code, for each transformed column
+    SelectionIndex:           np.ndarray   - positions of the selected rows
+
+    Output:
+    plan: list of tuple - ('Transform', col_idx, TransformDict), ('Delete', col_idx_list)
+                          and ('Select', rows)
+    '''
+    plan = [('Transform', i, CategoricalTransformDict[i]) for i in range(len(CategoricalFlag)) if CategoricalFlag[i]]
+    plan.append(('Delete', [i for i in range(len(FeatureDeleteFlag)) if FeatureDeleteFlag[i]]))
+    plan.append(('Select', np.asarray(SelectionIndex).reshape(-1,)))
+    return plan
+
+def optimize_plan(plan, num_col):
+    '''
+    Description:
+    Compile a logical plan into a single scan:
+    (1) deleted columns are pruned before anything is computed on them (their transforms included)
+    (2) the row selection is pushed down, so only the selected rows are ever read
+    (3) the remaining transforms are fused into the column projection
+
+    Parameters:
+    plan:    list of tuple - the output of build_plan
+    num_col: int           - number of columns of the raw data
+
+    Output:
+    scan: ('Scan', rows, projection) - projection is a list of (col_idx, TransformDict or None)
+                                       for the kept columns; rows is None for all the rows
+    '''
+    rows = None
+    kept = np.ones(num_col, dtype=bool)
+    transforms = {}
+    for step in plan:
+        if step[0] == 'Transform':
+            transforms[step[1]] = step[2]
+        elif step[0] == 'Delete':
+            kept[step[1]] = False
+        elif step[0] == 'Select':
+            # Successive selections compose on positions of the previous result
+            rows = step[1] if rows is None else rows[step[1]]
+        else:
+            raise ValueError("Unknown plan step '%s'!" % str(step[0]))
+    projection = [(i, transforms.get(i)) for i in np.flatnonzero(kept)]
+    return ('Scan', rows, projection)
+
+def transform_to_categorical(values, TransformDict):
+    '''
+    Description:
+    Vectorized version of mapping each value through TransformDict (missing values stay missing):
+    each distinct value is looked up once, then the codes are gathered back
+
+    Parameters:
+    values:        pd.Series
+    TransformDict: dict - value -> category code
+
+    Output:
+    codes: np.ndarray
+    '''
+    codes, uniques = pd.factorize(values)
+    mapped = [np.nan if str(x) == 'nan' else TransformDict[x] for x in uniques]
+    if (codes < 0).any():
+        codes = np.where(codes < 0, len(mapped), codes)
+        mapped.append(np.nan)
+    return pd.Series(mapped, dtype=None if len(mapped) > 0 else float).to_numpy()[codes]
+
+def execute_plan(df, scan):
+    '''
+    Description:
+    Run a compiled scan in one pass: each kept column is gathered (and transformed) on the
+    selected rows only, and the preprocessed frame is assembled once from those columns
+
+    Parameters:
+    df:   pd.DataFrame - the raw data, never modified
+    scan: tuple        - the output of optimize_plan
+
+    Output:
+    df:   pd.DataFrame - the preprocessed data
+    '''
+    _, rows, projection = scan
+    if rows is None:
+        rows = np.arange(df.shape[0])
+    columns = {}
+    for k, (i, TransformDict) in enumerate(projection):
+        feature = df.iloc[:, i]
+        if TransformDict is None:
+            columns[k] = feature.array.take(rows)
+        else:
+            columns[k] = transform_to_categorical(feature.iloc[rows], TransformDict)
+    # The gathered columns are fresh arrays, the frame adopts them without copying
+    result = pd.DataFrame(columns, index=df.index[rows], copy=False)
+    result.columns = df.columns[[i for i, _ in projection]]
+    return result
+
+def replace_columns(df, replaced):
+    '''
+    Description:
+    Copy-on-write update of a frame: a new frame holding the replaced columns, which shares the
+    buffers of all the other columns with df. df itself is never modified.
+
+    Parameters:
+    df:       pd.DataFrame
+    replaced: dict - col_idx -> new values (same length as df)
+
+    Output:
+    df:       pd.DataFrame
+    '''
+    columns = {}
+    for i in range(df.shape[1]):
+        if i in replaced:
+            columns[i] = getattr(replaced[i], 'array', replaced[i])
+        else:
+            columns[i] = df.iloc[:, i].array
+    result = pd.DataFrame(columns, index=df.index, copy=False)
+    result.columns = df.columns
+    return result
+
+def preprocess(df, FeatureDeleteFlag, CategoricalFlag, CategoricalTransformDict, SelectionIndex):
+    '''
+    Description:
+    Build, optimize and execute the plan of the current Page 3 state
+    '''
+    plan = build_plan(FeatureDeleteFlag, CategoricalFlag, CategoricalTransformDict, SelectionIndex)
+    return execute_plan(df, optimize_plan(plan, df.shape[1]))
+
+def set_value(df, row, col, value):
+    '''
+    Description:
+    Copy-on-write update of a single cell: only the column holding it is copied, so frames
+    sharing their buffers with df (e.g. the imputation cache entries) are left untouched
+
+    Parameters:
+    df:    pd.DataFrame
+    row:   int - row position
+    col:   int - column position
+    value: the new value; the column falls back to object when it cannot hold it
+
+    Output:
+    df:    pd.DataFrame
+    '''
+    feature = df.iloc[:, col].copy()
+    try:
+        feature.iloc[row] = value
+    except (TypeError, ValueError):
+        feature = feature.astype(object)
+        feature.iloc[row] = value
+    return replace_columns(df, {col: feature})
@@ -0,0 +1,163 @@
+import os
+import time
+import queue
+import shutil
+import inspect
+import tempfile
+import traceback
+import importlib.util
+import pandas as pd
+
+'''
+Imputer plugins: the algorithm file uploaded on Page 4 is a Python module defining
+
+    def impute(df, **parameters):           # or impute(df, progress, **parameters)
+        ...
+        return imputed                      # DataFrame (or array) of the same shape as df
+
+and the parameter file a Python module defining the keyword arguments of impute, either as a
+dict named PARAMETERS or as plain module-level variables. When impute has a progress argument,
+it receives a callable progress(done, total) to report its progress with.
+
+The plugin runs in a separate worker process, so a slow, crashing or memory-hungry algorithm
+cannot freeze or take down the interface.
+'''
+
+DEFAULT_TIMEOUT = 3600
+
+def default_memory_limit():
+    '''
+    Description:
+    Memory limit of the worker process in MB: 75% of the physical memory, None where it cannot
+    be found (or enforced, see limit_memory)
+    '''
+    try:
+        return int(0.75 * os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 2**20)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def load_module(path, name):
+    spec = importlib.util.spec_from_file_location(name, path)
+    if spec == None:
+        raise ValueError("Cannot load '%s' as a Python module!" % path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def load_parameters(path):
+    '''
+    Description:
+    The keyword arguments defined by a parameter file: its PARAMETERS dict if there is one,
+    its public module-level variables otherwise
+    '''
+    if path == None:
+        return {}
+    module = load_module(path, 'scis_parameters')
+    if hasattr(module, 'PARAMETERS'):
+        if not isinstance(module.PARAMETERS, dict):
+            raise ValueError("PARAMETERS of the parameter file should be a dict!")
+        return dict(module.PARAMETERS)
+    return dict([(name, value) for name, value in vars(module).items()
+                 if not name.startswith('_') and not inspect.ismodule(value) and not callable(value)])
+
+def check_result(df, result):
+    '''
+    Description:
+    The output of a plugin as a DataFrame shaped and labelled as its input
+    '''
+    if isinstance(result, pd.DataFrame):
+        if result.shape != df.shape:
+            raise ValueError("The imputed data has shape %s instead of %s!" % (str(result.shape), str(df.shape)))
+        result = result.set_axis(df.index, axis=0).set_axis(df.columns, axis=1)
+        return result
+    try:
+        return pd.DataFrame(result, index=df.index, columns=df.columns)
+    except (ValueError, TypeError):
+        raise ValueError("impute should return a DataFrame or an array shaped as its input!")
+
+def limit_memory(memory_mb):
+    # Only enforceable where the resource module exists (POSIX); elsewhere only the timeout applies
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = memory_mb * 2**20
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def run_worker(AlgorithmFile, ParameterFile, infile, outfile, messages, memory_mb):
+    # Entry point of the worker process; every outcome is reported through messages
+    try:
+        if memory_mb != None:
+            limit_memory(memory_mb)
+        df = pd.read_pickle(infile)
+        algorithm = load_module(AlgorithmFile, 'scis_algorithm')
+        if not callable(getattr(algorithm, 'impute', None)):
+            raise ValueError("The algorithm file should define a function impute(df, **parameters)!")
+        kwargs = load_parameters(ParameterFile)
+        if 'progress' in inspect.signature(algorithm.impute).parameters:
+            kwargs['progress'] = lambda done, total: messages.put(('progress', int(done), int(total)))
+        result = check_result(df, algorithm.impute(df, **kwargs))
+        result.to_pickle(outfile)
+        messages.put(('done',))
+    except MemoryError:
+        messages.put(('error', "The imputation algorithm ran out of memory (limit: %s MB)!" % str(memory_mb)))
+    except Exception as e:
+        messages.put(('error', "The imputation algorithm failed: %s: %s\n\n%s" % (type(e).__name__, str(e), traceback.format_exc())))
+
+def run_plugin(df, AlgorithmFile, ParameterFile=None, timeout=DEFAULT_TIMEOUT, memory_mb=None, progress=None, cancelled=None):
+    '''
+    Description:
+    Run an imputer plugin on df in a worker process
+
+    Parameters:
+    df:            pd.DataFrame - the preprocessed data, never modified
+    AlgorithmFile: str          - path of the algorithm module
+    ParameterFile: str          - path of the parameter module, None for no parameters
+    timeout:       float        - seconds before the worker is killed, None for no limit
+    memory_mb:     int          - address space limit of the worker, None for no limit
+    progress:      callable     - progress(done, total), called with the plugin's progress
+    cancelled:     callable     - polled while waiting, kills the worker when it returns True
+
+    Output:
+    imputed:       pd.DataFrame - None when cancelled
+    '''
+    # Only the plugin runs pay for the process machinery; 'spawn' does not fork the threads
+    # of the interface
+    import multiprocessing
+    context = multiprocessing.get_context('spawn')
+    workdir = tempfile.mkdtemp(prefix='scis_plugin_')
+    try:
+        infile = os.path.join(workdir, 'input.pkl')
+        outfile = os.path.join(workdir, 'output.pkl')
+        df.to_pickle(infile)
+        messages = context.Queue()
+        worker = context.Process(target=run_worker, args=(AlgorithmFile, ParameterFile, infile, outfile, messages, memory_mb), daemon=True)
+        worker.start()
+        deadline = None if timeout == None else time.time() + timeout
+        outcome = None
+        while outcome == None:
+            # Checked on every message too: a plugin reporting its progress often never lets the
+            # queue run empty
+            if cancelled != None and cancelled():
+                worker.kill()
+                return None
+            if deadline != None and time.time() > deadline:
+                worker.kill()
+                raise ValueError("The imputation algorithm did not finish within %g seconds!" % timeout)
+            try:
+                message = messages.get(timeout=0.1)
+            except queue.Empty:
+                if not worker.is_alive() and messages.empty():
+                    raise ValueError("The imputation algorithm crashed (exit code %s)!" % str(worker.exitcode))
+                continue
+            if message[0] == 'progress':
+                if progress != None:
+                    progress(message[1], message[2])
+            else:
+                outcome = message
+        worker.join()
+        if outcome[0] == 'error':
+            raise ValueError(outcome[1])
+        return pd.read_pickle(outfile)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
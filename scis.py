@@ -0,0 +1,162 @@
+import os
+import sys
+import csv
+import time
+import argparse
+import numpy as np
+import knn
+import pipeline
+import plugin
+
+REPORT_FIELDS = ['file', 'status', 'rows', 'columns', 'output_rows', 'output_columns', 'seconds', 'error']
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Run the SCIS pipeline (merge, error detection, preprocessing recipe and imputation) without the GUI")
+    parser.add_argument('files', nargs='*', help="input .csv/.xlsx files, the first column of each being the id")
+    parser.add_argument('-o', '--output', default=None, help="output .csv file (output directory with --batch)")
+    parser.add_argument('--gui', action='store_true', help="start the graphical interface instead")
+    parser.add_argument('--batch', default=None, help="replay the recipe over every .csv/.xlsx file of this directory, one dataset per worker process")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="number of worker processes with --batch (one dataset per worker) or --imputer knn (one chunk of rows per worker)")
+    parser.add_argument('--report', default=None, help="per-file report of --batch (default: report.csv in the output directory)")
+    parser.add_argument('--merge', default='Smart', choices=pipeline.MERGE_METHODS, help="merge method (default: Smart, as in the GUI)")
+    parser.add_argument('--recipe', default=None, help="JSON recipe of Page 3 steps (delete, transform, selections)")
+    parser.add_argument('--imputer', default='mean', choices=pipeline.IMPUTERS + ['knn'], help="'none' writes the preprocessed data only")
+    parser.add_argument('--fill-value', type=pipeline.parse_fill_value, default=0, help="constant of --imputer constant")
+    parser.add_argument('--neighbors', type=int, default=5, help="number of neighbours of --imputer knn")
+    parser.add_argument('--weights', default='uniform', choices=knn.WEIGHTS, help="weights of the neighbours of --imputer knn")
+    parser.add_argument('--algorithm', default=None, help="imputer plugin (.py defining impute(df, **parameters)), run in a worker process instead of --imputer")
+    parser.add_argument('--parameters', default=None, help="parameter file (.py) of the imputer plugin")
+    parser.add_argument('--timeout', type=float, default=plugin.DEFAULT_TIMEOUT, help="seconds before the imputer plugin is stopped")
+    parser.add_argument('--memory-mb', type=int, default=plugin.default_memory_limit(), help="memory limit of the imputer plugin in MB")
+    parser.add_argument('--errors', default='keep', choices=['keep', 'missing'], help="how to handle the text values detected in numerical columns")
+    parser.add_argument('--chunk-size', type=int, default=100000, help="number of rows written at a time")
+    args = parser.parse_args(argv)
+    if args.gui:
+        return args
+    if args.batch == None and len(args.files) == 0:
+        parser.error("please give the input files or --batch")
+    if args.output == None:
+        parser.error("please give the output with -o")
+    return args
+
+def run(files, savefile, how='Smart', recipe=None, imputer='mean', errors='keep', chunk_size=100000, log=print, algorithm=None, parameters=None,
+        timeout=plugin.DEFAULT_TIMEOUT, memory_mb=None, fill_value=0, k=5, weights='uniform', workers=None):
+    '''
+    Description:
+    The whole pipeline on one dataset: merge the files, detect the errors, replay the recipe
+    and stream the (imputed) result to savefile; with an algorithm file, the imputation is done
+    by that plugin (see plugin.py) in a worker process instead, and the 'knn' imputer queries
+    the neighbours in up to workers processes (see knn.knn_impute)
+
+    Output:
+    report: dict - row/column numbers before and after preprocessing, and the timing
+    '''
+    start = time.time()
+    df = pipeline.load_files(files, how)
+    ErrorColIdx, ErrorRowIdx = pipeline.error_detection(df)
+    for j, rows in zip(ErrorColIdx, ErrorRowIdx):
+        rows = np.asarray(rows).reshape(-1,)
+        if len(rows) > 0:
+            log("Column '%s': %i erroneous value(s)" % (str(df.columns[j]), len(rows)))
+            if errors == 'missing':
+                df.iloc[rows, j] = np.nan
+    session = pipeline.PreprocessSession(df)
+    if recipe != None:
+        session.apply_recipe(recipe)
+    preprocessed = session.preprocessed()
+    if algorithm != None:
+        plugin.run_plugin(preprocessed, algorithm, parameters, timeout, memory_mb).to_csv(savefile, index=False)
+    elif imputer == 'knn':
+        knn.knn_impute(preprocessed, k, weights, None, session.categorical_columns(), chunk_size, workers).to_csv(savefile, index=False)
+    else:
+        pipeline.write_csv(preprocessed, savefile, imputer, chunk_size, fill_value, session.categorical_columns())
+    return {'rows': df.shape[0], 'columns': df.shape[1], 'output_rows': preprocessed.shape[0],
+            'output_columns': preprocessed.shape[1], 'seconds': time.time() - start}
+
+def run_batch_file(task):
+    # Runs in a worker process, one dataset per task; failures are reported, not raised
+    infile, savefile, how, recipe, imputer, errors, chunk_size, algorithm, parameters, timeout, memory_mb, fill_value, k, weights = task
+    start = time.time()
+    try:
+        # The datasets already run in parallel, so the neighbours are queried in this process
+        report = run([infile], savefile, how, recipe, imputer, errors, chunk_size, lambda message: None, algorithm, parameters, timeout, memory_mb, fill_value,
+                     k, weights, 1)
+        report['status'] = 'ok'
+    except Exception as e:
+        report = {'status': 'failed', 'error': str(e), 'seconds': time.time() - start}
+    report['file'] = infile
+    return report
+
+def batch(directory, outdir, recipe=None, how='Smart', imputer='mean', errors='keep', chunk_size=100000, workers=None, log=print,
+          algorithm=None, parameters=None, timeout=plugin.DEFAULT_TIMEOUT, memory_mb=None, fill_value=0, k=5, weights='uniform'):
+    '''
+    Description:
+    Replay a recipe over every .csv/.xlsx file of a directory, in parallel worker processes.
+    Each file is a dataset of its own, written to outdir under the same name (as .csv).
+
+    Output:
+    reports: list of dict - per-file status, row/column numbers and timing, in file order
+    '''
+    files = sorted([os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.csv') or name.endswith('.xlsx')])
+    if len(files) == 0:
+        raise ValueError("There are no .csv/.xlsx files in %s!" % directory)
+    if os.path.abspath(directory) == os.path.abspath(outdir):
+        raise ValueError("The output directory should differ from the input directory!")
+    # Only batch runs pay for the process pool machinery
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    os.makedirs(outdir, exist_ok=True)
+    tasks = [(infile, os.path.join(outdir, os.path.splitext(os.path.basename(infile))[0] + '.csv'), how, recipe, imputer, errors, chunk_size,
+              algorithm, parameters, timeout, memory_mb, fill_value, k, weights) for infile in files]
+    reports = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_batch_file, task) for task in tasks]
+        for future in as_completed(futures):
+            report = future.result()
+            reports[report['file']] = report
+            if report['status'] == 'ok':
+                log("%s: %i -> %i rows (%.2fs)" % (report['file'], report['rows'], report['output_rows'], report['seconds']))
+            else:
+                log("%s: failed - %s" % (report['file'], report['error']))
+    return [reports[infile] for infile in files]
+
+def write_report(reports, reportfile):
+    with open(reportfile, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        for report in reports:
+            writer.writerow(dict([(field, report.get(field, '')) for field in REPORT_FIELDS]))
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv == None else argv)
+    if args.gui:
+        # Qt is only loaded when the interface is actually requested
+        import new_imputation_system
+        return new_imputation_system.main()
+    if args.batch != None:
+        try:
+            recipe = None if args.recipe == None else pipeline.load_recipe(args.recipe)
+            start = time.time()
+            reports = batch(args.batch, args.output, recipe, args.merge, args.imputer, args.errors, args.chunk_size, args.workers,
+                            print, args.algorithm, args.parameters, args.timeout, args.memory_mb, args.fill_value, args.neighbors, args.weights)
+            reportfile = args.report or os.path.join(args.output, 'report.csv')
+            write_report(reports, reportfile)
+        except (ValueError, OSError) as e:
+            print("Error: %s" % str(e), file=sys.stderr)
+            return 1
+        num_failed = len([report for report in reports if report['status'] != 'ok'])
+        print("%i file(s) processed, %i failed, in %.2fs; report written to %s" % (len(reports), num_failed, time.time() - start, reportfile))
+        return 0 if num_failed == 0 else 1
+    try:
+        recipe = None if args.recipe == None else pipeline.load_recipe(args.recipe)
+        report = run(args.files, args.output, args.merge, recipe, args.imputer, args.errors, args.chunk_size, print,
+                     args.algorithm, args.parameters, args.timeout, args.memory_mb, args.fill_value, args.neighbors, args.weights,
+                     args.workers)
+    except (ValueError, OSError) as e:
+        print("Error: %s" % str(e), file=sys.stderr)
+        return 1
+    print("%i rows x %i columns -> %i rows x %i columns written to %s (%.2fs)" % (report['rows'], report['columns'],
+          report['output_rows'], report['output_columns'], args.output, report['seconds']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
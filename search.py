@@ -0,0 +1,206 @@
+import numpy as np
+import pandas as pd
+import plan
+
+class ColumnIndex(object):
+    '''
+    Description:
+    Inverted index of a column: its distinct values, and for each of them the sorted positions
+    of the rows holding it. A search only compares the text with the distinct values, then
+    gathers the postings of the matching ones.
+
+    Parameters:
+    values: pd.Series - the column
+    '''
+    def __init__(self, values):
+        codes, self.uniques = pd.factorize(values)
+        # Missing values (code -1) are never matched
+        valid = np.flatnonzero(codes >= 0)
+        codes = codes[valid]
+        order = np.argsort(codes, kind='stable')
+        self.postings = valid[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(self.uniques)))])
+        self.texts = None
+
+    def lower_texts(self, TransformDict=None):
+        # The displayed texts of the distinct values, lower-cased; cached for untransformed columns
+        if TransformDict != None:
+            return pd.Series([str(TransformDict[value]) for value in self.uniques], dtype=object).str.lower()
+        if self.texts is None:
+            self.texts = pd.Series([str(value) for value in self.uniques], dtype=object).str.lower()
+        return self.texts
+
+    def rows(self, codes):
+        '''
+        Sorted positions of the rows holding any of the given distinct values
+        '''
+        starts = self.offsets[codes]
+        lengths = self.offsets[np.asarray(codes) + 1] - starts
+        # Gather all the postings lists at once: position p of the output reads postings at
+        # the start of its list plus its rank inside the list
+        shifts = starts - np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        rows = self.postings[np.arange(lengths.sum()) + np.repeat(shifts, lengths)]
+        return np.sort(rows)
+
+    def search(self, text, TransformDict=None):
+        '''
+        Description:
+        Positions of the rows whose displayed value contains text, case-insensitively
+
+        Parameters:
+        text:          str
+        TransformDict: dict - value -> category code, when the column is displayed transformed
+        '''
+        texts = self.lower_texts(TransformDict)
+        codes = np.flatnonzero(texts.str.contains(text.lower(), regex=False).to_numpy(dtype=bool))
+        return self.rows(codes)
+
+class SearchIndex(object):
+    '''
+    Description:
+    Full-table search over a DataFrame through per-column inverted indexes, built lazily the
+    first time a column is searched
+
+    Parameters:
+    df: pd.DataFrame - never modified; see drop for frames replaced column by column
+    '''
+    def __init__(self, df):
+        self.df = df
+        self.columns = {}
+        # Bumped by drop, so that an index built meanwhile from the old frame is not kept
+        self.version = 0
+
+    def column(self, j):
+        if j not in self.columns:
+            version = self.version
+            index = ColumnIndex(self.df.iloc[:,j])
+            if version != self.version:
+                return index
+            self.columns[j] = index
+        return self.columns[j]
+
+    def build(self, columns, cancelled=None):
+        '''
+        Index the given columns ahead of the searches; stops early when cancelled() is True
+        '''
+        for j in columns:
+            if cancelled != None and cancelled():
+                return
+            self.column(j)
+
+    def drop(self, df, j):
+        '''
+        Column j of the indexed frame was replaced (copy-on-write) by the one of df
+        '''
+        self.df = df
+        self.version += 1
+        self.columns.pop(j, None)
+
+    def search(self, text, columns, transforms=None, rows=None):
+        '''
+        Description:
+        Cells whose displayed value contains text, in display order (row by row)
+
+        Parameters:
+        text:       str
+        columns:    list of int - positions of the displayed columns
+        transforms: dict        - col_idx -> TransformDict applied on display
+        rows:       np.ndarray  - positions of the displayed rows in display order, None for all
+
+        Output:
+        cells:      np.ndarray  - (display row, display column) of each matching cell
+        '''
+        transforms = {} if transforms == None else transforms
+        display = None
+        if rows is not None:
+            # Display position of each row of the frame, -1 when not displayed
+            display = np.full(self.df.shape[0], -1, dtype=np.int64)
+            display[rows] = np.arange(len(rows))
+        found_rows = []
+        found_cols = []
+        for k, j in enumerate(columns):
+            matches = self.column(j).search(text, transforms.get(j))
+            if display is not None:
+                # Matching rows outside the selection are dropped, the others are renumbered
+                matches = display[matches]
+                matches = matches[matches >= 0]
+            found_rows.append(matches)
+            found_cols.append(np.full(len(matches), k))
+        if len(found_rows) == 0:
+            return np.zeros((0, 2), dtype=np.int64)
+        cells = np.stack([np.concatenate(found_rows), np.concatenate(found_cols)], axis=1).astype(np.int64)
+        return cells[np.lexsort((cells[:,1], cells[:,0]))]
+
+class SortIndex(object):
+    '''
+    Description:
+    Stable sort permutations of the columns of a DataFrame, computed once per column and
+    direction (missing values last). A sorted view of any row selection is then read off the
+    permutation in O(rows), the DataFrame itself is never reordered nor copied.
+
+    Parameters:
+    df: pd.DataFrame - never modified; see drop for frames replaced column by column
+    '''
+    def __init__(self, df):
+        self.df = df
+        # (col_idx, descending) -> (TransformDict, permutation)
+        self.orders = {}
+        self.version = 0
+        # (rows, permutation, sorted rows) of the last sorted_rows call
+        self.last = None
+
+    def cached(self, j, descending=False, TransformDict=None):
+        entry = self.orders.get((j, descending))
+        return entry != None and entry[0] is TransformDict
+
+    def order(self, j, descending=False, TransformDict=None):
+        '''
+        Positions of all the rows sorted by the displayed values of column j
+        '''
+        if not self.cached(j, descending, TransformDict):
+            version = self.version
+            values = self.df.iloc[:,j].reset_index(drop=True)
+            if TransformDict != None:
+                values = pd.Series(plan.transform_to_categorical(values, TransformDict))
+            try:
+                order = values.sort_values(ascending=not descending, kind='stable', na_position='last').index.to_numpy()
+            except TypeError:
+                # Values of mixed types are sorted by their text
+                values = values.map(lambda value: value if pd.isnull(value) else str(value))
+                order = values.sort_values(ascending=not descending, kind='stable', na_position='last').index.to_numpy()
+            if version != self.version:
+                return order
+            self.orders[(j, descending)] = (TransformDict, order)
+        return self.orders[(j, descending)][1]
+
+    def sorted_rows(self, j, rows=None, descending=False, TransformDict=None):
+        '''
+        Description:
+        The selected rows in the order of column j
+
+        Parameters:
+        rows:   np.ndarray - positions of the selected rows, None for all
+
+        Output:
+        rows:   np.ndarray - the same positions, sorted; the very same array as long as rows and
+                             the permutation are unchanged, so that a view keyed by the identity
+                             of its rows is not reset
+        '''
+        order = self.order(j, descending, TransformDict)
+        if rows is None:
+            return order
+        if self.last != None and self.last[0] is rows and self.last[1] is order:
+            return self.last[2]
+        selected = np.zeros(self.df.shape[0], dtype=bool)
+        selected[rows] = True
+        self.last = (rows, order, order[selected[order]])
+        return self.last[2]
+
+    def drop(self, df, j):
+        '''
+        Column j of the indexed frame was replaced (copy-on-write) by the one of df
+        '''
+        self.df = df
+        self.version += 1
+        self.orders.pop((j, False), None)
+        self.orders.pop((j, True), None)
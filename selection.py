@@ -0,0 +1,550 @@
+import re
+import numpy as np
+import pandas as pd
+import spatial
+import timeindex
+
+# The conditions offered by SelectionDialog.SelectionMethodComboBox, in combo-box order
+CONDITIONS = ['Equal', 'Not Equal', 'Greater than', 'Greater/Equal', 'Smaller than', 'Smaller/Equal',
+              'Start with', 'Not Start With', 'End with', 'Not End with', 'Contain', 'Not Contain',
+              'Match regex', 'Not Match regex']
+
+# Query operators and the condition index they map onto
+QUERY_OPERATORS = {
+    '==': 0, '=': 0, '!=': 1, '>': 2, '>=': 3, '<': 4, '<=': 5,
+    'startswith': 6, 'not startswith': 7, 'endswith': 8, 'not endswith': 9,
+    'contains': 10, 'not contains': 11, 'matches': 12, 'not matches': 13,
+}
+
+def range_mask(values, down, up):
+    '''
+    Description:
+    Vectorized version of the 'Range' selection: missing values are always kept, numerical
+    values are kept when they lie in [down, up] and non-numerical values are dropped
+
+    Parameters:
+    values: pd.Series - the (transformed) feature
+    down:   float     - lower bound, None for no lower bound
+    up:     float     - upper bound, None for no upper bound
+
+    Output:
+    mask:   np.ndarray of bool - the selected indicator
+    '''
+    if down == None:
+        down = -float('inf')
+    if up == None:
+        up = float('inf')
+    missing = np.asarray(values.isnull())
+    numbers = np.asarray(pd.to_numeric(values, errors='coerce'), dtype=float)
+    with np.errstate(invalid='ignore'):
+        inside = (numbers >= down) & (numbers <= up)
+    return missing | inside
+
+def condition_mask(values, condition, value):
+    '''
+    Description:
+    Vectorized version of the 'Condition' selection, with the same semantics as the
+    row-by-row implementation: missing values are always kept, (not) equal compares
+    numerically when both sides are numbers and as strings otherwise, the ordering
+    conditions drop non-numerical values and the string conditions compare str(x)
+
+    Parameters:
+    values:    pd.Series - the (transformed) feature
+    condition: int       - index in CONDITIONS
+    value:     str/float - the user-specified value
+
+    Output:
+    mask:      np.ndarray of bool - the selected indicator
+    '''
+    missing = np.asarray(values.isnull())
+    if condition in [0, 1]:
+        texts = np.asarray(values.astype(str) == str(value))
+        try:
+            target = float(value)
+            numbers = np.asarray(pd.to_numeric(values, errors='coerce'), dtype=float)
+            is_number = ~np.isnan(numbers)
+            equal = np.where(is_number, numbers == target, texts)
+        except (TypeError, ValueError):
+            equal = texts
+        if condition == 0:
+            return missing | equal
+        return missing | ~equal
+    elif condition in [2, 3, 4, 5]:
+        target = float(value)
+        numbers = np.asarray(pd.to_numeric(values, errors='coerce'), dtype=float)
+        with np.errstate(invalid='ignore'):
+            if condition == 2:
+                kept = numbers > target
+            elif condition == 3:
+                kept = numbers >= target
+            elif condition == 4:
+                kept = numbers < target
+            else:
+                kept = numbers <= target
+        return missing | kept
+    elif condition in [6, 7, 8, 9, 10, 11]:
+        texts = values.astype(str).str
+        if condition in [6, 7]:
+            matched = texts.startswith(str(value), na=False)
+        elif condition in [8, 9]:
+            matched = texts.endswith(str(value), na=False)
+        else:
+            matched = texts.contains(str(value), regex=False, na=False)
+        matched = np.asarray(matched, dtype=bool)
+        if condition % 2 == 0:
+            return missing | matched
+        return missing | ~matched
+    elif condition in [12, 13]:
+        matched = regex_mask(values, value)
+        if condition == 12:
+            return missing | matched
+        return missing | ~matched
+    else:
+        raise ValueError("Invalid selection condition!")
+
+def spatial_mask(lat, lon, method, args):
+    '''
+    Description:
+    Vectorized spatial selection over a latitude and a longitude column: rows with a missing
+    (or non-numerical) coordinate are kept, like missing values in the other selections
+
+    Parameters:
+    lat, lon: pd.Series - the coordinates
+    method:   str       - 'Box' with args (lat_min, lat_max, lon_min, lon_max) or
+                          'Radius' with args (center_lat, center_lon, radius_km)
+
+    Output:
+    mask:     np.ndarray of bool - the selected indicator
+    '''
+    lat = np.asarray(pd.to_numeric(lat, errors='coerce'), dtype=float)
+    lon = np.asarray(pd.to_numeric(lon, errors='coerce'), dtype=float)
+    missing = np.isnan(lat) | np.isnan(lon)
+    if method == 'Box':
+        return missing | spatial.box_mask(lat, lon, *args)
+    return missing | spatial.radius_mask(lat, lon, *args)
+
+def compile_regex(pattern):
+    '''
+    Description:
+    Compile a user-specified regular expression, turning a syntax error into a ValueError
+    '''
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    try:
+        return re.compile(str(pattern))
+    except re.error as e:
+        raise ValueError("Invalid regular expression '%s': %s" % (pattern, e))
+
+def regex_mask(values, pattern):
+    '''
+    Description:
+    Whether str(x) contains a match of the regular expression, for every value x. The pattern
+    is compiled once and only tested on the distinct values of the column: the categories of
+    a categorical column are used directly, other columns are factorized first.
+
+    Parameters:
+    values:  pd.Series          - the (transformed) feature
+    pattern: str/re.Pattern     - the regular expression, searched anywhere in the value
+
+    Output:
+    matched: np.ndarray of bool - False for missing values
+    '''
+    regex = compile_regex(pattern)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = np.asarray(values.cat.codes)
+        uniques = values.cat.categories
+    else:
+        codes, uniques = pd.factorize(values)
+    texts = pd.Series(np.asarray(uniques.astype(str), dtype=object), dtype=object)
+    unique_matched = np.asarray(texts.str.contains(regex, na=False), dtype=bool)
+    matched = np.zeros(len(codes), dtype=bool)
+    present = codes >= 0
+    matched[present] = unique_matched[codes[present]]
+    return matched
+
+# ====================================COMPOUND QUERIES=====================================
+_TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?(?![\w.]))
+      | "(?P<dstring>(?:[^"\\]|\\.)*)"
+      | '(?P<sstring>(?:[^'\\]|\\.)*)'
+      | `(?P<quoted>[^`]+)`
+      | (?P<op>==|!=|>=|<=|=|>|<|\(|\))
+      | (?P<word>[^\s()=!<>"'`]+)
+    )''', re.VERBOSE)
+
+def tokenize_query(text):
+    '''
+    Description:
+    Split a query string into (kind, value) tokens, where kind is one of 'number', 'string',
+    'column' (back-quoted name), 'op' and 'word'
+    '''
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        if match is None or match.end() == pos:
+            raise ValueError("Cannot parse the query near: %s" % text[pos:pos+20])
+        pos = match.end()
+        if match.group('number') is not None:
+            tokens.append(('number', match.group('number')))
+        elif match.group('dstring') is not None:
+            tokens.append(('string', re.sub(r'\\(.)', r'\1', match.group('dstring'))))
+        elif match.group('sstring') is not None:
+            tokens.append(('string', re.sub(r'\\(.)', r'\1', match.group('sstring'))))
+        elif match.group('quoted') is not None:
+            tokens.append(('column', match.group('quoted')))
+        elif match.group('op') is not None:
+            tokens.append(('op', match.group('op')))
+        else:
+            tokens.append(('word', match.group('word')))
+    return tokens
+
+class _QueryParser(object):
+    '''
+    Recursive-descent parser for
+
+        expr      := and_expr (OR and_expr)*
+        and_expr  := atom (AND atom)*
+        atom      := '(' expr ')' | column operator value | column BETWEEN value AND value
+    '''
+    def __init__(self, tokens, columns):
+        self.tokens = tokens
+        self.columns = [str(col) for col in columns]
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def keyword(self, *words):
+        kind, value = self.peek()
+        if kind == 'word' and value.lower() in words:
+            self.pos += 1
+            return value.lower()
+        return None
+
+    def parse(self):
+        if len(self.tokens) == 0:
+            raise ValueError("The query is empty!")
+        node = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise ValueError("Unexpected '%s' in the query!" % self.peek()[1])
+        return node
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.keyword('or', '||'):
+            node = ('or', node, self.parse_and())
+        return node
+
+    def parse_and(self):
+        node = self.parse_atom()
+        while self.keyword('and', '&&'):
+            node = ('and', node, self.parse_atom())
+        return node
+
+    def parse_atom(self):
+        kind, value = self.peek()
+        if kind == 'op' and value == '(':
+            self.pos += 1
+            node = self.parse_or()
+            if self.next() != ('op', ')'):
+                raise ValueError("Missing ')' in the query!")
+            return node
+        column = self.parse_column()
+        if self.keyword('between'):
+            down = self.parse_number()
+            if not self.keyword('and'):
+                raise ValueError("Expected 'and' after 'between %s'!" % down)
+            up = self.parse_number()
+            return ('cond', column, 'Range', (down, up))
+        operator = self.parse_operator()
+        condition = QUERY_OPERATORS[operator]
+        kind, value = self.next()
+        if kind not in ['number', 'string', 'word']:
+            raise ValueError("Expected a value after '%s %s'!" % (column, operator))
+        if condition in [2, 3, 4, 5]:
+            try:
+                value = float(value)
+            except ValueError:
+                raise ValueError("Please enter a numerical value for '%s %s'!" % (column, operator))
+        elif condition in [12, 13]:
+            value = compile_regex(value)
+        return ('cond', column, 'Condition', (condition, value))
+
+    def parse_column(self):
+        kind, value = self.next()
+        if kind not in ['word', 'column']:
+            raise ValueError("Expected a column name in the query!")
+        if value not in self.columns:
+            raise ValueError("Unknown column '%s' in the query!" % value)
+        if self.columns.count(value) > 1:
+            raise ValueError("Several columns are named '%s', the query is ambiguous!" % value)
+        return value
+
+    def parse_number(self):
+        kind, value = self.next()
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise ValueError("Expected a number in the range, got '%s'!" % value)
+
+    def parse_operator(self):
+        kind, value = self.next()
+        if kind == 'op' and value in QUERY_OPERATORS:
+            return value
+        if kind == 'word':
+            word = value.lower()
+            if word == 'not':
+                kind, value = self.next()
+                word = 'not ' + str(value).lower()
+            if word in QUERY_OPERATORS:
+                return word
+        raise ValueError("Unknown operator '%s' in the query!" % value)
+
+def compile_query(text, columns):
+    '''
+    Description:
+    Parse a boolean selection expression over several columns, e.g.
+        district == 3 and grid between 1000 and 1200 and crimedescr contains "BURGLARY"
+    Column names containing spaces or operators can be written as `column name`, and
+    regular expressions are written as  crimedescr matches "^459 PC".
+
+    Parameters:
+    text:    str          - the query
+    columns: list of str  - the columns which may be referenced
+
+    Output:
+    query:   tuple        - the compiled expression tree, to be used with evaluate_query
+    '''
+    return _QueryParser(tokenize_query(text), columns).parse()
+
+def query_columns(query):
+    '''
+    Description:
+    Names of all the columns referenced by a compiled query, in order of first appearance
+    '''
+    if query[0] == 'cond':
+        if isinstance(query[1], tuple):
+            return list(query[1])
+        return [query[1]]
+    names = query_columns(query[1])
+    for name in query_columns(query[2]):
+        if name not in names:
+            names.append(name)
+    return names
+
+def evaluate_query(query, get_column, rows, get_datetime=None):
+    '''
+    Description:
+    Evaluate a compiled query in one vectorized pass over the given rows. 'and'/'or' are
+    short-circuited: the right operand is only evaluated on the rows whose outcome is
+    still undecided after the left operand.
+
+    Parameters:
+    query:      tuple                - the output of compile_query
+    get_column: callable             - get_column(name, rows) returns the (transformed)
+                                       values of column 'name' at the positional rows
+    rows:       np.ndarray of int    - positional indices of the candidate rows
+    get_datetime: callable           - get_datetime(name, fmt) returns the whole column 'name'
+                                       as a timeindex.DatetimeColumn, parsed once and cached by
+                                       the caller; None to parse the rows on every call
+
+    Output:
+    mask:       np.ndarray of bool   - whether each candidate row is selected
+    '''
+    rows = np.asarray(rows).reshape(-1,)
+    if len(rows) == 0:
+        return np.zeros(0, dtype=bool)
+    if query[0] == 'cond':
+        _, column, method, args = query
+        if method in ['Box', 'Radius']:
+            return spatial_mask(get_column(column[0], rows), get_column(column[1], rows), method, args)
+        if method == 'Time':
+            if get_datetime != None:
+                times = get_datetime(column, args[0])
+                return times.missing[rows] | timeindex.time_mask(times.timestamps[rows], *args[1:])
+            values = get_column(column, rows)
+            timestamps, _ = timeindex.parse_datetime(values, args[0])
+            return np.asarray(values.isnull()) | timeindex.time_mask(timestamps, *args[1:])
+        values = get_column(column, rows)
+        if method == 'Range':
+            return range_mask(values, args[0], args[1])
+        return condition_mask(values, args[0], args[1])
+    mask = evaluate_query(query[1], get_column, rows, get_datetime)
+    undecided = mask if query[0] == 'and' else ~mask
+    if np.any(undecided):
+        mask = mask.copy()
+        mask[undecided] = evaluate_query(query[2], get_column, rows[undecided], get_datetime)
+    return mask
+
+# ====================================SELECTION STATE======================================
+class SelectionState(object):
+    '''
+    Description:
+    The row selection of Page 3 as a stack of selection actions. Every action only keeps the
+    rows it rejects, either as sorted row ids or as a packed bitset (whichever is smaller),
+    and every row keeps a counter of the active actions rejecting it. A row is selected iff
+    its counter is 0, so pushing or undoing an action only touches the rows that action
+    rejected. The sorted index of the selected rows is only rebuilt when it is read, by
+    merging the rows changed since it was last built.
+
+    Parameters:
+    num_sample: int - number of rows of the underlying DataFrame
+    '''
+    def __init__(self, num_sample):
+        self.num_sample = num_sample
+        # uint32: a uint16 counter wraps to 0 after 65536 actions rejecting the same row
+        self.reject_counter = np.zeros(num_sample, dtype=np.uint32)
+        self.actions = []
+        self.selected = np.arange(num_sample)
+        # Rows whose counter went to or from 0 since self.selected was built
+        self.pending = []
+        self.num_pending = 0
+        # Every action gets a serial number, so that a selection is identified by the
+        # serial numbers of its active actions (see key)
+        self.serial = 0
+        self.serials = []
+        # Rows which left (push) or came back to (pop) the selection in the last operation
+        self.changed = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.actions)
+
+    @property
+    def key(self):
+        '''
+        Identifies the current selection: equal keys mean equal selections, and the selection
+        of a key is a subset of the selection of any prefix of that key
+        '''
+        return tuple(self.serials)
+
+    @property
+    def nbytes(self):
+        return self.reject_counter.nbytes + sum([action[1].nbytes for action in self.actions])
+
+    @property
+    def index(self):
+        '''
+        The sorted positional ids of the selected rows (the SelectionIndex); the same array is
+        returned until the selection changes
+        '''
+        if len(self.pending) == 0:
+            return self.selected
+        if self.num_pending * 8 > len(self.selected):
+            self.selected = np.flatnonzero(self.reject_counter == 0)
+        else:
+            # Merge the changed rows: drop the ones which left, insert the ones which came back
+            changed = np.unique(np.concatenate(self.pending))
+            kept = self.reject_counter[changed] == 0
+            pos = np.searchsorted(self.selected, changed)
+            present = pos < len(self.selected)
+            present[present] = self.selected[pos[present]] == changed[present]
+            selected = np.delete(self.selected, pos[present & ~kept])
+            returned = changed[~present & kept]
+            self.selected = np.insert(selected, np.searchsorted(selected, returned), returned)
+        self.pending = []
+        self.num_pending = 0
+        return self.selected
+
+    def apply(self, rejected):
+        '''
+        Push a selection action given the positional ids of the rows it rejects, and return
+        the new SelectionIndex
+        '''
+        rejected = np.asarray(rejected, dtype=np.int64).reshape(-1,)
+        self.serial += 1
+        self.push(self.pack(rejected), self.serial)
+        return self.index
+
+    def push(self, action, serial):
+        '''
+        Push an already packed action (e.g. one returned by pop, to redo it) with its serial
+        number; the new SelectionIndex is read from index
+        '''
+        rejected = self.unpack(action)
+        self.reject_counter[rejected] += 1
+        self.changed = rejected[self.reject_counter[rejected] == 1]
+        self.actions.append(action)
+        self.serials.append(serial)
+        self.note_changed()
+
+    def apply_indicator(self, indicator):
+        '''
+        Push a selection action given its full-length selected indicator
+        '''
+        return self.apply(np.flatnonzero(~np.asarray(indicator, dtype=bool)))
+
+    def undo(self):
+        '''
+        Pop the last selection action and return the restored SelectionIndex
+        '''
+        self.pop()
+        return self.index
+
+    def pop(self):
+        '''
+        Pop the last selection action and return it packed, with its serial number
+        '''
+        action = self.actions.pop(-1)
+        serial = self.serials.pop(-1)
+        rejected = self.unpack(action)
+        self.reject_counter[rejected] -= 1
+        self.changed = rejected[self.reject_counter[rejected] == 0]
+        self.note_changed()
+        return action, serial
+
+    def note_changed(self):
+        if len(self.changed) > 0:
+            self.pending.append(self.changed)
+            self.num_pending += len(self.changed)
+
+    def pack(self, rejected):
+        # int32 ids cost 4 bytes per rejected row, the bitset 1/8 byte per row
+        if len(rejected) * 32 < self.num_sample:
+            return ('ids', np.sort(rejected).astype(np.int32 if self.num_sample < 2**31 else np.int64))
+        mask = np.zeros(self.num_sample, dtype=bool)
+        mask[rejected] = True
+        return ('bits', np.packbits(mask))
+
+    def unpack(self, action):
+        kind, data = action
+        if kind == 'ids':
+            return data.astype(np.int64)
+        # Only the non-zero bytes are unpacked: a bitset rejects at least 1/32 of the rows
+        nonzero = np.flatnonzero(data)
+        bits = np.unpackbits(data[nonzero]).reshape(-1, 8).astype(bool)
+        return (nonzero[:,None] * 8 + np.arange(8))[bits]
+
+def count_query(query, get_column, rows, chunk_size=262144, cancelled=None, get_datetime=None):
+    '''
+    Description:
+    Count the rows kept by a compiled query, chunk by chunk so that a running count can be
+    abandoned between two chunks
+
+    Parameters:
+    query:      tuple              - the output of compile_query
+    get_column: callable           - see evaluate_query
+    rows:       np.ndarray of int  - positional indices of the candidate rows
+    chunk_size: int                - number of rows evaluated at once
+    cancelled:  callable           - returns True when the count should be abandoned
+    get_datetime: callable         - see evaluate_query
+
+    Output:
+    num_kept:   int                - number of kept rows, None if cancelled
+    '''
+    rows = np.asarray(rows).reshape(-1,)
+    num_kept = 0
+    for start in range(0, len(rows), chunk_size):
+        if cancelled != None and cancelled():
+            return None
+        num_kept += int(np.sum(evaluate_query(query, get_column, rows[start:start+chunk_size], get_datetime)))
+    return num_kept
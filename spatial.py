@@ -0,0 +1,136 @@
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+def find_coordinate_columns(columns):
+    '''
+    Description:
+    Find the latitude/longitude columns of a DataFrame, e.g. 'latitude'/'longitude' in the
+    SacramentoCrime files
+
+    Parameters:
+    columns: list of str - the column names
+
+    Output:
+    lat_idx, lon_idx: int - positions of the two columns, None if not found
+    '''
+    names = [str(col).strip().lower() for col in columns]
+    lat_idx = None
+    lon_idx = None
+    for name in ['latitude', 'lat']:
+        if name in names:
+            lat_idx = names.index(name)
+            break
+    for name in ['longitude', 'lon', 'lng', 'long']:
+        if name in names:
+            lon_idx = names.index(name)
+            break
+    return lat_idx, lon_idx
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    '''
+    Description:
+    Great-circle distance in kilometres, vectorized over numpy arrays
+    '''
+    lat1, lon1, lat2, lon2 = [np.radians(np.asarray(x, dtype=float)) for x in [lat1, lon1, lat2, lon2]]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+def radius_bounding_box(lat, lon, radius_km):
+    '''
+    Description:
+    A (lat_min, lat_max, lon_min, lon_max) box containing every point within radius_km of
+    (lat, lon)
+    '''
+    dlat = np.degrees(radius_km / EARTH_RADIUS_KM)
+    coslat = np.cos(np.radians(min(abs(lat) + dlat, 90.0)))
+    if coslat < 1e-12:
+        dlon = 180.0
+    else:
+        dlon = min(180.0, np.degrees(radius_km / (EARTH_RADIUS_KM * coslat)))
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+def box_mask(lat, lon, lat_min, lat_max, lon_min, lon_max):
+    '''
+    Description:
+    Whether each point lies in the box (bounds included); False for missing coordinates
+    '''
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    with np.errstate(invalid='ignore'):
+        return (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+
+def radius_mask(lat, lon, center_lat, center_lon, radius_km):
+    '''
+    Description:
+    Whether each point lies within radius_km of the center; False for missing coordinates
+    '''
+    with np.errstate(invalid='ignore'):
+        return haversine_km(lat, lon, center_lat, center_lon) <= radius_km
+
+class GridIndex(object):
+    '''
+    Description:
+    A uniform grid over the valid (lat, lon) points. The row ids are stored sorted by grid
+    cell (CSR layout: cell k holds rows[offsets[k]:offsets[k+1]]), so a box query only visits
+    the cells overlapping the box and filters the points of those cells exactly.
+
+    Parameters:
+    lat, lon:       array-like - coordinates of every row, NaN/non-numerical for missing
+    points_per_cell int        - average number of points per (non-empty) grid cell
+    '''
+    def __init__(self, lat, lon, points_per_cell=8):
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        self.valid = ~(np.isnan(self.lat) | np.isnan(self.lon))
+        valid_rows = np.flatnonzero(self.valid)
+        self.side = max(1, int(np.sqrt(len(valid_rows) / points_per_cell)))
+        if len(valid_rows) == 0:
+            self.lat0, self.lon0, self.cell_lat, self.cell_lon = 0.0, 0.0, 1.0, 1.0
+        else:
+            self.lat0 = self.lat[valid_rows].min()
+            self.lon0 = self.lon[valid_rows].min()
+            self.cell_lat = max(self.lat[valid_rows].max() - self.lat0, 1e-12) / self.side
+            self.cell_lon = max(self.lon[valid_rows].max() - self.lon0, 1e-12) / self.side
+        cells = self.cell_of(self.lat[valid_rows], self.lon[valid_rows])
+        order = np.argsort(cells, kind='stable')
+        self.rows = valid_rows[order]
+        self.offsets = np.zeros(self.side * self.side + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=self.side * self.side), out=self.offsets[1:])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def cell_of(self, lat, lon):
+        y = np.clip(((lat - self.lat0) / self.cell_lat).astype(np.int64), 0, self.side - 1)
+        x = np.clip(((lon - self.lon0) / self.cell_lon).astype(np.int64), 0, self.side - 1)
+        return y * self.side + x
+
+    def candidates(self, lat_min, lat_max, lon_min, lon_max):
+        # Rows of all the cells overlapping the box
+        if len(self.rows) == 0 or lat_min > lat_max or lon_min > lon_max:
+            return np.zeros(0, dtype=np.int64)
+        lat_hi = self.lat0 + self.cell_lat * self.side
+        lon_hi = self.lon0 + self.cell_lon * self.side
+        if lat_max < self.lat0 or lat_min > lat_hi or lon_max < self.lon0 or lon_min > lon_hi:
+            return np.zeros(0, dtype=np.int64)
+        y0, y1 = [int(np.clip((v - self.lat0) // self.cell_lat, 0, self.side - 1)) for v in [lat_min, lat_max]]
+        x0, x1 = [int(np.clip((v - self.lon0) // self.cell_lon, 0, self.side - 1)) for v in [lon_min, lon_max]]
+        slices = [self.rows[self.offsets[y * self.side + x0]:self.offsets[y * self.side + x1 + 1]] for y in range(y0, y1 + 1)]
+        return np.concatenate(slices)
+
+    def query_box(self, lat_min, lat_max, lon_min, lon_max):
+        '''
+        Sorted ids of the rows inside the box (bounds included)
+        '''
+        rows = self.candidates(lat_min, lat_max, lon_min, lon_max)
+        rows = rows[box_mask(self.lat[rows], self.lon[rows], lat_min, lat_max, lon_min, lon_max)]
+        return np.sort(rows)
+
+    def query_radius(self, center_lat, center_lon, radius_km):
+        '''
+        Sorted ids of the rows within radius_km (great-circle distance) of the center
+        '''
+        rows = self.candidates(*radius_bounding_box(center_lat, center_lon, radius_km))
+        rows = rows[radius_mask(self.lat[rows], self.lon[rows], center_lat, center_lon, radius_km)]
+        return np.sort(rows)
@@ -0,0 +1,388 @@
+import threading
+import numpy as np
+import pandas as pd
+
+class MissingStats(object):
+    '''
+    Description:
+    Null counts of the raw data, computed once per column and per block of rows, then kept
+    up to date incrementally:
+    (1) a selection only subtracts (or, undone, adds back) the counts of the rows it removes;
+        the fully removed blocks are taken from the block counts, the other rows are scanned
+    (2) deleting a column only drops it from the sums, see summary
+    (3) transforming a column to categorical keeps its missing values missing and the others
+        not, so its counts are unchanged
+
+    Parameters:
+    df:         pd.DataFrame - the raw data, never modified
+    block_size: int          - number of rows per block
+    '''
+    def __init__(self, df, block_size=1024):
+        self.df = df
+        self.block_size = block_size
+        num_row, num_col = df.shape
+        isnull = df.isnull().to_numpy()
+        if num_row == 0:
+            self.block_counts = np.zeros((0, num_col), dtype=np.int64)
+        else:
+            self.block_counts = np.add.reduceat(isnull, np.arange(0, num_row, block_size), axis=0).astype(np.int64)
+        # Null counts of each column over the selected rows
+        self.counts = self.block_counts.sum(axis=0)
+        self.num_row = num_row
+
+    def rows_counts(self, rows):
+        '''
+        Per-column null counts over the given (distinct) row positions
+        '''
+        rows = np.asarray(rows, dtype=np.int64).reshape(-1,)
+        counts = np.zeros(self.df.shape[1], dtype=np.int64)
+        if len(rows) == 0:
+            return counts
+        blocks, inverse, sizes = np.unique(rows // self.block_size, return_inverse=True, return_counts=True)
+        block_lengths = np.minimum(self.block_size, self.df.shape[0] - blocks * self.block_size)
+        full = sizes == block_lengths
+        counts += self.block_counts[blocks[full]].sum(axis=0)
+        partial = rows[~full[inverse]]
+        if len(partial) > 0:
+            counts += self.df.iloc[np.sort(partial)].isnull().sum(axis=0).to_numpy()
+        return counts
+
+    def remove(self, rows):
+        '''
+        The rows left the selection
+        '''
+        self.counts -= self.rows_counts(rows)
+        self.num_row -= len(rows)
+
+    def add(self, rows):
+        '''
+        The rows came back to the selection
+        '''
+        self.counts += self.rows_counts(rows)
+        self.num_row += len(rows)
+
+    def summary(self, FeatureDeleteFlag):
+        '''
+        Description:
+        The Page 3 header over the selected rows and the kept columns, in O(columns)
+
+        Output:
+        MissingRate: float - percentage of missing cells
+        num_row:     int   - number of selected rows
+        num_col:     int   - number of kept columns
+        '''
+        kept = ~np.asarray(FeatureDeleteFlag, dtype=bool)
+        num_col = int(kept.sum())
+        if self.num_row == 0 or num_col == 0:
+            return 0.0, self.num_row, num_col
+        return 100 * self.counts[kept].sum() / (self.num_row * num_col), self.num_row, num_col
+
+class HyperLogLog(object):
+    '''
+    Description:
+    Mergeable distinct-count sketch: 2^p one-byte registers whatever the number of values,
+    with a relative error of about 1.04/sqrt(2^p)
+
+    Parameters:
+    p: int - number of index bits
+    '''
+    def __init__(self, p=12):
+        self.p = p
+        self.registers = np.zeros(2**p, dtype=np.uint8)
+
+    def add(self, values):
+        '''
+        values: pd.Series, missing values included or not
+        '''
+        if len(values) == 0:
+            return
+        hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+        idx = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = hashes & np.uint64(2**(64 - self.p) - 1)
+        # rank = position of the leftmost 1-bit of the remaining 64-p bits, exact through frexp
+        _, bit_length = np.frexp(rest.astype(np.float64))
+        rank = (64 - self.p - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, idx, rank)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(2.0 ** -self.registers.astype(np.float64))
+        zeros = np.sum(self.registers == 0)
+        if estimate <= 2.5 * m and zeros > 0:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+class QuantileSketch(object):
+    '''
+    Description:
+    Mergeable quantile sketch made of compactors: the items of level h stand for 2^h values,
+    and a full level is sorted and every other item (from a random offset) is promoted to the
+    next level. The memory stays within about k items per level, i.e. O(k log(n/k)).
+
+    Parameters:
+    k:    int - capacity of each level
+    seed: int
+    '''
+    def __init__(self, k=1024, seed=0):
+        self.k = k
+        self.levels = [np.zeros(0)]
+        self.count = 0
+        # The extremes are kept exactly, compactions may drop them
+        self.min = np.inf
+        self.max = -np.inf
+        self.rng = np.random.default_rng(seed)
+
+    def add(self, values):
+        '''
+        values: np.ndarray of float, without missing values
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) > 0:
+            self.min = min(self.min, values.min())
+            self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.count += len(values)
+        self.compress()
+
+    def merge(self, other):
+        for h in range(len(other.levels)):
+            if h == len(self.levels):
+                self.levels.append(np.zeros(0))
+            self.levels[h] = np.concatenate([self.levels[h], other.levels[h]])
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress()
+
+    def compress(self):
+        h = 0
+        while h < len(self.levels):
+            if len(self.levels[h]) > self.k:
+                items = np.sort(self.levels[h])
+                # An odd item out stays at its level, so that no weight is lost
+                kept = items[len(items) - len(items) % 2:]
+                items = items[:len(items) - len(items) % 2]
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.zeros(0))
+                self.levels[h+1] = np.concatenate([self.levels[h+1], items[self.rng.integers(2)::2]])
+                self.levels[h] = kept
+            h += 1
+
+    def weighted_items(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0**h) for h, level in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        return items[order], weights[order]
+
+    def quantiles(self, qs):
+        '''
+        Approximate quantiles, NaN when the sketch is empty
+        '''
+        items, weights = self.weighted_items()
+        if len(items) == 0:
+            return [np.nan for _ in qs]
+        cumulative = np.cumsum(weights)
+        positions = np.searchsorted(cumulative, np.asarray(qs) * cumulative[-1], side='left')
+        quantiles = list(items[np.minimum(positions, len(items) - 1)])
+        return [self.min if q == 0 else self.max if q == 1 else value for q, value in zip(qs, quantiles)]
+
+    def histogram(self, num_bins=10):
+        '''
+        Approximate histogram over [min, max] of the sketched values: (counts, bin edges)
+        '''
+        items, weights = self.weighted_items()
+        if len(items) == 0:
+            return np.zeros(0), np.zeros(0)
+        counts, edges = np.histogram(items, bins=num_bins, range=(self.min, self.max), weights=weights)
+        return np.round(counts).astype(np.int64), edges
+
+class FrequentItems(object):
+    '''
+    Description:
+    Mergeable Misra-Gries summary of the most frequent values: at most capacity counters, each
+    count underestimating the true one by at most n/(capacity+1)
+
+    Parameters:
+    capacity: int - number of counters
+    '''
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.counters = {}
+
+    def add(self, values):
+        self.merge_counts(values.value_counts(dropna=True).to_dict())
+
+    def merge(self, other):
+        self.merge_counts(other.counters)
+
+    def merge_counts(self, counts):
+        counters = dict(self.counters)
+        for value, count in counts.items():
+            counters[value] = counters.get(value, 0) + count
+        if len(counters) > self.capacity:
+            threshold = sorted(counters.values(), reverse=True)[self.capacity]
+            counters = dict([(value, count - threshold) for value, count in counters.items() if count > threshold])
+        self.counters = counters
+
+    def top(self, num_top=5):
+        return sorted(self.counters.items(), key=lambda item: item[1], reverse=True)[:num_top]
+
+class ColumnProfile(object):
+    '''
+    Description:
+    Streaming profile of a column, of fixed size whatever the number of rows: exact row and
+    missing counts, and the distinct count, top values and (numerical columns) quantiles and
+    histogram through mergeable sketches
+    '''
+    def __init__(self, numerical):
+        self.numerical = numerical
+        self.num_row = 0
+        self.num_missing = 0
+        self.distinct = HyperLogLog()
+        self.frequent = FrequentItems()
+        self.quantile = QuantileSketch() if numerical else None
+
+    def add(self, values):
+        valid = values.dropna()
+        self.num_row += len(values)
+        self.num_missing += len(values) - len(valid)
+        self.distinct.add(valid)
+        self.frequent.add(valid)
+        if self.numerical:
+            self.quantile.add(valid.to_numpy(dtype=np.float64))
+
+    def merge(self, other):
+        self.num_row += other.num_row
+        self.num_missing += other.num_missing
+        self.distinct.merge(other.distinct)
+        self.frequent.merge(other.frequent)
+        if self.numerical:
+            self.quantile.merge(other.quantile)
+
+    def summary(self, num_top=5, num_bins=10):
+        '''
+        Output:
+        summary: dict - rows, missing share (%), distinct, top values [(value, count)] and, for
+                        numerical columns, quantiles {q: value} and histogram (counts, edges)
+        '''
+        summary = {'rows': self.num_row,
+                   'missing': 0.0 if self.num_row == 0 else 100 * self.num_missing / self.num_row,
+                   'distinct': min(self.distinct.count(), self.num_row - self.num_missing),
+                   'top': self.frequent.top(num_top)}
+        if self.numerical:
+            qs = [0, 0.25, 0.5, 0.75, 1]
+            summary['quantiles'] = dict(zip(qs, self.quantile.quantiles(qs)))
+            summary['histogram'] = self.quantile.histogram(num_bins)
+        return summary
+
+class ColumnProfiler(object):
+    '''
+    Description:
+    Profiles of a column under any row selection. The column is cut into blocks whose
+    profiles are computed once and merged; after a selection, only the blocks it cuts through
+    are profiled again, on their selected rows. Profiles may be requested from several threads:
+    they are computed one at a time.
+
+    Parameters:
+    values:     pd.Series - the column, as displayed (class codes for a transformed column)
+    block_size: int       - number of rows per block
+    '''
+    def __init__(self, values, block_size=65536):
+        self.values = values
+        self.block_size = block_size
+        self.numerical = pd.api.types.is_numeric_dtype(values.dtype)
+        self.blocks = {}
+        self.lock = threading.Lock()
+
+    def block_profile(self, b):
+        if b not in self.blocks:
+            profile = ColumnProfile(self.numerical)
+            profile.add(self.values.iloc[b*self.block_size:(b+1)*self.block_size])
+            self.blocks[b] = profile
+        return self.blocks[b]
+
+    def profile(self, rows=None, cancelled=None):
+        '''
+        Description:
+        The profile of the selected rows
+
+        Parameters:
+        rows:      np.ndarray - sorted positions of the selected rows, None for all
+        cancelled: callable   - polled between blocks, stops early when it returns True
+
+        Output:
+        profile:   ColumnProfile, None when cancelled
+        '''
+        with self.lock:
+            return self.merged_profile(rows, cancelled)
+
+    def merged_profile(self, rows, cancelled):
+        num_row = len(self.values)
+        rows = np.arange(num_row) if rows is None else np.asarray(rows, dtype=np.int64)
+        bounds = np.searchsorted(rows, np.arange(0, num_row + self.block_size, self.block_size))
+        profile = ColumnProfile(self.numerical)
+        for b in range(len(bounds) - 1):
+            if cancelled != None and cancelled():
+                return None
+            lo, hi = bounds[b], bounds[b+1]
+            if hi == lo:
+                continue
+            if hi - lo == min(self.block_size, num_row - b*self.block_size):
+                profile.merge(self.block_profile(b))
+            else:
+                partial = ColumnProfile(self.numerical)
+                partial.add(self.values.iloc[rows[lo:hi]])
+                profile.merge(partial)
+        return profile
+
+def pairwise_statistics(df, block_size=65536):
+    '''
+    Description:
+    NaN-aware pairwise Pearson correlations of the numerical columns (each pair over the rows
+    where both values are present, as DataFrame.corr) and co-missingness counts of all the
+    columns, accumulated over blocks of rows with matrix products
+
+    Parameters:
+    df:         pd.DataFrame
+    block_size: int - number of rows per block
+
+    Output:
+    correlation: pd.DataFrame - numerical columns x numerical columns, NaN for fewer than 2 pairs
+    comissing:   pd.DataFrame - columns x columns, number of rows where both values are missing
+                                (the diagonal holds the missing count of each column)
+    '''
+    num_row, num_col = df.shape
+    numerical = [j for j in range(num_col) if pd.api.types.is_numeric_dtype(df.iloc[:,j].dtype)]
+    # Centering first keeps the sums of squares accurate
+    means = np.nan_to_num(np.array([df.iloc[:,j].mean() for j in numerical], dtype=np.float64))
+    k = len(numerical)
+    pairs = np.zeros((k, k))
+    sums = np.zeros((k, k))
+    squares = np.zeros((k, k))
+    products = np.zeros((k, k))
+    comissing = np.zeros((num_col, num_col))
+    for start in range(0, num_row, block_size):
+        block = df.iloc[start:start+block_size]
+        missing = block.isnull().to_numpy(dtype=np.float64)
+        comissing += missing.T @ missing
+        values = block.iloc[:, numerical].to_numpy(dtype=np.float64, na_value=np.nan) - means
+        valid = ~np.isnan(values)
+        present = valid.astype(np.float64)
+        values = np.where(valid, values, 0.0)
+        # sums[i, j] is the sum of column i over the rows where columns i and j are both present
+        pairs += present.T @ present
+        sums += values.T @ present
+        squares += (values * values).T @ present
+        products += values.T @ values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = products - sums * sums.T / pairs
+        variance = (squares - sums * sums / pairs) * (squares.T - sums.T * sums.T / pairs)
+        correlation = np.clip(covariance / np.sqrt(variance), -1, 1)
+    correlation[pairs < 2] = np.nan
+    names = df.columns[numerical]
+    return (pd.DataFrame(correlation, index=names, columns=names),
+            pd.DataFrame(comissing.astype(np.int64), index=df.columns, columns=df.columns))
@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+import knn
+
+def test_knn_impute_disjoint_missing_columns():
+    # 'a' is missing on the even rows and 'b' on the odd rows: no row is complete in both
+    rng = np.random.default_rng(0)
+    num_row = 200
+    df = pd.DataFrame({'latitude': rng.random(num_row), 'longitude': rng.random(num_row),
+                       'a': np.arange(num_row, dtype=np.float64), 'b': np.where(np.arange(num_row) % 4 < 2, 'x', 'y').astype(object)})
+    df.loc[::2, 'a'] = np.nan
+    df.loc[1::2, 'b'] = None
+    imputed = knn.knn_impute(df, k=1, workers=1)
+    assert imputed.isnull().sum().sum() == 0
+    # With one neighbour, every value is copied from the nearest row having a value for the column
+    points = df[['latitude', 'longitude']].to_numpy()
+    for column in ['a', 'b']:
+        donors = np.flatnonzero(df[column].notnull().to_numpy())
+        for row in np.flatnonzero(df[column].isnull().to_numpy()):
+            nearest = donors[np.argmin(((points[donors] - points[row])**2).sum(axis=1))]
+            assert imputed[column].iloc[row] == df[column].iloc[nearest]
@@ -0,0 +1,23 @@
+import json
+import pandas as pd
+import pipeline
+
+def replay(df, recipe):
+    session = pipeline.PreprocessSession(df)
+    session.apply_recipe(recipe)
+    return session.preprocessed()
+
+def test_recipe_selects_same_classes_on_reordered_extract(tmp_path):
+    first = pd.DataFrame({'beat': ['3A', '1B', '2C', '3A', '1B'], 'grid': [1, 2, 3, 4, 5]})
+    second = pd.DataFrame({'beat': ['2C', '1B', '3A', '2C', '3A'], 'grid': [6, 7, 8, 9, 10]})
+    # The step is written on the codes of the first extract: '3A' -> 0, '1B' -> 1, '2C' -> 2
+    classes = pipeline.transform_classes(pipeline.build_transform_dict(first['beat']))
+    recipe = [{'action': 'Transform', 'column': 'beat'},
+              {'action': 'Select', 'column': 'beat', 'method': 'Condition', 'condition': 'Not Equal', 'value': '1', 'classes': {'beat': classes}},
+              {'action': 'Query', 'query': 'beat >= 1', 'classes': {'beat': classes}}]
+    recipefile = str(tmp_path / 'recipe.json')
+    pipeline.save_recipe(recipe, recipefile)
+    recipe = pipeline.load_recipe(recipefile)
+    # Both drop '1B' then '3A', whatever their codes in each extract
+    assert replay(first, recipe)['grid'].tolist() == [3]
+    assert replay(second, recipe)['grid'].tolist() == [6, 9]
@@ -0,0 +1,203 @@
+import re
+import numpy as np
+import pandas as pd
+
+NAT = np.iinfo(np.int64).min
+NS_PER_HOUR = 3600 * 10**9
+NS_PER_DAY = 24 * NS_PER_HOUR
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+# Candidate formats, tried in order; the SacramentoCrime files use '%m/%d/%Y %H:%M'
+DATETIME_FORMATS = ['%m/%d/%Y %H:%M', '%m/%d/%Y %H:%M:%S', '%m/%d/%Y', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M',
+                    '%Y-%m-%d', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d %H:%M', '%Y/%m/%d', '%d/%m/%Y %H:%M',
+                    '%d/%m/%Y %H:%M:%S', '%d/%m/%Y', '%Y-%m-%dT%H:%M:%S', '%m/%d/%y %H:%M', '%m/%d/%y']
+
+# Inferred formats, keyed by the layouts (digits replaced by '9') of the sampled values
+_FORMAT_CACHE = {}
+
+def infer_datetime_format(values, num_sample=200):
+    '''
+    Description:
+    Infer the format of a column of date/time strings from a sample of its non-missing values.
+    The result is cached by the layout of the sampled values, so columns and files written the
+    same way only go through the inference once.
+
+    Parameters:
+    values:     pd.Series - the raw column
+    num_sample: int       - number of non-missing values which have to parse
+
+    Output:
+    fmt:        str       - a strptime format, None if no candidate fits
+    '''
+    sample = values.dropna()
+    if len(sample) == 0:
+        return None
+    # Evenly spread over the column rather than its head only
+    sample = sample.iloc[np.linspace(0, len(sample) - 1, min(num_sample, len(sample))).astype(int)].astype(str)
+    key = frozenset([re.sub(r'\d', '9', text.strip()) for text in sample])
+    if key in _FORMAT_CACHE:
+        return _FORMAT_CACHE[key]
+    fmt = None
+    for candidate in DATETIME_FORMATS:
+        try:
+            pd.to_datetime(sample.str.strip(), format=candidate, errors='raise')
+            fmt = candidate
+            break
+        except (ValueError, TypeError):
+            continue
+    _FORMAT_CACHE[key] = fmt
+    return fmt
+
+def parse_datetime(values, fmt=None):
+    '''
+    Description:
+    Parse a column of date/time strings into int64 nanosecond timestamps (NAT for missing or
+    unparsable values)
+
+    Output:
+    timestamps: np.ndarray of int64
+    fmt:        str - the format used
+    '''
+    if fmt == None:
+        fmt = infer_datetime_format(values)
+        if fmt == None:
+            raise ValueError("The column does not look like a date/time column!")
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        parsed = values
+    else:
+        parsed = pd.to_datetime(values.astype(str).str.strip(), format=fmt, errors='coerce')
+    return np.asarray(parsed.to_numpy(dtype='datetime64[ns]')).view(np.int64), fmt
+
+def parse_bound(text, end=False):
+    '''
+    Description:
+    Parse a user-specified time bound, None for an empty text. An end bound given as a bare
+    date covers that whole day.
+    '''
+    text = text.strip()
+    if text == '':
+        return None
+    try:
+        bound = pd.Timestamp(text)
+    except ValueError:
+        raise ValueError("Cannot understand the date/time '%s'!" % text)
+    if end and ':' not in text:
+        return bound.value + NS_PER_DAY - 1
+    return bound.value
+
+def parse_hours(text):
+    '''
+    Description:
+    Parse an hour-of-day specification such as '8-17' or '0-5,22,23'; None for an empty text.
+    A range wraps around midnight when its start exceeds its end ('22-5').
+    '''
+    return _parse_ranges(text, 24, lambda word: int(word), "hour")
+
+def parse_weekdays(text):
+    '''
+    Description:
+    Parse a day-of-week specification such as 'Mon-Fri' or 'Sat,Sun' (Monday = 0);
+    None for an empty text
+    '''
+    def day(word):
+        word = word.strip().lower()
+        if word[:3] in WEEKDAYS:
+            return WEEKDAYS.index(word[:3])
+        return int(word)
+    return _parse_ranges(text, 7, day, "day of week")
+
+def _parse_ranges(text, period, convert, name):
+    text = text.strip()
+    if text == '':
+        return None
+    selected = np.zeros(period, dtype=bool)
+    for part in text.split(','):
+        try:
+            bounds = [convert(word) for word in part.split('-')]
+        except (ValueError, IndexError):
+            raise ValueError("Cannot understand the %s '%s'!" % (name, part.strip()))
+        if len(bounds) == 1:
+            bounds = bounds * 2
+        if len(bounds) != 2 or min(bounds) < 0 or max(bounds) >= period:
+            raise ValueError("Cannot understand the %s '%s'!" % (name, part.strip()))
+        if bounds[0] <= bounds[1]:
+            selected[bounds[0]:bounds[1]+1] = True
+        else:
+            selected[bounds[0]:] = True
+            selected[:bounds[1]+1] = True
+    return selected
+
+def hour_of_day(timestamps):
+    return (timestamps // NS_PER_HOUR) % 24
+
+def day_of_week(timestamps):
+    # 1970-01-01 was a Thursday
+    return (timestamps // NS_PER_DAY + 3) % 7
+
+def time_mask(timestamps, start=None, end=None, hours=None, weekdays=None):
+    '''
+    Description:
+    Vectorized time-window selection: the timestamp lies in [start, end], its hour is one of
+    the selected hours and its day of week is one of the selected days. Missing timestamps
+    (NAT) are never matched.
+
+    Parameters:
+    timestamps: np.ndarray of int64 - the output of parse_datetime
+    start, end: int                 - bounds in ns, None for no bound
+    hours:      np.ndarray of bool  - 24 flags, None for every hour
+    weekdays:   np.ndarray of bool  - 7 flags, None for every day
+    '''
+    mask = timestamps != NAT
+    if start != None:
+        mask &= timestamps >= start
+    if end != None:
+        mask &= timestamps <= end
+    if hours is not None:
+        mask &= hours[hour_of_day(timestamps)]
+    if weekdays is not None:
+        mask &= weekdays[day_of_week(timestamps)]
+    return mask
+
+class DatetimeColumn(object):
+    '''
+    Description:
+    A date/time column parsed once into int64 timestamps, together with a sorted time index
+    (built lazily) so that date ranges are answered by binary search
+
+    Parameters:
+    values: pd.Series - the raw column, e.g. cdatetime = '1/1/2006 0:00'
+    fmt:    str       - the format, inferred when None
+    '''
+    def __init__(self, values, fmt=None):
+        self.timestamps, self.format = parse_datetime(values, fmt)
+        self.missing = np.asarray(values.isnull())
+        self.order = None
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def sorted_index(self):
+        if self.order is None:
+            valid = np.flatnonzero(self.timestamps != NAT)
+            self.order = valid[np.argsort(self.timestamps[valid], kind='stable')]
+            self.sorted_timestamps = self.timestamps[self.order]
+        return self.order, self.sorted_timestamps
+
+    def range_rows(self, start=None, end=None):
+        '''
+        Sorted ids of the rows with start <= timestamp <= end
+        '''
+        order, sorted_timestamps = self.sorted_index()
+        lo = 0 if start == None else np.searchsorted(sorted_timestamps, start, side='left')
+        hi = len(order) if end == None else np.searchsorted(sorted_timestamps, end, side='right')
+        return np.sort(order[lo:hi])
+
+    def query(self, start=None, end=None, hours=None, weekdays=None):
+        '''
+        Sorted ids of the rows matching the time window; the date range goes through the
+        sorted index and the hour/day filters only look at the rows inside the range
+        '''
+        rows = self.range_rows(start, end)
+        if hours is not None or weekdays is not None:
+            rows = rows[time_mask(self.timestamps[rows], hours=hours, weekdays=weekdays)]
+        return rows